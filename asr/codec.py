@@ -0,0 +1,218 @@
+import os
+import sys
+import logging
+import time
+import threading
+from collections import deque
+from typing import Optional, List
+from dsp import AudioConverter
+try:
+    import fcntl
+    import termios
+    outq_available = hasattr(termios, "TIOCOUTQ")
+except ImportError:
+    outq_available = False
+try:
+    import lameenc
+    lameenc_available = True
+except ImportError:
+    lameenc_available = False
+
+logger = logging.getLogger()
+
+
+class UploadCodec:
+    # 上传编码：输入 16k 单声道 S16 PCM，输出 iat 接口 data.format/data.encoding 对应的字节流
+    name = "pcm16k"
+    rate = 16000
+    encoding = "raw"
+    frame_size = 1280  # 每一帧发送的字节数
+    wire_rate = 32000 * 4 / 3  # base64 之后每秒音频的大致字节数
+
+    @property
+    def format(self) -> str:
+        return f"audio/L16;rate={self.rate}"
+
+    def reset(self) -> None:
+        pass
+
+    def encode(self, pcm: bytes) -> bytes:
+        return pcm
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class Downsample8kCodec(UploadCodec):
+    # 16k -> 8k：加窗 sinc 低通后 2:1 抽取，跨块保留滤波器历史，流式处理无接缝
+    name = "pcm8k"
+    rate = 8000
+    frame_size = 640
+    wire_rate = 16000 * 4 / 3
+
+    def __init__(self, taps: int = 63, cutoff: float = 3600):
+        self.converter = AudioConverter(16000, 8000, taps=taps, cutoff=cutoff)
+        self.reset()
+
+    def reset(self) -> None:
+        self.converter.reset()
+
+    def encode(self, pcm: bytes) -> bytes:
+        return self.converter.convert(pcm)
+
+
+class Mp3Codec(UploadCodec):
+    # iat 接口 encoding=lame 接受 mp3，需要可选依赖 lameenc
+    name = "mp3"
+    encoding = "lame"
+
+    def __init__(self, bit_rate: int = 32):
+        self.bit_rate = bit_rate
+        self.wire_rate = bit_rate * 1000 / 8 * 4 / 3
+        self.reset()
+
+    def reset(self) -> None:
+        self.encoder = lameenc.Encoder()
+        self.encoder.set_bit_rate(self.bit_rate)
+        self.encoder.set_in_sample_rate(16000)
+        self.encoder.set_channels(1)
+        self.encoder.set_quality(7)
+
+    def encode(self, pcm: bytes) -> bytes:
+        return bytes(self.encoder.encode(pcm))
+
+    def flush(self) -> bytes:
+        return bytes(self.encoder.flush())
+
+
+def available_codecs() -> List[UploadCodec]:
+    # 按音质从高到低排列
+    codecs = [UploadCodec(), Downsample8kCodec()]
+    if lameenc_available:
+        codecs.append(Mp3Codec())
+    return codecs
+
+
+class ThroughputMeter:
+    # 估计上行带宽：读取 socket 发送队列里尚未被确认的字节数(TIOCOUTQ)，
+    # 只有队列积压时测到的送达速率才是链路上限，否则只是下限。
+    # 录音是实时的，换成低码率编码后发送速率永远到不了高码率编码的门槛，估计只会被拉低；
+    # 连续 recover_turns 轮或 recover_seconds 秒没有积压，就忘掉估计，下一轮重新试最高音质
+    def __init__(self, window: float = 2.0, backlog_bytes: int = 8192, alpha: float = 0.3,
+                 recover_turns: int = 3, recover_seconds: float = 300):
+        self.window = window
+        self.backlog_bytes = backlog_bytes
+        self.alpha = alpha
+        self.recover_turns = recover_turns
+        self.recover_seconds = recover_seconds
+        self.capacity: Optional[float] = None
+        self.samples = deque()
+        self.sent = 0
+        self.saturated_at = 0.0
+        self.turn_saturated = False
+        self.clean_turns = 0
+        self.lock = threading.Lock()
+
+    def reset(self) -> None:
+        # 每轮开始时调用，上一轮发过数据且没有积压就记一轮
+        with self.lock:
+            if self.sent and not self.turn_saturated:
+                self.clean_turns += 1
+            self.turn_saturated = False
+            self.samples.clear()
+            self.sent = 0
+
+    @staticmethod
+    def unacked_bytes(sock) -> Optional[int]:
+        if not outq_available or sock is None:
+            return None
+        try:
+            buf = fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b"\0\0\0\0")
+            return int.from_bytes(buf, sys.byteorder, signed=True)
+        except (OSError, ValueError):
+            return None
+
+    def record(self, sent_bytes: int, send_seconds: float, sock=None) -> None:
+        now = time.monotonic()
+        unacked = self.unacked_bytes(sock)
+        with self.lock:
+            self.sent += sent_bytes
+            if unacked is None:
+                # 拿不到发送队列长度时退化为按 send() 阻塞时间估计
+                if send_seconds > 0.005:
+                    self._update(sent_bytes / send_seconds, saturated=True)
+                return
+            delivered = self.sent - unacked
+            self.samples.append((now, delivered))
+            while self.samples and now - self.samples[0][0] > self.window:
+                self.samples.popleft()
+            t0, d0 = self.samples[0]
+            if now - t0 < 0.5:
+                return
+            self._update((delivered - d0) / (now - t0), saturated=unacked > self.backlog_bytes)
+
+    def _update(self, rate: float, saturated: bool) -> None:
+        if saturated:
+            self.saturated_at = time.monotonic()
+            self.turn_saturated = True
+            self.clean_turns = 0
+            self.capacity = rate if self.capacity is None else (1 - self.alpha) * self.capacity + self.alpha * rate
+        elif self.capacity is not None and rate > self.capacity:
+            # 没有积压时的速率只是下限，不会拉低估计
+            self.capacity = rate
+
+    def select(self, codecs: Optional[List[UploadCodec]] = None, headroom: float = 1.5) -> UploadCodec:
+        codecs = codecs or available_codecs()
+        with self.lock:
+            if self.capacity is not None and (self.clean_turns >= self.recover_turns or
+                                              time.monotonic() - self.saturated_at >= self.recover_seconds):
+                logger.info(f"no uplink backlog for {self.clean_turns} turns, probing best codec again")
+                self.capacity = None
+                self.clean_turns = 0
+        if self.capacity is None:
+            return codecs[0]
+        for codec in codecs:
+            if codec.wire_rate * headroom <= self.capacity:
+                return codec
+        return codecs[-1]
+
+
+if __name__ == '__main__':
+    # 用 asr/samples 下的样本比较各编码的上传字节数和识别结果
+    import base64
+    from dotenv import load_dotenv
+    from asr.xf_iat import ASRClient, create_session_manager
+    load_dotenv()
+
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stdout)
+    logger.addHandler(handler)
+
+    samples = os.path.join(os.path.dirname(__file__), "samples")
+    with open(os.path.join(samples, "iat_pcm_16k.pcm"), "rb") as f:
+        pcm = f.read()
+
+    # (名称, 上传编码, 输入数据)：native 样本已经是目标格式，用透传编码只改 format/encoding
+    cases = [(codec.name, codec, pcm) for codec in available_codecs()]
+    native_8k = UploadCodec()
+    native_8k.rate, native_8k.frame_size = 8000, 640
+    with open(os.path.join(samples, "iat_pcm_8k.pcm"), "rb") as f:
+        cases.append(("pcm8k-native", native_8k, f.read()))
+    native_mp3 = UploadCodec()
+    native_mp3.encoding = "lame"
+    with open(os.path.join(samples, "iat_mp3_16k.mp3"), "rb") as f:
+        cases.append(("mp3-native", native_mp3, f.read()))
+
+    sessions = None
+    if os.getenv("asr_api_key"):
+        sessions = create_session_manager(os.getenv("asr_api_key"), os.getenv("asr_api_secret")).start()
+    for name, codec, data in cases:
+        codec.reset()
+        payload = codec.encode(data) + codec.flush()
+        text = ""
+        if sessions:
+            asr = ASRClient(os.getenv("asr_ws_connect_timeout"), os.getenv("asr_app_id"),
+                            os.getenv("asr_api_key"), os.getenv("asr_api_secret"),
+                            session_manager=sessions, codec=codec)
+            text = asr(data, timeout=int(os.getenv("asr_request_timeout", "10")))
+        print(f"{name:14s} bytes={len(payload):7d} wire={len(base64.b64encode(payload)):7d} text={text}")
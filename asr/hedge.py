@@ -0,0 +1,245 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+import numpy as np
+from asr.xf_iat import ASRClient, ASRError
+
+logger = logging.getLogger()
+
+
+class HedgeStats:
+    # 对冲请求的统计，用来调整对冲预算；同时记录首个中间结果的延迟，用于按 p95 推导对冲延迟。
+    # 节省的时间是实测的：每 sample_every 次对冲抽一次，备用连接胜出后不取消主连接，让它跑完(最多
+    # sample_timeout 秒)，记下它比胜出方晚了多久；主连接胜出的对冲节省为 0，超时没跑完的单独计数
+    def __init__(self, window: int = 200, sample_every: int = 5, sample_timeout: float = 10):
+        self.turns = 0
+        self.fired = 0
+        self.won = 0
+        self.sample_every = sample_every
+        self.sample_timeout = sample_timeout
+        self.saved = deque(maxlen=window)
+        self.unfinished = 0
+        self.partial_latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record_saved(self, seconds: Optional[float]) -> None:
+        # None 表示输的一路在 sample_timeout 内没有跑完(或失败)，节省的时间至少是那么多，但量不出来
+        with self.lock:
+            if seconds is None:
+                self.unfinished += 1
+            else:
+                self.saved.append(seconds)
+
+    def record_partial_latency(self, seconds: float) -> None:
+        with self.lock:
+            self.partial_latencies.append(seconds)
+
+    def hedge_delay(self, default: float, min_samples: int = 20, floor: float = 0.3) -> float:
+        with self.lock:
+            if len(self.partial_latencies) < min_samples:
+                return default
+            return max(floor, float(np.percentile(self.partial_latencies, 95)))
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            snapshot = {"turns": self.turns, "fired": self.fired, "won": self.won,
+                        "saved_samples": len(self.saved), "saved_unfinished": self.unfinished}
+            if self.saved:
+                snapshot["saved_mean"] = round(float(np.mean(self.saved)), 3)
+                snapshot["saved_p95"] = round(float(np.percentile(self.saved, 95)), 3)
+            return snapshot
+
+
+class HedgedASR:
+    # 对冲识别：主连接迟迟没有中间结果(或松开按键后迟迟没有最终结果)时，
+    # 在另一条预热连接上重放同样的音频，先拿到最终结果的一方胜出，另一方取消(抽样时让它跑完，量节省的时间)。
+    # 对外接口与 ASRClient 的流式接口一致，VoicePipeline 可以直接使用。
+    # 计时从第一帧音频送进来开始：端点检测在开口前不送音频，按下按键后的停顿不算服务端延迟
+    def __init__(self, client_factory: Callable[..., ASRClient], stats: HedgeStats,
+                 delay: Optional[float] = None, default_delay: float = 1.5,
+                 on_partial: Optional[Callable[[str], None]] = None):
+        self.client_factory = client_factory
+        self.stats = stats
+        self.delay = delay
+        self.default_delay = default_delay
+        self.on_partial = on_partial
+        self.lock = threading.RLock()
+        self.frames: List[bytes] = []
+        self.finished = False
+        self.first_fed_at: Optional[float] = None
+        self.rate = 16000
+        self.future: Future = Future()
+        self.leader: Optional[ASRClient] = None
+        self.timer: Optional[threading.Timer] = None
+        self.secondary: Optional[ASRClient] = None
+        # 抽中测量的对冲：胜出时刻和还在跑的主连接
+        self.sampled = False
+        self.won_at: Optional[float] = None
+        self.loser: Optional[ASRClient] = None
+        self.loser_timer: Optional[threading.Timer] = None
+        self.primary = self._new_client(primary=True)
+        self._watch(self.primary)
+
+    @property
+    def stream_queue(self):
+        # 主连接已经失败时以备用连接的发送队列为准
+        if self.secondary and self.primary.future.done():
+            return self.secondary.stream_queue
+        return self.primary.stream_queue
+
+    @property
+    def hedge_delay(self) -> float:
+        return self.delay if self.delay is not None else self.stats.hedge_delay(self.default_delay)
+
+    def _new_client(self, primary: bool) -> ASRClient:
+        client = None
+
+        def on_partial(text: str) -> None:
+            # 只转发最先给出中间结果的那一路，避免屏幕上两份文本来回跳
+            with self.lock:
+                if self.leader is None:
+                    self.leader = client
+            if self.leader is client and self.on_partial:
+                self.on_partial(text)
+
+        # client_factory(on_partial, primary)：primary 区分主备连接，例如只让主连接参与带宽统计
+        client = self.client_factory(on_partial=on_partial, primary=primary)
+        return client
+
+    def _watch(self, client: ASRClient) -> None:
+        client.future.add_done_callback(lambda f: self._on_done(client, f))
+
+    def start_stream(self, rate: int = 16000) -> Future:
+        with self.lock:
+            self.stats.turns += 1
+        self.rate = rate
+        self.primary.start_stream(rate)
+        return self.future
+
+    def _arm(self, delay: float) -> None:
+        if self.timer:
+            self.timer.cancel()
+        self.timer = threading.Timer(delay, self._check)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _check(self) -> None:
+        # 录音中一直没有中间结果，或录音结束后一直没有最终结果，就发起对冲；
+        # 录音中已经有中间结果说明主连接正常，等松开按键后再检查一次
+        if self.future.done() or self.secondary:
+            return
+        if self.finished or self.primary.first_partial_at is None:
+            self.fire()
+
+    def fire(self) -> None:
+        with self.lock:
+            if self.secondary or self.future.done():
+                return
+            logger.info(f"asr hedge fired {time.monotonic() - (self.first_fed_at or self.primary.started_at):.2f}s "
+                        f"after first audio")
+            with self.stats.lock:
+                self.stats.fired += 1
+                self.sampled = self.stats.sample_every > 0 and (self.stats.fired - 1) % self.stats.sample_every == 0
+            self.secondary = self._new_client(primary=False)
+            self._watch(self.secondary)
+            self.secondary.start_stream(self.rate)
+            for data in self.frames:
+                self.secondary.feed(data)
+            if self.finished:
+                self.secondary.finish()
+
+    def feed(self, audio_data: bytes) -> None:
+        with self.lock:
+            self.frames.append(audio_data)
+            self.primary.feed(audio_data)
+            if self.secondary:
+                self.secondary.feed(audio_data)
+            first = self.first_fed_at is None
+            if first:
+                self.first_fed_at = time.monotonic()
+        if first and not self.future.done():
+            self._arm(self.hedge_delay)
+
+    def finish(self) -> None:
+        with self.lock:
+            self.finished = True
+            self.primary.finish()
+            if self.secondary:
+                self.secondary.finish()
+        if not self.future.done() and not self.secondary:
+            self._arm(self.hedge_delay)
+
+    def _on_done(self, client: ASRClient, future: Future) -> None:
+        with self.lock:
+            if self.future.done():
+                if client is self.loser:
+                    self._record_loser(future)
+                return
+            other = self.secondary if client is self.primary else self.primary
+            if future.exception() is None:
+                if client is self.primary and client.first_partial_at and self.first_fed_at:
+                    self.stats.record_partial_latency(client.first_partial_at - self.first_fed_at)
+                if client is self.secondary:
+                    self.stats.won += 1
+                self.future.set_result(future.result())
+                if self.sampled and client is self.primary:
+                    # 主连接自己先完成，这次对冲没有省下时间
+                    self.stats.record_saved(0.0)
+                elif self.sampled and other.future.done():
+                    # 主连接已经失败，省下的时间量不出来
+                    self.stats.record_saved(None)
+                elif self.sampled:
+                    self.won_at = time.monotonic()
+                    self.loser = other
+                    self.loser_timer = threading.Timer(self.stats.sample_timeout, other.cancel)
+                    self.loser_timer.daemon = True
+                    self.loser_timer.start()
+                elif other:
+                    other.cancel()
+            elif other is not None and not other.future.done():
+                # 另一路还在进行，等它的结果
+                return
+            elif client is self.primary and self.secondary is None and not self.future.done():
+                # 主连接直接报错，不必等计时器，立即对冲
+                logger.info(f"asr primary failed: {future.exception()}, hedging now")
+                self.fire()
+                return
+            else:
+                self.future.set_exception(future.exception())
+        if self.timer:
+            self.timer.cancel()
+
+    def _record_loser(self, future: Future) -> None:
+        self.loser = None
+        if self.loser_timer:
+            self.loser_timer.cancel()
+        self.stats.record_saved(time.monotonic() - self.won_at if future.exception() is None else None)
+
+    def cancel(self) -> None:
+        if self.timer:
+            self.timer.cancel()
+        with self.lock:
+            # 整轮被取消时不再测量，被取消的主连接不算没跑完
+            self.loser = None
+            if self.loser_timer:
+                self.loser_timer.cancel()
+        if not self.future.done():
+            self.future.set_exception(ASRError("cancelled"))
+        self.primary.cancel()
+        if self.secondary:
+            self.secondary.cancel()
+
+    def wait_result(self, timeout: Optional[float] = 20) -> str:
+        try:
+            result = self.future.result(timeout=timeout)
+        except TimeoutError:
+            logger.error(f"hedged asr timeout after {timeout}s")
+            result = ""
+        except Exception as e:
+            logger.error(f"hedged asr failed: {e}")
+            result = ""
+        logger.info(f"return: {result}, hedge stats={self.stats.snapshot()}")
+        return result
@@ -2,30 +2,63 @@ import os
 import sys
 import logging
 import websocket
-import datetime
-import hashlib
 import base64
-import hmac
 import json
-from urllib.parse import urlencode
 import time
-import ssl
-from wsgiref.handlers import format_date_time
-from datetime import datetime
-from time import mktime
-from typing import Union, Any, Optional
+from typing import Union, Any, Optional, Callable
 import threading
+import queue
+from concurrent.futures import Future
+from xfyun.session import Session, SessionManager, create_url
+from asr.codec import UploadCodec, ThroughputMeter
+from replay.session import SessionRecorder
+
+IAT_URL = 'wss://ws-api.xfyun.cn/v2/iat'
 
 STATUS_FIRST_FRAME = 0  # 第一帧的标识
 STATUS_CONTINUE_FRAME = 1  # 中间帧标识
 STATUS_LAST_FRAME = 2  # 最后一帧的标识
+STREAM_CANCEL = object()  # 放入发送队列表示放弃本次识别
 
 
 logger = logging.getLogger()
 
 
+class ASRError(Exception):
+    pass
+
+
+def create_session_manager(api_key: str, api_secret: str, url: str = IAT_URL, **kwargs) -> SessionManager:
+    # url 可以指向本地替身服务(standin)做离线测试
+    return SessionManager("asr", lambda: create_url(url, api_key, api_secret), **kwargs)
+
+
+class Transcript:
+    # 动态修正(dwa=wpgs)：每条结果带序号 sn，pgs=rpl 时用它替换 rg 范围内的旧结果
+    def __init__(self):
+        self.segments: dict[int, str] = {}
+
+    def apply(self, result: dict) -> str:
+        sn: int = result.get("sn", len(self.segments) + 1)
+        if result.get("pgs") == "rpl" and result.get("rg"):
+            start, end = result["rg"]
+            for i in range(start, end + 1):
+                self.segments.pop(i, None)
+        self.segments[sn] = "".join(w["w"] for i in result.get("ws", []) for w in i["cw"])
+        return self.text
+
+    @property
+    def text(self) -> str:
+        return "".join(self.segments[sn] for sn in sorted(self.segments))
+
+
 class ASRClient:
-    def __init__(self, ws_connect_timeout: Union[int, str], app_id: str, api_key: str, api_secret: str):
+    def __init__(self, ws_connect_timeout: Union[int, str], app_id: str, api_key: str, api_secret: str,
+                 session_manager: Optional[SessionManager] = None,
+                 on_partial: Optional[Callable[[str], None]] = None,
+                 codec: Optional[UploadCodec] = None,
+                 throughput: Optional[ThroughputMeter] = None,
+                 recorder: Optional[SessionRecorder] = None):
         if isinstance(ws_connect_timeout, str):
             self.ws_connect_timeout = int(ws_connect_timeout)
         else:
@@ -39,13 +72,29 @@ class ASRClient:
             "language": "zh_cn",
             "accent": "mandarin",
             "vinfo": 1,
-            "vad_eos": 10000
+            "vad_eos": 10000,
+            "dwa": "wpgs"
         }
         self.ws: Optional[websocket.WebSocketApp] = None
-        self.thread_loop = None
+        self.session_manager: Optional[SessionManager] = session_manager
+        self.session: Optional[Session] = None
         self.is_connected: bool = False
         self.result: str = ""
-        self.once_done = False
+        self.transcript = Transcript()
+        # 中间结果回调，参数是当前完整的识别文本(已应用修正)
+        self.on_partial = on_partial
+        self.future: Future = Future()
+        self.connect_done = threading.Event()
+        # 上传编码(默认 16k 原始 PCM)，以及用于自适应选择编码的上行带宽统计
+        self.codec: UploadCodec = codec or UploadCodec()
+        self.throughput = throughput
+        self.stream_queue: Optional[queue.Queue] = None
+        self.stream_rate: int = 16000
+        self.started_at: Optional[float] = None
+        self.first_partial_at: Optional[float] = None
+        # 可选的会话录制，记下服务端返回的原始帧
+        self.recorder = recorder
+        self.record_stream = recorder.stream() if recorder else 0
 
         # 启动守护线程
         self.start_daemon()
@@ -55,34 +104,23 @@ class ASRClient:
             self.ws.close()
 
     def start_daemon(self):
-        if not self.thread_loop:
-            self.thread_loop = threading.Thread(target=self.connect, daemon=True)
-            self.thread_loop.start()
+        # 优先使用预热好的连接，握手不在一轮对话的关键路径上
+        if not self.session:
+            if self.session_manager:
+                self.session = self.session_manager.acquire()
+            else:
+                self.session = Session(self.create_url, "asr").start()
+            self.session.bind(self)
 
     def create_url(self) -> str:
-        url: str = 'wss://ws-api.xfyun.cn/v2/iat'
-        now: datetime = datetime.now()
-        date: str = format_date_time(mktime(now.timetuple()))
-        signature_origin: str = f"host: ws-api.xfyun.cn\n" \
-                                f"date: {date}\n" \
-                                f"GET /v2/iat HTTP/1.1"
-        signature_sha: bytes = hmac.new(self.api_secret.encode('utf-8'), signature_origin.encode('utf-8'),
-                                        digestmod=hashlib.sha256).digest()
-        signature_sha: str = base64.b64encode(signature_sha).decode(encoding='utf-8')
-        authorization_origin: str = f'api_key="{self.api_key}", algorithm="hmac-sha256", headers="host date request-line", signature="{signature_sha}"'
-        authorization: str = base64.b64encode(authorization_origin.encode('utf-8')).decode(encoding='utf-8')
-
-        v: dict[str, str] = {
-            "authorization": authorization,
-            "date": date,
-            "host": "ws-api.xfyun.cn"
-        }
-        return url + '?' + urlencode(v)
+        return create_url(IAT_URL, self.api_key, self.api_secret)
 
     def on_message(self, ws: websocket.WebSocketApp, message: str) -> None:
         try:
             if not message:
                 return
+            if self.recorder:
+                self.recorder.asr_frame(self.record_stream, message)
             response: dict = json.loads(message)
             code: int = response.get("code")
             sid: str = response.get("sid")
@@ -90,120 +128,201 @@ class ASRClient:
             if code != 0:
                 err_msg: str = response.get("message")
                 logger.error(f"sid:{sid} call error:{err_msg} code is:{code}")
+                self._fail(ASRError(f"sid:{sid} code:{code} {err_msg}"))
             else:
-                data: list = response["data"]["result"]["ws"]
-                logger.info(f"sid:{sid} call success!, data is: {json.dumps(data, ensure_ascii=False)}")
-                self.result += "".join(w["w"] for i in data for w in i["cw"])
-                self.once_done = True
+                result: dict = response["data"]["result"]
+                logger.info(f"sid:{sid} call success!, data is: {json.dumps(result, ensure_ascii=False)}")
+                self.result = self.transcript.apply(result)
+                if self.first_partial_at is None:
+                    self.first_partial_at = time.monotonic()
+                if self.on_partial:
+                    self.on_partial(self.result)
+                # 流式上传时服务端会边听边返回，只有 status == 2 才是最终结果
+                if response["data"].get("status") == STATUS_LAST_FRAME:
+                    self._resolve(self.result)
         except Exception as e:
-            logger.error("receive msg, but parse exception:", e)
+            logger.error(f"receive msg, but parse exception: {e}")
+            self._fail(e)
 
     def on_error(self, ws: websocket.WebSocketApp, error: Exception) -> None:
-        logger.error(f"### error ###\n{error}")
+        # 收到最终帧后服务端正常关闭(code 1000)也会走到这里，不算错误
+        if self.future.done():
+            logger.debug(f"### closed after final frame ###\n{error}")
+        else:
+            logger.error(f"### error ###\n{error}")
         self.is_connected = False
-        self.thread_loop = None
         self.ws = None
-        #self.start_daemon()
+        self.connect_done.set()
+        self._fail(ASRError(f"websocket error: {error}"))
 
     def on_close(self, ws: websocket.WebSocketApp, a: Any, b: Any) -> None:
         logger.info(f"### closed ###\na={a}\nb={b}")
         self.is_connected = False
-        self.thread_loop = None
         self.ws = None
-        #self.start_daemon()
+        self.connect_done.set()
+        self._fail(ASRError(f"websocket closed before final result: {a} {b}"))
 
     def on_open(self, ws: websocket.WebSocketApp) -> None:
         logger.info(f"### connected ###")
         self.is_connected = True
         self.ws = ws
+        self.connect_done.set()
 
-    def connect(self) -> None:
-        websocket.enableTrace(False)
-        ws = websocket.WebSocketApp(self.create_url(),
-                                    on_message=self.on_message,
-                                    on_error=self.on_error,
-                                    on_close=self.on_close,
-                                    on_open=self.on_open)
-        ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
+    def _resolve(self, result: str) -> None:
+        if not self.future.done():
+            self.future.set_result(result)
 
-    def send_audio(self, audio_data: bytes, rate: int = 16000) -> None:
-        for i in range(self.ws_connect_timeout):
-            if not self.is_connected:
-                logger.info("WebSocket is not connected, waiting...")
-                time.sleep(1)
-            else:
-                break
+    def _fail(self, error: Exception) -> None:
+        if not self.future.done():
+            self.future.set_exception(error)
+
+    def _send_frame(self, status: int, buf: bytes) -> None:
+        d: dict = {
+            "data": {
+                "status": status,
+                "format": self.codec.format,
+                "audio": str(base64.b64encode(buf), 'utf-8'),
+                "encoding": self.codec.encoding
+            }
+        }
+        if status == STATUS_FIRST_FRAME:
+            d["common"] = self.common_args
+            d["business"] = self.business_args
+        payload = json.dumps(d)
+        start = time.monotonic()
+        self.ws.send(payload)
+        if self.throughput:
+            self.throughput.record(len(payload), time.monotonic() - start, getattr(self.ws.sock, "sock", None))
+
+    def _wait_connected(self) -> bool:
+        # on_open / on_error / on_close 都会唤醒，不再按秒轮询
+        if not self.connect_done.wait(self.ws_connect_timeout):
+            self._fail(ASRError(f"websocket connect timeout after {self.ws_connect_timeout}s"))
+        return self.is_connected
 
-        if not self.is_connected:
+    def send_audio(self, audio_data: bytes, rate: int = 16000) -> None:
+        if not self._wait_connected():
+            self._fail(ASRError("websocket is not connected"))
             return
 
-        frame_size: int = 1280  # 每一帧的音频大小
+        self.codec.reset()
+        if self.throughput:
+            self.throughput.reset()
+        audio_data = self.codec.encode(audio_data) + self.codec.flush()
+        frame_size: int = self.codec.frame_size  # 每一帧的音频大小
         intervel = 0.04  # 发送音频间隔(单位:s)
         status: int = STATUS_FIRST_FRAME  # 音频的状态信息
 
-        total_bytes: int = len(audio_data)
         offset: int = 0
 
-        while offset < total_bytes:
+        while True:
             buf: bytes = audio_data[offset:offset + frame_size]
             offset += frame_size
 
             if not buf:
                 status = STATUS_LAST_FRAME
 
-            if status == STATUS_FIRST_FRAME:
-                d: dict = {
-                    "common": self.common_args,
-                    "business": self.business_args,
-                    "data": {
-                        "status": 0,
-                        "format": f"audio/L16;rate={rate}",
-                        "audio": str(base64.b64encode(buf), 'utf-8'),
-                        "encoding": "raw"
-                    }
-                }
-                self.ws.send(json.dumps(d))
-                status = STATUS_CONTINUE_FRAME
-            elif status == STATUS_CONTINUE_FRAME:
-                d: dict = {
-                    "data": {
-                        "status": 1,
-                        "format": f"audio/L16;rate={rate}",
-                        "audio": str(base64.b64encode(buf), 'utf-8'),
-                        "encoding": "raw"
-                    }
-                }
-                self.ws.send(json.dumps(d))
-            elif status == STATUS_LAST_FRAME:
-                d: dict = {
-                    "data": {
-                        "status": 2,
-                        "format": f"audio/L16;rate={rate}",
-                        "audio": str(base64.b64encode(buf), 'utf-8'),
-                        "encoding": "raw"
-                    }
-                }
-                self.ws.send(json.dumps(d))
-                #time.sleep(1)
+            self._send_frame(status, buf)
+            if status == STATUS_LAST_FRAME:
                 break
+            status = STATUS_CONTINUE_FRAME
 
             # 模拟音频采样间隔
             time.sleep(intervel)
 
-    def __call__(self, audio_data: Union[bytes, Any], rate: int = 16000, timeout: int = 20) -> str:
-        if isinstance(audio_data, bytes):
-            self.result = ""
-            self.once_done = False
-            self.send_audio(audio_data, rate)
+    def start_stream(self, rate: int = 16000) -> Future:
+        # 流式识别：录音线程通过 feed() 边录边送，finish() 发送最后一帧
+        self.result = ""
+        self.transcript = Transcript()
+        self.stream_rate = rate
+        self.started_at = time.monotonic()
+        self.stream_queue = queue.Queue()
+        self.stream_thread = threading.Thread(target=self._stream_sender, daemon=True)
+        self.stream_thread.start()
+        return self.future
+
+    def feed(self, audio_data: bytes) -> None:
+        # 识别已经结束(出错或取消)后发送线程不再消费队列，丢弃后续音频
+        if self.stream_queue is not None and audio_data and not self.future.done():
+            self.stream_queue.put(audio_data)
+
+    def finish(self) -> None:
+        if self.stream_queue is not None:
+            self.stream_queue.put(None)
+
+    def cancel(self) -> None:
+        # 放弃本次识别：结束等待、停止发送并关闭连接
+        self._fail(ASRError("cancelled"))
+        if self.stream_queue is not None:
+            self.stream_queue.put(STREAM_CANCEL)
+        if self.session:
+            self.session.close()
+
+    def _stream_sender(self) -> None:
+        # 连接建立前到达的音频先在队列里排队，连接后一次性补发
+        if not self._wait_connected():
+            self._fail(ASRError("websocket is not connected"))
+            return
 
-            # 等待 ASR 完成
-            for i in range(int(timeout)):
-                if not self.once_done:
-                    time.sleep(1)
-                else:
+        frame_size: int = self.codec.frame_size
+        status: int = STATUS_FIRST_FRAME
+        pending = bytearray()
+        self.codec.reset()
+        if self.throughput:
+            self.throughput.reset()
+        try:
+            while True:
+                data = self.stream_queue.get()
+                if data is STREAM_CANCEL:
+                    break
+                if data is None:
+                    pending += self.codec.flush()
+                    # 首帧必须携带 common/business 参数，哪怕没有录到音频
+                    if pending or status == STATUS_FIRST_FRAME:
+                        self._send_frame(status, bytes(pending))
+                    self._send_frame(STATUS_LAST_FRAME, b"")
                     break
-            logger.info(f"return: {self.result}")
-            return self.result
+                pending += self.codec.encode(data)
+                while len(pending) >= frame_size:
+                    self._send_frame(status, bytes(pending[:frame_size]))
+                    del pending[:frame_size]
+                    status = STATUS_CONTINUE_FRAME
+        except Exception as e:
+            logger.error(f"stream send exception: {e}")
+            self._fail(e)
+
+    def submit(self, audio_data: bytes, rate: int = 16000) -> Future:
+        # 整段音频识别，返回在最终帧到达时完成的 Future
+        self.result = ""
+        self.transcript = Transcript()
+        self.started_at = time.monotonic()
+        threading.Thread(target=self._submit_sender, args=(audio_data, rate), daemon=True).start()
+        return self.future
+
+    def _submit_sender(self, audio_data: bytes, rate: int) -> None:
+        try:
+            self.send_audio(audio_data, rate)
+        except Exception as e:
+            logger.error(f"send audio exception: {e}")
+            self._fail(e)
+
+    def wait_result(self, timeout: Optional[float] = 20) -> str:
+        # 等待 ASR 完成，结果一到立即返回；超时或出错返回空串
+        try:
+            result = self.future.result(timeout=timeout)
+        except TimeoutError:
+            logger.error(f"asr request timeout after {timeout}s")
+            result = ""
+        except Exception as e:
+            logger.error(f"asr request failed: {e}")
+            result = ""
+        logger.info(f"return: {result}")
+        return result
+
+    def __call__(self, audio_data: Union[bytes, Any], rate: int = 16000, timeout: int = 20) -> str:
+        if isinstance(audio_data, bytes):
+            self.submit(audio_data, rate)
+            return self.wait_result(timeout)
         elif hasattr(audio_data, 'read'):
             # 如果是文件类对象，读取其内容
             audio_data_bytes: bytes = audio_data.read()
@@ -220,12 +339,15 @@ if __name__ == '__main__':
     handler.setFormatter(formatter)
     logger.addHandler(handler)
 
-    asr = ASRClient(os.getenv("asr_ws_connect_timeout"),
-                    os.getenv("asr_app_id"),
-                    os.getenv("asr_api_key"),
-                    os.getenv("asr_api_secret"))
+    sessions = create_session_manager(os.getenv("asr_api_key"), os.getenv("asr_api_secret")).start()
+    sample = os.path.join(os.path.dirname(__file__), "samples/iat_pcm_16k.pcm")
     for i in range(5):
-        with open("samples/iat_pcm_16k.pcm", "rb") as f:
+        asr = ASRClient(os.getenv("asr_ws_connect_timeout"),
+                        os.getenv("asr_app_id"),
+                        os.getenv("asr_api_key"),
+                        os.getenv("asr_api_secret"),
+                        session_manager=sessions)
+        with open(sample, "rb") as f:
             result = asr(f, rate=16000, timeout=int(os.getenv("asr_request_timeout")))
             print(result)
         time.sleep(1)
@@ -1,5 +1,12 @@
 import logging
-from typing import List, Tuple, Callable
+import queue
+import threading
+import time
+from collections import deque
+from typing import List, Tuple, Callable, Optional
+import numpy as np
+# 重采样和格式转换只依赖 numpy，放在 dsp.py 里(ASR 上传编码也用)，这里一并导出
+from dsp import AudioConverter, CapturePreprocessor, Resampler, to_float, from_float, mix_channels, soft_clip
 try:
     import alsaaudio
     alsaaudio_available = True
@@ -18,20 +25,132 @@ if alsaaudio_available:
 logger = logging.getLogger()
 
 
+class VoiceActivityDetector:
+    # 基于短时能量和过零率的端点检测，按帧批量计算；切掉首尾静音，判断一句话是否说完
+    LEADING = 0
+    SPEECH = 1
+    TRAILING = 2
+
+    def __init__(self, rate: int = 16000, channels: int = 1, frame_ms: int = 20,
+                 threshold_db: float = -45.0, margin_db: float = 10.0, zcr_threshold: float = 0.25,
+                 start_ms: int = 60, hangover_ms: int = 300, preroll_ms: int = 200, tail_ms: int = 100):
+        self.frame_ms = frame_ms
+        self.frame_samples = rate * frame_ms // 1000 * channels
+        self.frame_bytes = self.frame_samples * 2
+        self.threshold_db = threshold_db
+        self.margin_db = margin_db
+        self.zcr_threshold = zcr_threshold
+        self.start_frames = max(1, start_ms // frame_ms)
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.preroll_frames = preroll_ms // frame_ms
+        self.tail_frames = tail_ms // frame_ms
+        self.reset()
+
+    def reset(self) -> None:
+        self.state = self.LEADING
+        self.remainder = b""
+        self.preroll = deque(maxlen=self.preroll_frames + self.start_frames)
+        self.pending: List[bytes] = []
+        self.speech_run = 0
+        self.silence_frames = 0
+        self.noise_db: Optional[float] = None
+        self.speech_detected = False
+
+    def classify(self, buf: bytes) -> np.ndarray:
+        x = np.frombuffer(buf, dtype='<i2').reshape(-1, self.frame_samples).astype(np.float32) / 32768.0
+        db = 10.0 * np.log10(np.mean(x * x, axis=1) + 1e-10)
+        signs = np.signbit(x)
+        zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+        if self.noise_db is None:
+            self.noise_db = min(float(np.min(db)), self.threshold_db - self.margin_db)
+        threshold = max(self.threshold_db, self.noise_db + self.margin_db)
+        # 浊音能量高，清音(擦音)能量低但过零率高
+        speech = (db > threshold) | ((db > threshold - self.margin_db / 2) & (zcr > self.zcr_threshold))
+        quiet = db[~speech]
+        if quiet.size:
+            self.noise_db = 0.9 * self.noise_db + 0.1 * float(np.mean(quiet))
+        return speech
+
+    def process(self, data: bytes) -> bytes:
+        # 输入任意长度的 PCM，返回应该送给 ASR 的部分；句中停顿在说话恢复时补发
+        buf = self.remainder + data
+        n = len(buf) // self.frame_bytes * self.frame_bytes
+        self.remainder = buf[n:]
+        if n == 0:
+            return b""
+
+        out = []
+        for i, is_speech in enumerate(self.classify(buf[:n])):
+            frame = buf[i * self.frame_bytes:(i + 1) * self.frame_bytes]
+            if self.state == self.LEADING:
+                self.preroll.append(frame)
+                self.speech_run = self.speech_run + 1 if is_speech else 0
+                if self.speech_run >= self.start_frames:
+                    out.extend(self.preroll)
+                    self.preroll.clear()
+                    self.state = self.SPEECH
+                    self.speech_detected = True
+            elif is_speech:
+                out.extend(self.pending)
+                self.pending.clear()
+                out.append(frame)
+                self.state = self.SPEECH
+                self.silence_frames = 0
+            else:
+                self.pending.append(frame)
+                self.silence_frames += 1
+                self.state = self.TRAILING
+        return b"".join(out)
+
+    def flush(self) -> bytes:
+        # 录音结束：尾部静音只保留 tail_ms，其余丢弃
+        tail = b"".join(self.pending[:self.tail_frames]) if self.state == self.TRAILING else b""
+        self.pending.clear()
+        self.remainder = b""
+        return tail
+
+    @property
+    def in_speech(self) -> bool:
+        return self.state == self.SPEECH or \
+            (self.state == self.TRAILING and self.silence_frames < self.hangover_frames)
+
+    @property
+    def silence_ms(self) -> int:
+        # 说完话之后已经持续的静音时长
+        return self.silence_frames * self.frame_ms if self.state == self.TRAILING else 0
+
+
 class AudioPlayer:
-    def __init__(self, format: int = pyaudio.paInt16, channels: int = 1, rate: int = 16000):
+    # format/channels/rate 是调用方写入的音频格式；device_* 是声卡实际打开的格式，
+    # 不同时在进程内转换一次(例如 16k 单声道 -> 声卡原生的 48k 立体声)，不经过 ALSA plug 层重采样
+    def __init__(self, format: int = pyaudio.paInt16, channels: int = 1, rate: int = 16000, periodsize: int = 128,
+                 device: str = 'default', device_rate: Optional[int] = None, device_channels: Optional[int] = None,
+                 device_format: Optional[int] = None):
         self.format = format
         self.channels = channels
         self.rate = rate
+        self.periodsize = periodsize
+        self.frame_bytes = pyaudio.get_sample_size(format) * channels
+        self.period_bytes = periodsize * self.frame_bytes
+        self.device_rate = device_rate or rate
+        self.device_channels = device_channels or channels
+        self.device_format = device_format or format
+        self.converter: Optional[AudioConverter] = AudioConverter(
+            rate, self.device_rate, channels, self.device_channels,
+            pyaudio.get_sample_size(format), pyaudio.get_sample_size(self.device_format))
+        if self.converter.passthrough:
+            self.converter = None
+        device_periodsize = periodsize * self.device_rate // rate
         if alsaaudio_available:
-            self.stream = alsaaudio.PCM(alsaaudio.PCM_PLAYBACK, channels=channels,
-                                        rate=rate, format=pyaudio_alsaaudio_foramt_mapping[format],
-                                        periodsize=128, device='default')
+            self.stream = alsaaudio.PCM(alsaaudio.PCM_PLAYBACK, channels=self.device_channels,
+                                        rate=self.device_rate,
+                                        format=pyaudio_alsaaudio_foramt_mapping[self.device_format],
+                                        periodsize=device_periodsize, device=device)
         else:
             self.pa = pyaudio.PyAudio()
-            self.stream = self.pa.open(format=format,
-                                       channels=channels,
-                                       rate=rate,
+            self.stream = self.pa.open(format=self.device_format,
+                                       channels=self.device_channels,
+                                       rate=self.device_rate,
                                        output=True,
                                        start=True)
 
@@ -41,19 +160,322 @@ class AudioPlayer:
             self.pa.terminate()
 
     def play(self, audio_data: bytes) -> None:
+        # 同步播放，按整数个 period 写入，切片用 memoryview 不拷贝
+        view = memoryview(audio_data).cast('B')
+        chunk = self.period_bytes * 4
+        for offset in range(0, len(view), chunk):
+            self.write(view[offset:offset + chunk])
+
+    def write(self, data: memoryview) -> None:
+        if self.converter:
+            data = self.converter.convert(data)
+        if alsaaudio_available:
+            # pyalsaaudio 的 write 接受任意 buffer，直接写 memoryview
+            self.stream.write(data)
+        else:
+            # pyaudio 只接受只读 bytes，开发机上才走这里，拷贝一次
+            self.stream.write(bytes(data))
+
+    def drop(self) -> None:
+        # 丢弃已经交给声卡、还没播出来的音频(打断时用)
+        if alsaaudio_available and hasattr(self.stream, "drop"):
+            self.stream.drop()
+        if self.converter:
+            self.converter.reset()
+
+
+class PlaybackEngine:
+    # 播放引擎：生产者(合成线程)把 PCM 写进固定大小的环形缓冲区，专用的写线程按整数个 period 写声卡。
+    # 网络接收和声卡输出互不阻塞；缓冲区满时 write() 阻塞生产者，形成有界背压。
+    # 写线程直接把环形缓冲区的 memoryview 切片交给声卡，不产生中间 bytes。
+    def __init__(self, player: AudioPlayer, buffer_ms: int = 3000, periods_per_write: int = 4):
+        self.player = player
+        self.period_bytes = player.period_bytes
+        self.write_bytes = self.period_bytes * periods_per_write
+        capacity = player.rate * buffer_ms // 1000 * player.frame_bytes
+        # 容量取 write_bytes 的整数倍，回绕处也是整 period
+        self.capacity = max(1, -(-capacity // self.write_bytes)) * self.write_bytes
+        self.ring = bytearray(self.capacity)
+        self.view = memoryview(self.ring)
+        # head/tail 是累计的读写字节数，位置取模 capacity
+        self.head = 0
+        self.tail = 0
+        self.generation = 0
+        self.streaming = False
+        self.draining = 0
+        self.writing = False
+        self.running = True
+        self.cond = threading.Condition()
+        # 统计
+        self.underruns = 0
+        self.writes = 0
+        self.max_depth = 0
+        self.thread = threading.Thread(target=self._writer_daemon, name="playback", daemon=True)
+        self.thread.start()
+
+    @property
+    def depth(self) -> int:
+        return self.tail - self.head
+
+    @property
+    def depth_ms(self) -> float:
+        return self.depth / self.player.frame_bytes * 1000 / self.player.rate
+
+    def write(self, audio_data: bytes, timeout: Optional[float] = None) -> int:
+        # 拷贝进环形缓冲区(唯一的一次拷贝)，空间不够时等待写线程腾出空间；返回写入的字节数
+        data = memoryview(audio_data).cast('B')
+        written = 0
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.cond:
+            generation = self.generation
+            while written < len(data) and self.running:
+                free = self.capacity - self.depth
+                if free == 0:
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                    if self.generation != generation:
+                        # 被 flush() 清空，丢弃剩余部分
+                        break
+                    continue
+                pos = self.tail % self.capacity
+                n = min(free, len(data) - written, self.capacity - pos)
+                self.ring[pos:pos + n] = data[written:written + n]
+                self.tail += n
+                written += n
+                self.streaming = True
+                self.max_depth = max(self.max_depth, self.depth)
+                self.cond.notify_all()
+        return written
+
+    play = write
+
+    def flush(self) -> None:
+        # 丢弃还没写到声卡的音频，连同声卡自己缓冲的部分，停止发声不超过一个 period
+        with self.cond:
+            self.head = self.tail
+            self.generation += 1
+            self.streaming = False
+            self.cond.notify_all()
+        drop = getattr(self.player, "drop", None)
+        if drop:
+            try:
+                drop()
+            except Exception as e:
+                logger.warning(f"playback drop failed: {e}")
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        # 等待已排队的音频全部写到声卡；之后缓冲区变空不再计为欠载
+        with self.cond:
+            self.draining += 1
+            try:
+                done = self.cond.wait_for(lambda: self.depth == 0 and not self.writing, timeout)
+            finally:
+                self.draining -= 1
+            self.streaming = False
+            return done
+
+    def close(self) -> None:
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join()
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {"depth": self.depth, "max_depth": self.max_depth, "underruns": self.underruns,
+                    "writes": self.writes, "capacity": self.capacity}
+
+    def _writer_daemon(self) -> None:
+        period_seconds = self.player.periodsize / self.player.rate
+        while True:
+            with self.cond:
+                while self.running and self.depth == 0:
+                    if self.streaming and not self.draining:
+                        # 还在播放中缓冲区就空了：生产者没跟上
+                        self.underruns += 1
+                        self.streaming = False
+                        logger.debug(f"playback underrun #{self.underruns}")
+                    self.cond.wait()
+                if not self.running:
+                    return
+                if self.depth < self.period_bytes:
+                    # 不足一个 period，稍等一下后续数据再写，等不到就按实际长度写(一段音频的结尾)
+                    self.cond.wait(period_seconds)
+                    if self.depth == 0:
+                        continue
+                pos = self.head % self.capacity
+                n = min(self.depth, self.write_bytes, self.capacity - pos)
+                if n >= self.period_bytes:
+                    n -= n % self.period_bytes
+                generation = self.generation
+                self.writing = True
+            try:
+                self.player.write(self.view[pos:pos + n])
+            except Exception as e:
+                logger.error(f"playback write failed: {e}")
+            with self.cond:
+                self.writing = False
+                self.writes += 1
+                if self.generation == generation:
+                    self.head += n
+                self.cond.notify_all()
+
+
+class MixerChannel:
+    # 混音器的一路持续输入(例如说话声)，接口和 AudioPlayer 一样，可以直接交给 PlaybackEngine；
+    # 缓冲区只有几个 block，write() 阻塞到混音线程取走为止，节奏仍由声卡决定
+    def __init__(self, mixer: "Mixer", name: str, gain: float = 1.0, buffer_blocks: int = 2):
+        self.mixer = mixer
+        self.name = name
+        self.gain = gain
+        player = mixer.player
+        self.rate = player.rate
+        self.periodsize = player.periodsize
+        self.frame_bytes = player.frame_bytes
+        self.period_bytes = player.period_bytes
+        self.capacity = mixer.block_bytes * buffer_blocks
+        self.buffer = bytearray()
+
+    def write(self, data: memoryview) -> None:
+        data = memoryview(data).cast('B')
         offset = 0
-        chunk = 128 * self.channels
+        with self.mixer.cond:
+            while offset < len(data) and self.mixer.running:
+                free = self.capacity - len(self.buffer)
+                if free <= 0:
+                    self.mixer.cond.wait()
+                    continue
+                self.buffer += data[offset:offset + free]
+                offset += free
+                self.mixer.cond.notify_all()
+
+    play = write
+
+    def drop(self) -> None:
+        # 打断：丢掉这一路还没混音的数据，以及声卡里已经缓冲的部分
+        with self.mixer.cond:
+            self.buffer.clear()
+            self.mixer.cond.notify_all()
+        self.mixer.player.drop()
+
+
+class Mixer:
+    # 软件混音：多路 PCM 各乘自己的增益后相加，再乘总音量、软削波，写到同一个 AudioPlayer。
+    # 提示音(play)叠在说话声上播放，不用再打开一个声卡设备；调音量只改总增益，不经过 ALSA 混音器
+    def __init__(self, player: AudioPlayer, periods_per_block: int = 4, volume: int = 100, knee: float = 0.8):
+        self.player = player
+        self.block_bytes = player.period_bytes * periods_per_block
+        self.width = player.frame_bytes // player.channels
+        self.volume = volume
+        self.knee = knee
+        self.channels: List[MixerChannel] = []
+        # 正在播放的提示音：[(帧数, 声道数) float32, 已播放帧数, 增益]
+        self.clips: List[list] = []
+        self.cond = threading.Condition()
+        self.running = True
+        # 统计
+        self.blocks = 0
+        self.clipped_blocks = 0
+        self.thread = threading.Thread(target=self._mixer_daemon, name="mixer", daemon=True)
+        self.thread.start()
+
+    @property
+    def gain(self) -> float:
+        # 音量百分比按平方映射，听感上更接近线性
+        return (self.volume / 100) ** 2
+
+    def channel(self, name: str, gain: float = 1.0) -> MixerChannel:
+        channel = MixerChannel(self, name, gain)
+        with self.cond:
+            self.channels.append(channel)
+        return channel
+
+    def play(self, pcm: bytes, gain: float = 1.0) -> None:
+        # 一次性的短音频(提示音)，格式与 player 相同，不阻塞，和其他声音叠加播放
+        clip = to_float(pcm, self.width, self.player.channels)
+        with self.cond:
+            self.clips.append([clip, 0, gain])
+            self.cond.notify_all()
+
+    def close(self) -> None:
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join()
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {"blocks": self.blocks, "clipped_blocks": self.clipped_blocks, "clips": len(self.clips)}
+
+    def _mix(self) -> np.ndarray:
+        # 在 cond 内调用：从每一路取出最多一个 block 相加
+        frames = self.block_bytes // self.player.frame_bytes
+        mix = np.zeros((frames, self.player.channels), dtype=np.float32)
+        n = 0
+        for channel in self.channels:
+            take = min(len(channel.buffer), self.block_bytes) // self.player.frame_bytes * self.player.frame_bytes
+            if take:
+                x = to_float(bytes(channel.buffer[:take]), self.width, self.player.channels)
+                del channel.buffer[:take]
+                mix[:len(x)] += channel.gain * x
+                n = max(n, len(x))
+        for clip in self.clips:
+            x = clip[0][clip[1]:clip[1] + frames]
+            clip[1] += len(x)
+            mix[:len(x)] += clip[2] * x
+            n = max(n, len(x))
+        self.clips = [clip for clip in self.clips if clip[1] < len(clip[0])]
+        return mix[:n]
+
+    def _mixer_daemon(self) -> None:
         while True:
-            data = audio_data[offset:offset + chunk]
-            offset += chunk
-            if not data:
-                break
-            self.stream.write(data)
+            with self.cond:
+                # 不足一帧的尾巴(奇数长度的写入)留在缓冲区等下一次写入补齐，不算有数据，否则会空转
+                while self.running and not self.clips and \
+                        not any(len(channel.buffer) >= self.player.frame_bytes for channel in self.channels):
+                    self.cond.wait()
+                if not self.running:
+                    return
+                mix = self._mix()
+                # 各路腾出了空间
+                self.cond.notify_all()
+            mix *= self.gain
+            out = soft_clip(mix, self.knee)
+            if out is not mix:
+                self.clipped_blocks += 1
+            self.blocks += 1
+            try:
+                self.player.write(from_float(out, self.width))
+            except Exception as e:
+                logger.error(f"mixer write failed: {e}")
+
+
+def tone(freq: float, ms: int, rate: int = 16000, channels: int = 1, amplitude: float = 0.3,
+         fade_ms: int = 10) -> bytes:
+    # 生成提示音：正弦波，首尾淡入淡出避免爆音
+    t = np.arange(rate * ms // 1000) / rate
+    x = amplitude * np.sin(2 * np.pi * freq * t)
+    fade = min(len(x) // 2, rate * fade_ms // 1000)
+    if fade:
+        ramp = np.linspace(0.0, 1.0, fade)
+        x[:fade] *= ramp
+        x[-fade:] *= ramp[::-1]
+    return from_float(np.repeat(x[:, None], channels, axis=1))
 
 
 class AudioRecorder:
-    def __init__(self, format: int = pyaudio.paInt16, channels: int = 1, rate: int = 8000, chunk: int = 1024):
-        # 设置音频参数
+    # 录音：阻塞读声卡，没有数据时线程睡眠，不空转；录到的音频写进预先分配、有上限的缓冲区，
+    # 超过 max_seconds 自动结束。每次录音后在 stats 里记录这次录音占用的 CPU 和内存。
+    # 常开模式(open())下声卡一直开着，后台线程持续读取并保留最近 preroll_ms 的音频，
+    # 按下按键时这段音频接在录音最前面：没有打开设备的延迟，也不会切掉第一个字
+    def __init__(self, format: int = pyaudio.paInt16, channels: int = 1, rate: int = 8000, chunk: int = 320,
+                 vad: Optional[VoiceActivityDetector] = None, auto_stop_ms: int = 0, max_seconds: float = 60,
+                 preroll_ms: int = 300, device: str = 'default', device_rate: Optional[int] = None,
+                 device_channels: Optional[int] = None, device_format: Optional[int] = None,
+                 preprocessor: Optional[CapturePreprocessor] = None):
+        # 设置音频参数，chunk 是每次读取的帧数，16k 时 320 帧是 20ms
         self.format = format
         self.channels = channels
         self.rate = rate
@@ -63,68 +485,259 @@ class AudioRecorder:
         else:
             self.pa = pyaudio.PyAudio()
         self.is_recording = False
+        self.stop_requested = False
+        self.stop_deadline = 0.0
+        # 端点检测，auto_stop_ms > 0 时说完话静音这么久就自动结束录音，不用等松开按键
+        self.vad = vad
+        self.auto_stop_ms = auto_stop_ms
+        # 声卡按原生格式打开，读到的数据在进程内转换成 rate/channels/format
+        self.device = device
+        self.device_rate = device_rate or rate
+        self.device_channels = device_channels or channels
+        self.device_format = device_format or format
+        self.converter: Optional[AudioConverter] = AudioConverter(
+            self.device_rate, rate, self.device_channels, channels,
+            pyaudio.get_sample_size(self.device_format), pyaudio.get_sample_size(format))
+        if self.converter.passthrough:
+            self.converter = None
+        # 去直流、高通、自动增益，在格式转换之后、端点检测和预录缓冲之前
+        self.preprocessor = preprocessor
+        # 讯飞听写单次最长 60 秒，缓冲区一次分配，每次录音复用
+        self.frame_bytes = pyaudio.get_sample_size(format) * channels
+        self.buffer = bytearray(int(max_seconds * rate) * self.frame_bytes)
+        self.view = memoryview(self.buffer)
+        self.length = 0
+        self.stats: dict = {}
+        self.overruns = 0
+        # 常开模式的预录环形缓冲区，written 是累计写入的字节数
+        self.preroll = bytearray(rate * preroll_ms // 1000 * self.frame_bytes)
+        self.preroll_written = 0
+        self.stream = None
+        self.monitor_thread: Optional[threading.Thread] = None
+        self.monitor_cpu = 0.0
+        self.listener: Optional[queue.Queue] = None
+        self.lock = threading.Lock()
+        # 常开模式下每块音频都交给 tap(例如唤醒词检测)，在读线程里调用，不能阻塞
+        self.tap: Optional[Callable[[bytes], None]] = None
 
     def __del__(self):
         if not alsaaudio_available:
             self.pa.terminate()
 
-    def start_recording(self, callback: Callable = None):
+    @property
+    def device_chunk(self) -> int:
+        return self.chunk * self.device_rate // self.rate
+
+    def _open_stream(self):
+        if self.converter:
+            self.converter.reset()
+        if self.preprocessor:
+            self.preprocessor.reset()
+        if alsaaudio_available:
+            # 阻塞模式：read() 在凑满一个 period 之前睡眠，不再用 PCM_NONBLOCK 空转占满一个核
+            return alsaaudio.PCM(alsaaudio.PCM_CAPTURE, alsaaudio.PCM_NORMAL,
+                                 channels=self.device_channels, rate=self.device_rate,
+                                 format=pyaudio_alsaaudio_foramt_mapping[self.device_format],
+                                 periodsize=self.device_chunk, periods=8, device=self.device)
+        return self.pa.open(format=self.device_format,
+                            channels=self.device_channels,
+                            rate=self.device_rate,
+                            input=True,
+                            frames_per_buffer=self.device_chunk,
+                            start=True)
+
+    def _read(self, stream) -> bytes:
+        if alsaaudio_available:
+            l, data = stream.read()
+            if l < 0:
+                # -EPIPE：读得不够快，声卡缓冲区溢出，pyalsaaudio 已经自动恢复
+                self.overruns += 1
+                return b""
+        else:
+            # 溢出时丢掉这段继续录，不抛异常中断录音
+            data = stream.read(self.device_chunk, exception_on_overflow=False)
+        if self.converter:
+            data = self.converter.convert(data)
+        return self.preprocessor.process(data) if self.preprocessor else data
+
+    def open(self) -> "AudioRecorder":
+        # 进入常开模式
+        if self.monitor_thread is None:
+            self.stream = self._open_stream()
+            self.monitor_thread = threading.Thread(target=self._monitor_daemon, name="capture", daemon=True)
+            self.monitor_thread.start()
+        return self
+
+    def close(self) -> None:
+        thread, self.monitor_thread = self.monitor_thread, None
+        if thread:
+            # 读线程最多再读一个 period 就会退出
+            thread.join()
+            self.stream.close()
+            self.stream = None
+
+    def _monitor_daemon(self) -> None:
+        cpu_started = time.thread_time()
+        while self.monitor_thread is not None:
+            data = self._read(self.stream)
+            with self.lock:
+                self._remember(data)
+                if self.listener:
+                    self.listener.put(data)
+            if self.tap and data:
+                self.tap(data)
+            self.monitor_cpu = time.thread_time() - cpu_started
+
+    def _remember(self, data: bytes) -> None:
+        # 写进预录环形缓冲区，只保留最后 len(self.preroll) 字节
+        size = len(self.preroll)
+        if not size or not data:
+            return
+        data = memoryview(data)[-size:]
+        pos = self.preroll_written % size
+        n = min(len(data), size - pos)
+        self.preroll[pos:pos + n] = data[:n]
+        self.preroll[:len(data) - n] = data[n:]
+        self.preroll_written += len(data)
+
+    def _preroll_bytes(self) -> bytes:
+        size = len(self.preroll)
+        if self.preroll_written < size:
+            return bytes(self.preroll[:self.preroll_written])
+        pos = self.preroll_written % size
+        return bytes(self.preroll[pos:] + self.preroll[:pos])
+
+    def _listen(self) -> Tuple[queue.Queue, bytes]:
+        # 拿到预录音频的同时开始接收后续数据，两者之间不丢也不重复
+        chunks: queue.Queue = queue.Queue()
+        with self.lock:
+            self.listener = chunks
+            return chunks, self._preroll_bytes()
+
+    def _append(self, data: bytes) -> bool:
+        # 返回 False 表示缓冲区已满
+        n = min(len(data), len(self.buffer) - self.length)
+        self.view[self.length:self.length + n] = data[:n]
+        self.length += n
+        return n == len(data)
+
+    def start_recording(self, callback: Callable = None, frame_callback: Callable = None):
         if self.is_recording:
             return
 
         logger.info("录音开始...")
         self.is_recording = True
+        self.stop_requested = False
+        self.length = 0
+        self.stats = {"reads": 0}
+        if self.vad:
+            self.vad.reset()
+        started = time.monotonic()
+        cpu_started = time.thread_time()
+        overruns = self.overruns
+        monitor_cpu = self.monitor_cpu
+        stream = None
+        chunks = None
 
         try:
-            frames = []
-
-            # 打开音频流
-            if alsaaudio_available:
-                stream = alsaaudio.PCM(alsaaudio.PCM_CAPTURE, alsaaudio.PCM_NONBLOCK,
-                                       channels=self.channels, rate=self.rate,
-                                       format=pyaudio_alsaaudio_foramt_mapping[self.format],
-                                       periodsize=128, periods=8, device='default')
+            if self.monitor_thread:
+                # 常开模式：从预录的音频开始，之后的数据由读线程送过来
+                chunks, data = self._listen()
+                self.stats["preroll_bytes"] = len(data)
             else:
-                stream = self.pa.open(format=self.format,
-                                      channels=self.channels,
-                                      rate=self.rate,
-                                      input=True,
-                                      start=True)
+                # 打开音频流
+                stream = self._open_stream()
+                data = self._read(stream)
 
             # 循环读取音频流
             while self.is_recording:
-                if alsaaudio_available:
-                    l, data = stream.read()
-                    if l > 0:
-                        frames.append(data)
-                else:
-                    data = stream.read(self.chunk)
-                    frames.append(data)
-
-            # 回调音频数据后处理函数
-            if callback:
-               callback(b''.join(frames))
+                self.stats["reads"] += 1
+                if self.vad:
+                    data = self.vad.process(data)
+                if data:
+                    if not self._append(data):
+                        logger.warning(f"录音超过 {len(self.buffer) // self.frame_bytes / self.rate:.0f} 秒，自动停止")
+                        break
+                    # 边录边送，松开按键前音频就已经在路上了
+                    if frame_callback:
+                        frame_callback(data)
 
-            # 停止和关闭流
-            stream.close()
+                if self.stop_requested:
+                    # 松开按键时如果还在说话，等这句话说完再停，最多等到 stop_deadline
+                    if (self.vad and not self.vad.in_speech) or time.monotonic() >= self.stop_deadline:
+                        break
+                elif self.vad and self.auto_stop_ms and self.vad.silence_ms >= self.auto_stop_ms:
+                    logger.info("检测到说话结束，自动停止录音")
+                    break
+                data = self._next(stream, chunks)
+            self.is_recording = False
+
+            if self.vad:
+                data = self.vad.flush()
+                if data and self._append(data) and frame_callback:
+                    frame_callback(data)
+
+            # 停止和关闭流，常开模式下只是不再接收
+            self._stop_listening(stream)
+            self.stats["overruns"] = self.overruns - overruns
+            if self.preprocessor:
+                self.stats["preprocess"] = self.preprocessor.stats()
+            # 常开模式下读线程的 CPU 也算在这次录音上
+            self._record_stats(started, cpu_started - (self.monitor_cpu - monitor_cpu))
+
+            # 回调音频数据后处理函数，缓冲区下次录音会复用，交出去的是拷贝
+            if callback:
+                callback(bytes(self.view[:self.length]))
         except Exception as e:
+            self.is_recording = False
+            self._stop_listening(stream)
             logger.error(f"录音异常: {e}")
 
-    def stop_recording(self):
+    def _next(self, stream, chunks: Optional[queue.Queue]) -> bytes:
+        if chunks is None:
+            return self._read(stream)
+        try:
+            return chunks.get(timeout=1.0)
+        except queue.Empty:
+            logger.warning("录音设备超过 1 秒没有数据")
+            return b""
+
+    def _stop_listening(self, stream) -> None:
+        with self.lock:
+            self.listener = None
+        if stream:
+            stream.close()
+
+    def _record_stats(self, started: float, cpu_started: float) -> None:
+        seconds = time.monotonic() - started
+        cpu = time.thread_time() - cpu_started
+        self.stats.update(seconds=seconds, cpu_seconds=cpu, cpu_percent=cpu / seconds * 100 if seconds else 0.0,
+                          buffer_bytes=len(self.buffer), recorded_bytes=self.length)
+        logger.info(f"录音 {seconds:.1f}s，CPU {cpu * 1000:.0f}ms ({self.stats['cpu_percent']:.1f}%)，"
+                    f"缓冲区 {self.length}/{len(self.buffer)} 字节，读取 {self.stats['reads']} 次，"
+                    f"溢出 {self.stats['overruns']} 次")
+
+    def stop_recording(self, drain: float = 0.0):
+        # drain 秒内继续录音以免截断尾音，有端点检测时说完话就立即结束
         if self.is_recording:
-            self.is_recording = False
+            self.stop_deadline = time.monotonic() + drain
+            self.stop_requested = True
             logger.info("录音结束...")
 
 
 class AudioVolumeControl:
-    def __init__(self):
+    def __init__(self, software_mixer: Optional[Mixer] = None):
         self.volume = 100
+        # 有软件混音器时硬件音量只在启动时设满，之后按键调音量只改软件增益，不再经过 ALSA 混音器
+        self.software_mixer = software_mixer
         if alsaaudio_available:
             self.mixer = alsaaudio.Mixer("Speaker", 0)
+            if software_mixer:
+                self.mixer.setvolume(100)
         self.set(self.volume)
 
     def get(self):
-        if alsaaudio_available:
+        if alsaaudio_available and not self.software_mixer:
             vol = self.mixer.getvolume()
             vol = int(vol[0])
         else:
@@ -133,7 +746,9 @@ class AudioVolumeControl:
 
     def set(self, volume: int):
         self.volume = volume
-        if alsaaudio_available:
+        if self.software_mixer:
+            self.software_mixer.volume = volume
+        elif alsaaudio_available:
             self.mixer.setvolume(volume)
 
     def up(self, step: int = 10):
@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import resource
+import threading
+import numpy as np
+from openai import OpenAI
+from standin.faults import Faults
+from standin.xfyun_server import XfyunStandin
+from standin.chat_server import ChatStandin
+from asr.xf_iat import ASRClient
+from asr.xf_iat import create_session_manager as create_asr_session_manager
+from tts.xf_tts import TTSClient
+from tts.xf_tts import create_session_manager as create_tts_session_manager
+from chat.chat import Chat
+from gateway.server import Gateway, Tenant
+from gateway.client import DeviceClient
+
+logger = logging.getLogger()
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "..", "asr", "samples", "iat_pcm_16k.pcm")
+
+
+def report(rows: list, elapsed: float) -> None:
+    ok = [t for t in rows if "error" not in t]
+    errors = {}
+    for t in rows:
+        if "error" in t:
+            errors[t["error"]] = errors.get(t["error"], 0) + 1
+    print(f"turns={len(rows)} ok={len(ok)} errors={errors} elapsed={elapsed:.1f}s "
+          f"throughput={len(ok) / elapsed:.1f} turns/s")
+    if not ok:
+        return
+    # 设备端从说完(发送 end)开始计时
+    stages = {
+        "asr": [t["asr"] for t in ok],
+        "device_first_audio": [t["device_first_audio"] for t in ok if "device_first_audio" in t],
+        "device_total": [t["device_total"] for t in ok],
+    }
+    print(f"{'stage':20s}{'p50':>10s}{'p95':>10s}{'p99':>10s}   (ms)")
+    for name, values in stages.items():
+        if values:
+            p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+            print(f"{name:20s}{p50:10.1f}{p95:10.1f}{p99:10.1f}")
+
+
+async def device(args: argparse.Namespace, url: str, index: int, pcm: bytes, rows: list) -> None:
+    # 错开上线时间，之后每台设备说 turns 句话，两句之间停 think 秒
+    await asyncio.sleep(args.ramp * index / args.devices)
+    client = DeviceClient(url, f"device-{index}", f"tenant-{index % args.tenants}")
+    try:
+        await client.connect()
+    except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+        logger.error(f"device {index} connect failed: {e}")
+        rows.extend({"error": "connect"} for i in range(args.turns))
+        return
+    for i in range(args.turns):
+        rows.append(await client.turn(pcm, realtime=not args.fast, timeout=args.timeout * 3))
+        await asyncio.sleep(args.think)
+    await client.close()
+
+
+async def drive(args: argparse.Namespace, url: str, pcm: bytes, gateway: Gateway) -> list:
+    rows = []
+    peak = {"threads": 0, "devices": 0}
+    done = asyncio.Event()
+
+    async def sample():
+        while not done.is_set():
+            peak["threads"] = max(peak["threads"], threading.active_count())
+            if gateway:
+                peak["devices"] = max(peak["devices"], gateway.stats()["devices"])
+            await asyncio.sleep(0.1)
+
+    sampler = asyncio.create_task(sample())
+    await asyncio.gather(*(device(args, url, i, pcm, rows) for i in range(args.devices)))
+    done.set()
+    await sampler
+    print(f"peak threads={peak['threads']} peak devices={peak['devices']}")
+    return rows
+
+
+def run(args: argparse.Namespace) -> None:
+    with open(args.sample, "rb") as f:
+        pcm = f.read()[:int(args.utterance * 32000)]
+
+    gateway = None
+    url = args.url
+    if not url:
+        # 网关、替身服务和模拟设备都跑在本进程里，CPU 占用是三者之和
+        xfyun = XfyunStandin(faults=Faults(args.latency, args.jitter, args.failure_rate),
+                             tts_rtf=args.tts_rtf).start_in_thread()
+        chat_standin = ChatStandin(faults=Faults(args.chat_latency, args.chat_jitter, args.failure_rate),
+                                   token_seconds=args.token_seconds).start_in_thread()
+        asr_sessions = create_asr_session_manager("standin", "standin", url=f"{xfyun.url}/v2/iat",
+                                                  pool_size=args.asr_pool).start()
+        tts_sessions = create_tts_session_manager("standin", "standin", url=f"{xfyun.url}/v2/tts",
+                                                  pool_size=args.tts_pool).start()
+        client = OpenAI(api_key="standin", base_url=chat_standin.url, timeout=args.timeout)
+        gateway = Gateway(lambda on_partial: ASRClient(args.timeout, "standin", "standin", "standin",
+                                                       session_manager=asr_sessions, on_partial=on_partial),
+                          lambda: TTSClient(args.timeout, "standin", "standin", "standin",
+                                            session_manager=tts_sessions),
+                          lambda tenant, device: Chat(url=chat_standin.url, model="standin", api_key="standin",
+                                                      client=client),
+                          "你是小燧。", host="127.0.0.1", port=0,
+                          tenants=[Tenant(f"tenant-{i}", args.tenant_limit) for i in range(args.tenants)],
+                          open_tenants=False, allow_anonymous=True, max_turns=args.max_turns,
+                          queue_timeout=args.queue_timeout,
+                          asr_request_timeout=args.timeout, tts_timeout=args.timeout,
+                          tts_fanout=args.tts_fanout).start_in_thread()
+        url = gateway.url
+
+    cpu = os.times()
+    start = time.monotonic()
+    rows = asyncio.run(drive(args, url, pcm, gateway))
+    elapsed = time.monotonic() - start
+    cpu_end = os.times()
+    report(rows, elapsed)
+    cpu_seconds = (cpu_end.user - cpu.user) + (cpu_end.system - cpu.system)
+    print(f"cpu={cpu_seconds:.1f}s ({cpu_seconds / elapsed * 100:.0f}% of one core) "
+          f"maxrss={resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f}MB")
+    if gateway:
+        stats = gateway.stats()
+        print(f"gateway: peak_active={stats['peak_active']} "
+              f"rejected={sum(t['rejected'] for t in stats['tenants'].values())}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多设备网关压测，默认在本进程内启动网关和替身服务")
+    parser.add_argument("--url", default=None, help="压测已经在运行的网关，例如 ws://127.0.0.1:8770/v1/device")
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=2, help="每台设备说几句话")
+    parser.add_argument("--tenants", type=int, default=4)
+    parser.add_argument("--tenant-limit", type=int, default=16, help="每个租户同时进行的轮数")
+    parser.add_argument("--max-turns", type=int, default=64, help="网关同时进行的轮数")
+    parser.add_argument("--queue-timeout", type=float, default=10, help="排队超过这个时间就拒绝(秒)")
+    parser.add_argument("--asr-pool", type=int, default=8)
+    parser.add_argument("--tts-pool", type=int, default=16)
+    parser.add_argument("--tts-fanout", type=int, default=2)
+    parser.add_argument("--ramp", type=float, default=5, help="所有设备在这段时间内陆续上线(秒)")
+    parser.add_argument("--think", type=float, default=1, help="两句话之间的间隔(秒)")
+    parser.add_argument("--utterance", type=float, default=2, help="每句话上传的音频时长(秒)")
+    parser.add_argument("--fast", action="store_true", help="不按实时速率上传音频")
+    parser.add_argument("--sample", default=SAMPLE)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--chat-latency", type=float, default=0.3)
+    parser.add_argument("--chat-jitter", type=float, default=0.1)
+    parser.add_argument("--token-seconds", type=float, default=0.03)
+    parser.add_argument("--tts-rtf", type=float, default=0.1)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=int, default=10)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    run(args)
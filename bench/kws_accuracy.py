@@ -0,0 +1,110 @@
+import os
+import sys
+import glob
+import time
+import logging
+import argparse
+import numpy as np
+from dsp import Resampler, to_float, from_float
+from kws.spotter import KeywordSpotter, extract, load_templates, read_pcm
+
+logger = logging.getLogger()
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "..", "asr", "samples", "iat_pcm_16k.pcm")
+RATE = 16000
+CHUNK = 640
+
+
+def clips(directory: str) -> list:
+    paths = sorted(glob.glob(os.path.join(directory, "*.wav")) + glob.glob(os.path.join(directory, "*.pcm")))
+    return [read_pcm(path) for path in paths]
+
+
+def perturb(x: np.ndarray, rng: np.random.Generator, speed: float, gain_db: float, snr_db: float,
+            pad: float = 0.5) -> bytes:
+    # 变语速(重采样，音调随之变化)、变音量、加白噪声，前后补一段噪声
+    if speed != 1.0:
+        x = Resampler(RATE, int(RATE / speed)).process(x[:, None])[:, 0]
+    x = x * 10 ** (gain_db / 20)
+    x = np.concatenate((np.zeros(int(pad * RATE)), x, np.zeros(int(pad * RATE))))
+    level = np.sqrt(np.mean(x * x))
+    x = x + rng.normal(0, level * 10 ** (-snr_db / 20), len(x))
+    return from_float(np.clip(x, -1, 1)[:, None])
+
+
+def synthetic(rng: np.random.Generator, positives: int) -> tuple:
+    # 没有录好的样本时：从 asr 样例里截一段当“唤醒词”，扰动后作为模板和正样本，
+    # 样例其余部分的扰动版本作为负样本。只用来验证流程和算开销，准确率要用真实录音测
+    x = to_float(read_pcm(SAMPLE))[:, 0].astype(np.float64)
+    start, end = int(0.33 * RATE), int(0.95 * RATE)
+    keyword = x[start:end]
+    rest = np.concatenate((x[:start - RATE // 10], x[end + RATE // 10:]))
+    templates = [extract(perturb(keyword, rng, speed, 0, 40, pad=0.1)) for speed in (0.95, 1.0, 1.05)]
+    pos = [perturb(keyword, rng, rng.uniform(0.85, 1.15), rng.uniform(-12, 6), rng.uniform(10, 30))
+           for i in range(positives)]
+    neg = [perturb(rest, rng, speed, rng.uniform(-12, 6), rng.uniform(10, 30))
+           for speed in np.linspace(0.8, 1.2, 12)]
+    return templates, pos, neg
+
+
+def run(spotter: KeywordSpotter, pcm: bytes, costs: list = None) -> int:
+    detections = 0
+    for offset in range(0, len(pcm), CHUNK):
+        start = time.perf_counter()
+        if spotter.process(pcm[offset:offset + CHUNK]) is not None:
+            detections += 1
+        if costs is not None:
+            costs.append(time.perf_counter() - start)
+    return detections
+
+
+def main(args: argparse.Namespace) -> None:
+    rng = np.random.default_rng(args.seed)
+    if args.synthetic:
+        templates, pos, neg = synthetic(rng, args.positives)
+    else:
+        templates = load_templates(args.templates)
+        pos = clips(args.positives_dir)
+        neg = clips(args.negatives_dir)
+    neg_hours = sum(len(pcm) for pcm in neg) / 2 / RATE / 3600
+    pos_seconds = sum(len(pcm) for pcm in pos) / 2 / RATE
+    print(f"templates={len(templates)} frames={[len(t) for t in templates]} positives={len(pos)} "
+          f"negatives={neg_hours * 60:.1f}min{' (synthetic)' if args.synthetic else ''}")
+
+    print(f"{'threshold':>10s}{'FR %':>10s}{'FA/hour':>10s}")
+    for threshold in args.thresholds:
+        # 正样本：一段里至少检测到一次算通过；负样本：每次检测都算一次误唤醒
+        missed = 0
+        for pcm in pos:
+            if run(KeywordSpotter(templates, threshold=threshold), pcm) == 0:
+                missed += 1
+        false_accepts = sum(run(KeywordSpotter(templates, threshold=threshold), pcm) for pcm in neg)
+        print(f"{threshold:10.2f}{missed / len(pos) * 100:10.1f}{false_accepts / neg_hours:10.1f}")
+
+    # 开销：正负样本连在一起逐块处理，算每块耗时和占实时的比例
+    costs = []
+    spotter = KeywordSpotter(templates, threshold=args.thresholds[0])
+    start = time.process_time()
+    for pcm in pos + neg:
+        run(spotter, pcm, costs)
+    cpu = time.process_time() - start
+    seconds = pos_seconds + neg_hours * 3600
+    p50, p99 = np.percentile(np.array(costs) * 1e6, [50, 99])
+    print(f"cpu={cpu / seconds * 100:.2f}% of one core, per 20ms chunk p50={p50:.0f}us p99={p99:.0f}us "
+          f"max={max(costs) * 1e6:.0f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="唤醒词误唤醒率(FA)和漏检率(FR)，输入 16k 16bit 单声道 wav/pcm")
+    parser.add_argument("--templates", default="kws_templates")
+    parser.add_argument("--positives-dir", default="kws_clips/positive", help="每个文件说一次唤醒词")
+    parser.add_argument("--negatives-dir", default="kws_clips/negative", help="不含唤醒词的说话和环境声")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.12, 0.15, 0.18, 0.2, 0.22, 0.25, 0.3])
+    parser.add_argument("--synthetic", action="store_true", help="没有录音时用 asr 样例合成数据")
+    parser.add_argument("--positives", type=int, default=40, help="合成的正样本数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    main(args)
@@ -0,0 +1,212 @@
+import os
+import sys
+import time
+import threading
+import logging
+import argparse
+import numpy as np
+from openai import OpenAI
+from standin.faults import Faults
+from standin.xfyun_server import XfyunStandin
+from standin.chat_server import ChatStandin
+from asr.xf_iat import ASRClient
+from asr.xf_iat import create_session_manager as create_asr_session_manager
+from asr.hedge import HedgedASR, HedgeStats
+from tts.xf_tts import TTSClient
+from tts.xf_tts import create_session_manager as create_tts_session_manager
+from chat.chat import Chat
+from chat.cache import ResponseCache
+from tts.cache import TTSCache
+from pipeline import VoicePipeline
+
+logger = logging.getLogger()
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "..", "asr", "samples", "iat_pcm_16k.pcm")
+
+
+def report(rows: list) -> None:
+    # 每个阶段单独的耗时，以及从松开按键开始累计的端到端耗时
+    stops = [t["barge_in_stop"] for t in rows if "barge_in_stop" in t]
+    missed = sum(1 for t in rows if t.get("barge_in_missed"))
+    if stops or missed:
+        print(f"barge-in: interrupted={len(stops)} missed={missed} (cancel() found no turn)")
+        if stops:
+            p50, p95, p99 = np.percentile(np.array(stops) * 1000, [50, 95, 99])
+            print(f"barge-in stop (ms): p50={p50:.1f} p95={p95:.1f} p99={p99:.1f}")
+        return
+    ok = [t for t in rows if "error" not in t]
+    print(f"turns={len(rows)} ok={len(ok)} errors={len(rows) - len(ok)}")
+    if not ok:
+        return
+    # 流式模式下第一句断出来就开始合成，tts 阶段从第一句算起
+    spoken = [t.get("first_segment", t["chat"]) for t in ok]
+    stages = {
+        "asr": [t["asr"] for t in ok],
+        "chat_first_sentence": [s - t["asr"] for s, t in zip(spoken, ok)],
+        "chat_total": [t["chat"] - t["asr"] for t in ok],
+        "tts_first_audio": [t["first_audio"] - s for s, t in zip(spoken, ok)],
+        "tts_total": [t["tts"] - s for s, t in zip(spoken, ok)],
+        "e2e_first_audio": [t["first_audio"] for t in ok],
+        "e2e_total": [t["tts"] for t in ok],
+    }
+    print(f"{'stage':20s}{'p50':>10s}{'p95':>10s}{'p99':>10s}   (ms)")
+    for name, values in stages.items():
+        p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+        print(f"{name:20s}{p50:10.1f}{p95:10.1f}{p99:10.1f}")
+
+
+class RealtimeSink:
+    # 按实时速率"播放"的假声卡，用来观察播放引擎的队列深度和欠载
+    def __init__(self, rate: int = 16000):
+        self.rate = rate
+        self.periodsize = 128
+        self.frame_bytes = 2
+        self.period_bytes = self.periodsize * self.frame_bytes
+
+    def write(self, data) -> None:
+        time.sleep(len(data) / self.frame_bytes / self.rate)
+
+
+def barge_in(pipeline: VoicePipeline, playback, asr: ASRClient, pcm: bytes, after: float,
+             tail: bool = False) -> dict:
+    # 开口 after 秒后打断，测量从打断到不再向声卡写数据的时间；
+    # tail 时在合成全部结束、只剩缓冲区里的音频还在播放时再等 after 秒打断
+    timings = {}
+    t = threading.Thread(target=lambda: timings.update(pipeline.run_turn(asr, pcm)))
+    t.start()
+    while playback.depth == 0 and t.is_alive():
+        time.sleep(0.001)
+    turn = pipeline.turn
+    while tail and turn and "tts" not in turn.timings and t.is_alive():
+        time.sleep(0.001)
+    time.sleep(after)
+    start = time.monotonic()
+    if pipeline.cancel():
+        while playback.depth or playback.writing:
+            time.sleep(0.0005)
+        stop = time.monotonic() - start
+        t.join()
+        timings["barge_in_stop"] = stop
+        timings["barge_in_turn_end"] = time.monotonic() - start
+    else:
+        t.join()
+        timings["barge_in_missed"] = True
+    return timings
+
+
+def run(args: argparse.Namespace) -> list:
+    xfyun = XfyunStandin(faults=Faults(args.latency, args.jitter, args.failure_rate, seed=args.seed),
+                         transcript=args.transcript, tts_rtf=args.tts_rtf).start_in_thread()
+    chat_standin = ChatStandin(faults=Faults(args.chat_latency, args.chat_jitter, args.failure_rate,
+                                             seed=args.seed),
+                               token_seconds=args.token_seconds).start_in_thread()
+    chat_standin.reply = chat_standin.reply * args.reply_repeat
+    asr_sessions = create_asr_session_manager("standin", "standin", url=f"{xfyun.url}/v2/iat",
+                                              pool_size=2 if args.hedge else 1).start()
+    tts_sessions = create_tts_session_manager("standin", "standin", url=f"{xfyun.url}/v2/tts",
+                                              pool_size=args.tts_fanout).start()
+    # 替身注入 stall 时请求要靠客户端超时结束，不能用 SDK 默认的 10 分钟
+    client = OpenAI(api_key="standin", base_url=chat_standin.url, timeout=args.timeout)
+    chat = Chat(url=chat_standin.url, model="standin", api_key="standin", max_conversation=args.turns, client=client,
+                history_budget=args.history_budget,
+                response_cache=ResponseCache() if args.chat_cache else None)
+
+    tts_cache = TTSCache(args.tts_cache) if args.tts_cache else None
+    playback = None
+    if args.playback:
+        # audio 模块依赖 pyaudio/alsaaudio，只在需要时导入
+        from audio import PlaybackEngine
+        playback = PlaybackEngine(RealtimeSink())
+    pipeline = VoicePipeline(chat, "你是小燧。",
+                             lambda: TTSClient(args.timeout, "standin", "standin", "standin",
+                                               session_manager=tts_sessions),
+                             playback.write if playback else (lambda audio: None),
+                             asr_request_timeout=args.timeout, stream=not args.no_stream,
+                             tts_timeout=args.timeout, tts_cache=tts_cache, tts_fanout=args.tts_fanout,
+                             flush=playback.flush if playback else None,
+                             drain=playback.drain if playback else None)
+
+    with open(args.sample, "rb") as f:
+        pcm = f.read()
+    chunk = 256  # 与 alsaaudio periodsize=128 的一次读取一致
+
+    def new_asr(on_partial=None, primary=True) -> ASRClient:
+        return ASRClient(args.timeout, "standin", "standin", "standin", session_manager=asr_sessions,
+                         on_partial=on_partial)
+
+    hedge_stats = HedgeStats()
+    rows = []
+    for i in range(args.turns):
+        if args.hedge:
+            asr = HedgedASR(new_asr, hedge_stats, delay=args.hedge_delay)
+        else:
+            asr = new_asr()
+        asr.start_stream(rate=16000)
+        for offset in range(0, len(pcm), chunk):
+            asr.feed(pcm[offset:offset + chunk])
+            if args.realtime:
+                time.sleep(chunk / 32000)
+        # 模拟"边录边送"：松开按键之前录到的音频都已经发出去了
+        while not asr.stream_queue.empty() and not asr.future.done():
+            time.sleep(0.001)
+        if args.barge_in is not None and playback:
+            timings = barge_in(pipeline, playback, asr, pcm, args.barge_in, tail=args.barge_in_tail)
+        else:
+            timings = pipeline.run_turn(asr, pcm)
+        timings["prompt_tokens"] = chat.prompt_tokens
+        rows.append(timings)
+        # 与 App 一样，播放结束后在后台压缩历史
+        chat.compact_history()
+        logger.debug(f"turn {i}: {timings}")
+        time.sleep(args.gap)
+
+    if args.hedge:
+        print(f"hedge: {hedge_stats.snapshot()}")
+    if playback:
+        print(f"playback: {playback.stats()}")
+    print(f"prompt tokens: max={max(t['prompt_tokens'] for t in rows)} last={rows[-1]['prompt_tokens']}, "
+          f"history={len(chat.history.turns)} turns, summary={len(chat.history.summary)} chars")
+    if chat.response_cache:
+        print(f"chat cache: {chat.response_cache.stats()}")
+    if tts_cache:
+        print(f"tts cache: {tts_cache.stats()}")
+    asr_sessions.stop()
+    tts_sessions.stop()
+    chat_standin.stop()
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ASR -> Chat -> TTS 单轮延迟基准，使用本地替身服务")
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--sample", default=SAMPLE)
+    parser.add_argument("--latency", type=float, default=0.05, help="xfyun 替身的响应延迟(秒)")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--chat-latency", type=float, default=0.3)
+    parser.add_argument("--chat-jitter", type=float, default=0.1)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--token-seconds", type=float, default=0.03, help="对话替身每个 token 的生成间隔(秒)")
+    parser.add_argument("--no-stream", action="store_true", help="整段生成、整段合成(旧流程)")
+    parser.add_argument("--tts-cache", default=None, help="合成缓存目录，替身每轮回答相同，第二轮未命中时写入缓存，第三轮起全部命中")
+    parser.add_argument("--playback", action="store_true", help="经播放引擎按实时速率播放")
+    parser.add_argument("--tts-fanout", type=int, default=3, help="并行合成的连接数")
+    parser.add_argument("--reply-repeat", type=int, default=1, help="把替身的回答重复 N 遍，模拟长回答")
+    parser.add_argument("--barge-in", type=float, default=None, help="开口后多少秒打断(需要 --playback)")
+    parser.add_argument("--barge-in-tail", action="store_true",
+                        help="合成结束后、缓冲区里的音频还在播放时打断(配合 --barge-in 的秒数)")
+    parser.add_argument("--history-budget", type=int, default=1000, help="对话历史的 token 预算")
+    parser.add_argument("--chat-cache", action="store_true", help="启用回答缓存(替身识别结果不变，第二轮起命中)")
+    parser.add_argument("--transcript", default="今天天气怎么样", help="替身返回的识别结果")
+    parser.add_argument("--tts-rtf", type=float, default=0.1, help="替身合成的实时率")
+    parser.add_argument("--timeout", type=int, default=10)
+    parser.add_argument("--gap", type=float, default=0.05, help="两轮之间的间隔(秒)")
+    parser.add_argument("--realtime", action="store_true", help="按录音实时速率送音频")
+    parser.add_argument("--hedge", action="store_true", help="启用对冲识别")
+    parser.add_argument("--hedge-delay", type=float, default=None, help="对冲延迟(秒)，默认按 p95 推导")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    report(run(args))
@@ -0,0 +1,99 @@
+import re
+import sys
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 归一化时去掉的标点、空白，以及句首的称呼/客套和句尾的语气词
+PUNCTUATION = re.compile(r"[\s\W_]+", re.UNICODE)
+PREFIX = re.compile(r"^(小燧|小隧|你好|请问|那么|嗯|呃)+")
+SUFFIX = re.compile(r"(呀|啊|呢|吧|嘛|哦|啦)+$")
+
+# 答案随时间变化，或者依赖上下文(指代、追问)的问题不缓存
+CONTEXT_DEPENDENT = re.compile(
+    r"(几点|时间|现在|今天|明天|昨天|后天|今年|星期|礼拜|周几|日期|几号|天气|气温|新闻|最新|"
+    r"刚才|上面|前面|之前|这个|那个|这些|那些|它|他|她|继续|再说|再来|然后呢|为什么|还有|照片|图片)"
+)
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = PUNCTUATION.sub("", text)
+    text = PREFIX.sub("", text)
+    text = SUFFIX.sub("", text)
+    return text
+
+
+def cacheable(text: str) -> bool:
+    normalized = normalize(text)
+    return bool(normalized) and CONTEXT_DEPENDENT.search(normalized) is None
+
+
+class ResponseCache:
+    # 对话回答缓存：键是归一化后的用户问题加系统提示词的哈希，提示词改了自动失效；
+    # 条目有 TTL，总数超过 max_entries 时淘汰最久未用的；依赖时间或上下文的问题不进缓存
+    def __init__(self, max_entries: int = 256, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[Tuple[str, str], Tuple[float, str]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.prompt_hashes = {}
+
+    def key(self, system_prompt: str, user_prompt: str) -> Optional[Tuple[str, str]]:
+        if not cacheable(user_prompt):
+            return None
+        digest = self.prompt_hashes.get(system_prompt)
+        if digest is None:
+            digest = hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()[:16]
+            self.prompt_hashes = {system_prompt: digest}
+        return digest, normalize(user_prompt)
+
+    def get(self, system_prompt: str, user_prompt: str) -> Optional[str]:
+        key = self.key(system_prompt, user_prompt)
+        if key is None:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, system_prompt: str, user_prompt: str, response: str) -> None:
+        key = self.key(system_prompt, user_prompt)
+        if key is None or not response:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+if __name__ == "__main__":
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    cache = ResponseCache(max_entries=2, ttl=60)
+    cache.put("你是小燧。", "你是谁？", "我是小燧。")
+    start = time.perf_counter()
+    response = cache.get("你是小燧。", "小燧，你是谁呀")
+    logger.info(f"hit={response} in {(time.perf_counter() - start) * 1e6:.1f}us")
+    logger.info(f"other prompt={cache.get('你是助手。', '你是谁？')}, "
+                f"time question cacheable={cacheable('现在几点了？')}, stats={cache.stats()}")
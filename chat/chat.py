@@ -1,63 +1,154 @@
 import os
 import sys
 import logging
-import json
+import threading
+from typing import Any, Callable, Iterator, List, Optional, Tuple
 from openai import OpenAI
+from chat.history import ConversationHistory, count_tokens
+from chat.journal import HistoryJournal
+from chat.cache import ResponseCache
+from replay.session import SessionRecorder
 
 logger = logging.getLogger(__name__)
 
 
 class Chat:
-    def __init__(self, url: str, model: str, api_key: str, max_conversation: int = 10, history_path: str = None) -> None:
+    def __init__(self, url: str, model: str, api_key: str, max_conversation: int = 10, history_path: str = None,
+                 history_budget: int = 1000, summary_budget: int = 300,
+                 response_cache: Optional[ResponseCache] = None, client: Optional[OpenAI] = None,
+                 recorder: Optional[SessionRecorder] = None) -> None:
         self.url = url
         self.model = model
         self.api_key = api_key
         self.history_path = history_path
         self.max_conversation = max_conversation
-        self.client = OpenAI(api_key=self.api_key, base_url=self.url)
-        if self.history_path and os.path.exists(self.history_path):
-            with open(self.history_path, "r") as f:
-                self.last_conversation = json.load(f)
-        else:
-            self.last_conversation = []
+        # 网关里多个设备共用一个 client，共享同一个 HTTP 连接池
+        self.client = client or OpenAI(api_key=self.api_key, base_url=self.url)
+        # 可选的回答缓存，命中时不调用模型
+        self.response_cache = response_cache
+        # 历史按 token 预算裁剪，旧对话合并成摘要；summary_budget=0 时只裁剪不摘要
+        self.history = ConversationHistory(budget=history_budget, summary_budget=summary_budget,
+                                           max_turns=max_conversation)
+        # 历史持久化为追加式日志，每轮追加一行，后台写入；旧版的 history.json 会自动迁移
+        self.journal: Optional[HistoryJournal] = None
+        if self.history_path:
+            self.journal = HistoryJournal(self.history_path)
+            legacy_path = os.path.splitext(self.history_path)[0] + ".json"
+            self.journal.load(self.history, legacy_path=legacy_path if legacy_path != self.history_path else None)
+            self.journal.start(self.history)
+        self.prompt_tokens = 0
+        # 可选的会话录制，记下请求的 messages 和回答的增量文本
+        self.recorder = recorder
+
+    @property
+    def last_conversation(self) -> List[Tuple[str, str]]:
+        return self.history.turns
+
+    def _messages(self, system_prompt: str, user_prompt: str) -> list:
+        messages = self.history.messages(system_prompt, user_prompt)
+        self.prompt_tokens = sum(count_tokens(message["content"]) + 4 for message in messages)
+        logger.info(f"Messages({self.prompt_tokens} tokens): {messages}")
+        if self.recorder:
+            self.recorder.chat_request(messages)
+        return messages
+
+    def _remember(self, user_prompt: str, content: str) -> None:
+        self.history.append(user_prompt, content)
+        if self.journal:
+            self.journal.append_turn(user_prompt, content)
+
+    def summarize(self, summary: str, turns: List[Tuple[str, str]]) -> str:
+        # 把旧摘要和更早的几轮对话压缩成一段新摘要
+        dialog = "\n".join(f"用户：{prompt}\n助手：{response}" for prompt, response in turns)
+        completion = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": "你负责压缩对话记录。请用简短的中文概括用户的信息、偏好和已经讨论过的要点，"
+                                              "不超过150字，只输出摘要本身。"},
+                {"role": "user", "content": f"已有摘要：{summary or '无'}\n新的对话：\n{dialog}"}
+            ],
+            temperature=0.1,
+            max_tokens=200
+        )
+        return completion.choices[0].message.content
+
+    def close(self) -> None:
+        # 停止日志写线程并关闭文件，排队中的记录先写完
+        if self.journal:
+            self.journal.close()
+
+    def compact_history(self) -> Optional[threading.Thread]:
+        # 播放结束后调用，在后台把超出预算的旧对话合并成摘要，不占用下一轮的响应时间
+        if not self.history.summary_enabled or not self.history.overflow():
+            return None
+        t = threading.Thread(target=self._fold, name="chat-summary", daemon=True)
+        t.start()
+        return t
+
+    def _fold(self) -> None:
+        n = self.history.fold(self.summarize)
+        if n and self.journal:
+            self.journal.append_fold(n, self.history.summary)
+
+    def _cached(self, system_prompt: str, user_prompt: str) -> Optional[str]:
+        if not self.response_cache:
+            return None
+        content = self.response_cache.get(system_prompt, user_prompt)
+        if content is not None:
+            logger.info(f"response cache hit: {user_prompt}")
+            self._remember(user_prompt, content)
+        return content
 
     def __call__(self, system_prompt: str, user_prompt: str) -> str:
-        messages = [
-            {
-                "role": "system",
-                "content": system_prompt
-            }
-        ]
-        if self.last_conversation:
-            for (prompt, response) in self.last_conversation:
-                messages.append({
-                    "role": "user",
-                    "content": prompt
-                })
-                messages.append({
-                    "role": "assistant",
-                    "content": response
-                })
-        messages.append({
-                "role": "user",
-                "content": user_prompt
-            })
-        logger.info(f"Messages: {messages}")
+        content = self._cached(system_prompt, user_prompt)
+        if content is not None:
+            return content
         completion = self.client.chat.completions.create(
             model=self.model,
-            messages=messages,
+            messages=self._messages(system_prompt, user_prompt),
             temperature=0.1,
             max_tokens=500
         )
         content = completion.choices[0].message.content
-        if len(self.last_conversation) > self.max_conversation:
-            self.last_conversation.pop(0)
-        self.last_conversation.append((user_prompt, content))
-        with open(self.history_path, "w") as f:
-            json.dump(self.last_conversation, f)
-            f.flush()
+        if self.recorder:
+            self.recorder.chat_delta(content)
+        self._remember(user_prompt, content)
+        if self.response_cache:
+            self.response_cache.put(system_prompt, user_prompt, content)
         return content
 
+    def stream(self, system_prompt: str, user_prompt: str,
+               on_stream: Optional[Callable[[Any], None]] = None) -> Iterator[str]:
+        # 流式返回回答的增量文本，完整读完之后才写入对话历史；
+        # on_stream 拿到底层的流对象，其他线程调用它的 close() 可以立即断开 HTTP 连接(打断)
+        content = self._cached(system_prompt, user_prompt)
+        if content is not None:
+            yield content
+            return
+        completion = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(system_prompt, user_prompt),
+            temperature=0.1,
+            max_tokens=500,
+            stream=True
+        )
+        if on_stream:
+            on_stream(completion)
+        content = ""
+        with completion:
+            for chunk in completion:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if self.recorder:
+                        self.recorder.chat_delta(delta)
+                    content += delta
+                    yield delta
+        self._remember(user_prompt, content)
+        if self.response_cache:
+            self.response_cache.put(system_prompt, user_prompt, content)
+
 
 if __name__ == "__main__":
     from dotenv import load_dotenv
@@ -84,3 +175,5 @@ if __name__ == "__main__":
                      '你回答的内容必须符合中国的法律和道德约束，不得损害他人利益，要保护青少年身心健康，切记！\n')
     response = chat(system_prompt, "你是谁，你可以做什么？")
     logger.info(f"Response: {response}")
+    for delta in chat.stream(system_prompt, "给我讲一个简短的笑话"):
+        logger.info(f"Delta: {delta}")
@@ -0,0 +1,129 @@
+import re
+import sys
+import logging
+import threading
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 中日韩字符大约一个字一个 token，其余按 4 个字符一个 token 估算，不依赖具体模型的分词器
+CJK = re.compile(r"[　-〿㐀-䶿一-鿿豈-﫿＀-￯]")
+
+SUMMARY_PREFIX = "以下是你和用户之前对话的摘要：\n"
+
+Turn = Tuple[str, str]
+
+
+def count_tokens(text: str) -> int:
+    cjk = len(CJK.findall(text))
+    rest = len(CJK.sub("", text).strip())
+    return cjk + (rest + 3) // 4
+
+
+def turn_tokens(turn: Turn) -> int:
+    # 每条消息另加 4 个 token 的角色和分隔开销
+    return count_tokens(turn[0]) + count_tokens(turn[1]) + 8
+
+
+class ConversationHistory:
+    # 按 token 预算管理对话历史：发给模型的历史(摘要 + 最近几轮)不超过 budget；
+    # 超出预算的旧对话由 fold() 合并进滚动摘要，fold() 会调用模型，应在播放结束后放到后台执行
+    def __init__(self, budget: int = 1000, summary_budget: int = 300, max_turns: int = 10,
+                 turns: Optional[List[Turn]] = None, summary: str = ""):
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self.max_turns = max_turns
+        self.turns: List[Turn] = [tuple(turn) for turn in (turns or [])]
+        self.summary = summary
+        self.lock = threading.Lock()
+        self.folding = False
+
+    def append(self, prompt: str, response: str) -> None:
+        with self.lock:
+            self.turns.append((prompt, response))
+            # 摘要一直失败时也不能无限增长
+            limit = self.max_turns * 2 if self.summary_enabled else self.max_turns
+            while len(self.turns) > limit:
+                self.turns.pop(0)
+
+    @property
+    def summary_enabled(self) -> bool:
+        return self.summary_budget > 0
+
+    def recent(self) -> Tuple[str, List[Turn]]:
+        # 从最新一轮往前取，直到放不下为止；摘要优先占用预算
+        with self.lock:
+            summary = self.summary
+            used = count_tokens(summary) if summary else 0
+            recent: List[Turn] = []
+            for turn in reversed(self.turns[-self.max_turns:]):
+                used += turn_tokens(turn)
+                if used > self.budget:
+                    break
+                recent.insert(0, turn)
+            return summary, recent
+
+    def messages(self, system_prompt: str, user_prompt: str) -> list:
+        summary, recent = self.recent()
+        if summary:
+            system_prompt = f"{system_prompt}\n{SUMMARY_PREFIX}{summary}"
+        messages = [{"role": "system", "content": system_prompt}]
+        for (prompt, response) in recent:
+            messages.append({"role": "user", "content": prompt})
+            messages.append({"role": "assistant", "content": response})
+        messages.append({"role": "user", "content": user_prompt})
+        return messages
+
+    def overflow(self) -> List[Turn]:
+        # 已经不在最近窗口里的旧对话，等待合并进摘要
+        summary, recent = self.recent()
+        with self.lock:
+            return self.turns[:len(self.turns) - len(recent)]
+
+    def fold(self, summarizer: Callable[[str, List[Turn]], str]) -> int:
+        # 把窗口外的旧对话和原摘要一起交给 summarizer 生成新摘要；返回合并掉的轮数
+        with self.lock:
+            if self.folding or not self.summary_enabled:
+                return 0
+            self.folding = True
+        try:
+            old = self.overflow()
+            if not old:
+                return 0
+            summary = summarizer(self.summary, old)
+            summary = self._truncate(summary.strip())
+            with self.lock:
+                # 合并期间可能追加了新的对话，只删掉已经合并的那部分
+                if self.turns[:len(old)] != old:
+                    return 0
+                del self.turns[:len(old)]
+                self.summary = summary
+            logger.info(f"folded {len(old)} turns into summary ({count_tokens(summary)} tokens)")
+            return len(old)
+        except Exception as e:
+            logger.error(f"summarize history failed: {e}")
+            return 0
+        finally:
+            with self.lock:
+                self.folding = False
+
+    def _truncate(self, summary: str) -> str:
+        # 摘要本身也有上限，超出时保留后面(更新的)内容
+        while summary and count_tokens(summary) > self.summary_budget:
+            summary = summary[max(1, len(summary) // 10):]
+        return summary
+
+    def tokens(self) -> int:
+        summary, recent = self.recent()
+        return (count_tokens(summary) if summary else 0) + sum(turn_tokens(turn) for turn in recent)
+
+
+if __name__ == "__main__":
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    history = ConversationHistory(budget=120, summary_budget=40)
+    for i in range(10):
+        history.append(f"第{i}个问题，今天天气怎么样？", f"第{i}个回答，今天天气晴，最高气温二十五度，适合出门散步。")
+        history.fold(lambda summary, turns: summary + "".join(f"用户问了{prompt[:4]}。" for prompt, _ in turns))
+        logger.info(f"turns={len(history.turns)} tokens={history.tokens()} summary={history.summary}")
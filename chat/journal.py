@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import threading
+from typing import Optional
+from chat.history import ConversationHistory
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryJournal:
+    # 对话历史的追加式日志(JSONL)，每轮只追加一行，由后台线程写入，不在响应路径上：
+    #   {"t": "turn", "prompt": ..., "response": ...}   新的一轮对话
+    #   {"t": "fold", "n": 3, "summary": ...}            最早的 n 轮合并进了摘要
+    #   {"t": "snapshot", "summary": ..., "turns": [...]} 压缩后的完整状态，总是第一行
+    # fsync 按 fsync_interval 批量进行；追加满 compact_every 行后写快照(临时文件 + 改名)压缩日志。
+    # 加载时逐行重放，断电造成的半行或损坏的行直接跳过。
+    def __init__(self, path: str, fsync_interval: float = 1.0, compact_every: int = 200):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.queue: queue.Queue = queue.Queue()
+        self.records = 0
+        self.file = None
+        self.thread: Optional[threading.Thread] = None
+
+    def load(self, history: ConversationHistory, legacy_path: Optional[str] = None) -> ConversationHistory:
+        # 重放日志恢复历史；日志不存在时从旧的 history.json 迁移
+        if not os.path.exists(self.path) and legacy_path and os.path.exists(legacy_path):
+            try:
+                with open(legacy_path, "r") as f:
+                    for prompt, response in json.load(f):
+                        history.append(prompt, response)
+                logger.info(f"migrated {len(history.turns)} turns from {legacy_path}")
+            except (ValueError, TypeError) as e:
+                logger.error(f"legacy history {legacy_path} is corrupt: {e}")
+            self.records = self.compact_every
+            return history
+
+        bad = 0
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                for line in f:
+                    try:
+                        self.apply(history, json.loads(line))
+                        self.records += 1
+                    except (ValueError, KeyError, TypeError):
+                        bad += 1
+        if bad:
+            # 有坏行时尽快写一次快照，把日志恢复成干净的状态
+            logger.warning(f"skipped {bad} corrupt records in {self.path}")
+            self.records = self.compact_every
+        return history
+
+    @staticmethod
+    def apply(history: ConversationHistory, record: dict) -> None:
+        kind = record["t"]
+        if kind == "turn":
+            history.append(record["prompt"], record["response"])
+        elif kind == "fold":
+            del history.turns[:record["n"]]
+            history.summary = record["summary"]
+        elif kind == "snapshot":
+            history.turns = [tuple(turn) for turn in record["turns"]]
+            history.summary = record["summary"]
+        else:
+            raise KeyError(kind)
+
+    def start(self, history: ConversationHistory) -> "HistoryJournal":
+        # 写线程维护一份自己的副本，快照只反映已经写进日志的记录，不会和排队中的记录重复
+        self.mirror = ConversationHistory(max_turns=history.max_turns, summary_budget=history.summary_budget,
+                                          turns=list(history.turns), summary=history.summary)
+        self.thread = threading.Thread(target=self._writer_daemon, name="history-journal", daemon=True)
+        self.thread.start()
+        return self
+
+    def append_turn(self, prompt: str, response: str) -> None:
+        self.queue.put({"t": "turn", "prompt": prompt, "response": response})
+
+    def append_fold(self, n: int, summary: str) -> None:
+        self.queue.put({"t": "fold", "n": n, "summary": summary})
+
+    def close(self, timeout: Optional[float] = 5) -> None:
+        self.queue.put(None)
+        if self.thread:
+            self.thread.join(timeout)
+
+    def _open(self):
+        if self.file is None:
+            self.file = open(self.path, "ab")
+        return self.file
+
+    def _writer_daemon(self) -> None:
+        dirty = False
+        last_sync = time.monotonic()
+        if self.records >= self.compact_every:
+            self._compact()
+        while True:
+            try:
+                timeout = max(0.0, self.fsync_interval - (time.monotonic() - last_sync)) if dirty else None
+                record = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                record = False
+            try:
+                if record:
+                    self.apply(self.mirror, record)
+                    f = self._open()
+                    f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+                    f.flush()
+                    self.records += 1
+                    dirty = True
+                    if not self.queue.empty():
+                        # 还有排队的记录，攒在一起 fsync
+                        continue
+                if dirty and (record is None or time.monotonic() - last_sync >= self.fsync_interval):
+                    os.fsync(self.file.fileno())
+                    last_sync = time.monotonic()
+                    dirty = False
+                if not dirty and self.records >= self.compact_every:
+                    self._compact()
+            except OSError as e:
+                logger.error(f"history journal write failed: {e}")
+            if record is None:
+                if self.file:
+                    self.file.close()
+                    self.file = None
+                return
+
+    def _compact(self) -> None:
+        try:
+            self.compact()
+        except OSError as e:
+            logger.error(f"history journal compaction failed: {e}")
+
+    def compact(self) -> None:
+        # 把当前状态写成只有一行快照的新日志，原子替换旧日志
+        snapshot = {"t": "snapshot", "summary": self.mirror.summary, "turns": list(self.mirror.turns)}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(json.dumps(snapshot, ensure_ascii=False).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if self.file:
+            self.file.close()
+            self.file = None
+        os.replace(tmp, self.path)
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self.records = 1
+        logger.info(f"history journal compacted, {len(snapshot['turns'])} turns")
+
+
+if __name__ == "__main__":
+    import tempfile
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    path = os.path.join(tempfile.mkdtemp(), "history.jsonl")
+    history = ConversationHistory(max_turns=5)
+    journal = HistoryJournal(path, compact_every=8).start(history)
+    for i in range(12):
+        history.append(f"问题{i}", f"回答{i}")
+        journal.append_turn(f"问题{i}", f"回答{i}")
+    journal.close()
+    # 模拟断电留下的半行
+    with open(path, "ab") as f:
+        f.write(b'{"t": "turn", "prompt": "\xe9\x97')
+    restored = HistoryJournal(path).load(ConversationHistory(max_turns=5))
+    logger.info(f"restored={restored.turns == history.turns} turns={restored.turns}")
@@ -0,0 +1,299 @@
+import sys
+import math
+import time
+import logging
+from math import gcd
+from typing import Optional
+import numpy as np
+
+logger = logging.getLogger()
+
+# 采样宽度(字节) -> 满幅值，S16/S24(3 字节紧凑)/S32 小端
+FULL_SCALE = {2: 32768.0, 3: 8388608.0, 4: 2147483648.0}
+
+
+def to_float(data: bytes, width: int = 2, channels: int = 1) -> np.ndarray:
+    # PCM 字节 -> (帧数, 声道数) 的 float32，范围 [-1, 1)
+    if width == 3:
+        b = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        # 高字节按有符号数扩展
+        x = b[:, 0].astype(np.int32) | (b[:, 1].astype(np.int32) << 8) | (b[:, 2].astype(np.int8).astype(np.int32) << 16)
+    else:
+        x = np.frombuffer(data, dtype=f'<i{width}')
+    return (x.astype(np.float32) / np.float32(FULL_SCALE[width])).reshape(-1, channels)
+
+
+def from_float(x: np.ndarray, width: int = 2) -> bytes:
+    scale = FULL_SCALE[width]
+    y = np.clip(np.round(x.astype(np.float64 if width == 4 else np.float32) * scale), -scale, scale - 1)
+    if width == 3:
+        return y.astype('<i4').reshape(-1).view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    return y.astype(f'<i{width}').tobytes()
+
+
+def mix_channels(x: np.ndarray, channels: int) -> np.ndarray:
+    # 多声道混成单声道取平均，单声道扩展到多声道直接复制，其余情况按声道序号循环取
+    if x.shape[1] == channels:
+        return x
+    if channels == 1:
+        return x.mean(axis=1, keepdims=True, dtype=np.float32)
+    return x[:, np.arange(channels) % x.shape[1]]
+
+
+def soft_clip(x: np.ndarray, knee: float = 0.8) -> np.ndarray:
+    # 幅度超过 knee 的部分用 tanh 平滑压进 [-1, 1]，不像硬削波那样产生刺耳的高次谐波
+    a = np.abs(x)
+    over = a > knee
+    if not over.any():
+        return x
+    x = x.copy()
+    r = 1.0 - knee
+    x[over] = np.sign(x[over]) * (knee + r * np.tanh((a[over] - knee) / r))
+    return x
+
+
+class Resampler:
+    # 流式有理数重采样：up 倍插值、加窗 sinc 低通、down 倍抽取，多相分解后只计算要输出的样本。
+    # 块之间保留 taps - 1 个输入样本的历史，分块处理和整段处理的结果完全一致
+    def __init__(self, from_rate: int, to_rate: int, channels: int = 1, taps: int = 48,
+                 cutoff: Optional[float] = None):
+        g = gcd(from_rate, to_rate)
+        self.up = to_rate // g
+        self.down = from_rate // g
+        self.from_rate = from_rate
+        self.to_rate = to_rate
+        self.channels = channels
+        # taps 是每个相位的抽头数，滤波器总长 taps * up
+        self.taps = taps
+        cutoff = cutoff or 0.45 * min(from_rate, to_rate)
+        n = np.arange(taps * self.up) - (taps * self.up - 1) / 2
+        fc = cutoff / (from_rate * self.up)
+        h = 2 * fc * np.sinc(2 * fc * n) * np.hamming(len(n))
+        h = h / h.sum() * self.up
+        # bank[p, j] = h[p + j * up]：相位 p 的输出由 x[n], x[n-1], ... x[n-taps+1] 加权得到
+        self.bank = h.reshape(taps, self.up).T.astype(np.float32)
+        self.offsets = np.arange(taps)
+        self.reset()
+
+    def reset(self) -> None:
+        self.history = np.zeros((self.taps - 1, self.channels), dtype=np.float32)
+        self.consumed = 0  # 已输入的样本总数
+        self.produced = 0  # 已输出的样本总数
+
+    @property
+    def passthrough(self) -> bool:
+        return self.up == self.down == 1
+
+    def process(self, x: np.ndarray) -> np.ndarray:
+        # x 是 (帧数, 声道数) 的 float32，返回这一块能算出的全部输出样本
+        if self.passthrough:
+            return x
+        buf = np.concatenate((self.history, x))
+        total = self.consumed + len(x)
+        # 输出样本 k 位于输入的 k * down / up 处，用到的最新输入是 floor(k * down / up)，必须 < total
+        end = -(-total * self.up // self.down)
+        pos = np.arange(self.produced, end, dtype=np.int64) * self.down
+        newest = pos // self.up - (self.consumed - (self.taps - 1))
+        frames = buf[newest[:, None] - self.offsets[None, :]]
+        y = np.einsum('kj,kjc->kc', self.bank[pos % self.up], frames)
+        self.history = buf[len(buf) - (self.taps - 1):]
+        self.consumed = total
+        self.produced = end
+        return y
+
+
+class AudioConverter:
+    # 字节流进、字节流出：采样格式、声道数、采样率一起转换；不足一帧的尾巴留到下一块。
+    # 用于按声卡原生格式录音/播放，在进程内只转换一次，不再经过 ALSA plug 层
+    def __init__(self, from_rate: int, to_rate: int, from_channels: int = 1, to_channels: int = 1,
+                 from_width: int = 2, to_width: int = 2, taps: int = 48, cutoff: Optional[float] = None):
+        self.from_channels = from_channels
+        self.to_channels = to_channels
+        self.from_width = from_width
+        self.to_width = to_width
+        self.frame_bytes = from_width * from_channels
+        # 声道数减少时先混音再重采样，增加时反过来，重采样的声道数总是较少的那个
+        self.resampler = Resampler(from_rate, to_rate, min(from_channels, to_channels), taps=taps,
+                                   cutoff=cutoff)
+        self.remainder = b""
+
+    @property
+    def passthrough(self) -> bool:
+        return self.resampler.passthrough and self.from_channels == self.to_channels and \
+            self.from_width == self.to_width
+
+    def reset(self) -> None:
+        self.resampler.reset()
+        self.remainder = b""
+
+    def convert(self, data: bytes) -> bytes:
+        if self.passthrough:
+            return bytes(data)
+        if self.remainder:
+            data = self.remainder + bytes(data)
+        n = len(data) // self.frame_bytes * self.frame_bytes
+        self.remainder = bytes(data[n:])
+        if n == 0:
+            return b""
+        x = to_float(memoryview(data)[:n], self.from_width, self.from_channels)
+        if self.to_channels < self.from_channels:
+            x = mix_channels(x, self.to_channels)
+        x = self.resampler.process(x)
+        if self.to_channels > self.from_channels:
+            x = mix_channels(x, self.to_channels)
+        return from_float(x, self.to_width)
+
+
+class CapturePreprocessor:
+    # 录音预处理，送 ASR 之前分块处理，状态跨块保持：
+    # 去直流(一阶 IIR，按块用累加和向量化) -> 高通(线性相位 FIR，滤掉风扇、车辆等低频噪声)
+    # -> 自动增益(按块 RMS 调整，低于 gate_dbfs 视为静音保持增益不变，块内线性过渡) -> 软限幅
+    DC_BLOCK = 256
+
+    def __init__(self, rate: int = 16000, channels: int = 1, width: int = 2, dc_pole: float = 0.995,
+                 highpass_hz: float = 120, taps: int = 401, target_dbfs: float = -20, max_gain_db: float = 24,
+                 min_gain_db: float = -12, gate_dbfs: float = -50, attack_ms: float = 20,
+                 release_ms: float = 800, limit: float = 0.9):
+        self.rate = rate
+        self.channels = channels
+        self.width = width
+        self.frame_bytes = width * channels
+        self.pole = dc_pole
+        # pole 的 0..DC_BLOCK-1 次幂和它们的倒数，一块之内 y[k] = R^k * (R * y[-1] + sum(d[j] * R^-j))
+        self.powers = dc_pole ** np.arange(self.DC_BLOCK, dtype=np.float64)
+        self.inverse = 1.0 / self.powers
+        # 高通 = 单位冲激 - 低通，直流增益为 0；群时延 (taps - 1) / 2 个样本
+        self.taps = taps | 1
+        if highpass_hz:
+            n = np.arange(self.taps) - (self.taps - 1) / 2
+            fc = highpass_hz / rate
+            h = 2 * fc * np.sinc(2 * fc * n) * np.hamming(self.taps)
+            h = -h / h.sum()
+            h[(self.taps - 1) // 2] += 1.0
+            self.highpass: Optional[np.ndarray] = h.astype(np.float32)
+        else:
+            self.highpass = None
+        self.target_dbfs = target_dbfs
+        self.max_gain_db = max_gain_db
+        self.min_gain_db = min_gain_db
+        self.gate_dbfs = gate_dbfs
+        self.attack = attack_ms / 1000
+        self.release = release_ms / 1000
+        self.limit = limit
+        # 增益跨录音保留，下一句从上一句的增益开始
+        self.gain_db = 0.0
+        # 统计
+        self.clipped_samples = 0
+        self.limited_blocks = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self.remainder = b""
+        self.dc_x = np.zeros(self.channels, dtype=np.float64)
+        self.dc_y = np.zeros(self.channels, dtype=np.float64)
+        self.history = np.zeros((self.taps - 1, self.channels), dtype=np.float32)
+
+    def _dc_block(self, x: np.ndarray) -> np.ndarray:
+        # y[n] = x[n] - x[n-1] + R * y[n-1]
+        d = np.diff(x, axis=0, prepend=self.dc_x[None, :])
+        self.dc_x = x[-1].astype(np.float64)
+        y = np.empty(x.shape, dtype=np.float64)
+        for start in range(0, len(x), self.DC_BLOCK):
+            seg = d[start:start + self.DC_BLOCK]
+            m = len(seg)
+            acc = self.pole * self.dc_y + np.cumsum(seg * self.inverse[:m, None], axis=0)
+            y[start:start + m] = self.powers[:m, None] * acc
+            self.dc_y = y[start + m - 1]
+        return y.astype(np.float32)
+
+    def _high_pass(self, x: np.ndarray) -> np.ndarray:
+        if self.highpass is None:
+            return x
+        buf = np.concatenate((self.history, x))
+        self.history = buf[len(buf) - (self.taps - 1):]
+        y = np.empty_like(x)
+        for c in range(self.channels):
+            y[:, c] = np.convolve(buf[:, c], self.highpass, 'valid')
+        return y
+
+    def _gain(self, x: np.ndarray) -> np.ndarray:
+        # 标量部分用 math，逐块调用时 numpy 标量运算的开销比计算本身还大
+        seconds = len(x) / self.rate
+        flat = x.reshape(-1)
+        level_db = 10 * math.log10(float(np.dot(flat, flat)) / len(flat) + 1e-12)
+        gain_db = self.gain_db
+        if level_db > self.gate_dbfs:
+            desired = min(max(self.target_dbfs - level_db, self.min_gain_db), self.max_gain_db)
+            tau = self.attack if desired < gain_db else self.release
+            gain_db = desired + (gain_db - desired) * math.exp(-seconds / tau)
+        # 这一块的峰值乘上增益后不超过 limit，突然的大声立即压下来
+        peak = max(float(flat.max()), -float(flat.min()))
+        if peak > 0:
+            gain_db = min(gain_db, 20 * math.log10(self.limit / peak))
+        ramp = np.linspace(10 ** (self.gain_db / 20), 10 ** (gain_db / 20), len(x), dtype=np.float32)
+        self.gain_db = gain_db
+        x = x * ramp[:, None]
+        y = soft_clip(x, self.limit)
+        if y is not x:
+            self.limited_blocks += 1
+        return y
+
+    def process(self, data: bytes) -> bytes:
+        # 输出和输入等长(不足一帧的尾巴留到下一块)，整体比输入晚高通滤波器的群时延
+        if self.remainder:
+            data = self.remainder + bytes(data)
+        n = len(data) // self.frame_bytes * self.frame_bytes
+        self.remainder = bytes(data[n:])
+        if n == 0:
+            return b""
+        x = to_float(memoryview(data)[:n], self.width, self.channels)
+        self.clipped_samples += int(np.count_nonzero(np.abs(x) >= 0.999))
+        return from_float(self._gain(self._high_pass(self._dc_block(x))), self.width)
+
+    def stats(self) -> dict:
+        return {"gain_db": round(self.gain_db, 1), "clipped_samples": self.clipped_samples,
+                "limited_blocks": self.limited_blocks}
+
+
+if __name__ == "__main__":
+    # 每 20ms 一块的转换耗时，以及占实时的比例
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    cases = [("capture 48k stereo s32 -> 16k mono s16", 48000, 16000, 2, 1, 4, 2),
+             ("capture 44.1k stereo s16 -> 16k mono s16", 44100, 16000, 2, 1, 2, 2),
+             ("playback 16k mono s16 -> 48k stereo s16", 16000, 48000, 1, 2, 2, 2),
+             ("asr 16k mono s16 -> 8k mono s16", 16000, 8000, 1, 1, 2, 2)]
+    for name, from_rate, to_rate, from_channels, to_channels, from_width, to_width in cases:
+        converter = AudioConverter(from_rate, to_rate, from_channels, to_channels, from_width, to_width)
+        t = np.arange(from_rate * 10) / from_rate
+        signal = np.repeat((0.5 * np.sin(2 * np.pi * 440 * t))[:, None], from_channels, axis=1)
+        data = from_float(signal, from_width)
+        chunk = from_rate // 50 * converter.frame_bytes
+        start = time.perf_counter()
+        out = b"".join(converter.convert(data[i:i + chunk]) for i in range(0, len(data), chunk))
+        seconds = time.perf_counter() - start
+        whole = AudioConverter(from_rate, to_rate, from_channels, to_channels, from_width, to_width).convert(data)
+        logger.info(f"{name}: {seconds / 500 * 1e6:.0f}us per 20ms chunk, {seconds / 10 * 100:.2f}% of realtime, "
+                    f"out={len(out)} bytes, chunked == whole: {out == whole}")
+
+    # 录音预处理：安静的 300Hz 语音基音叠加直流和 50Hz 工频噪声，逐块处理，看每块耗时的分布和处理后的电平
+    rate = 16000
+    t = np.arange(rate * 10) / rate
+    signal = 0.01 * np.sin(2 * np.pi * 300 * t) + 0.05 + 0.02 * np.sin(2 * np.pi * 50 * t)
+    data = from_float(signal[:, None])
+    preprocessor = CapturePreprocessor(rate)
+    chunk = rate // 50 * 2
+    costs = []
+    out = []
+    for i in range(0, len(data), chunk):
+        start = time.perf_counter()
+        out.append(preprocessor.process(data[i:i + chunk]))
+        costs.append(time.perf_counter() - start)
+    p50, p99 = np.percentile(np.array(costs) * 1e6, [50, 99])
+    y = to_float(b"".join(out))[-rate:, 0]
+    spectrum = np.abs(np.fft.rfft(y))
+    logger.info(f"capture preprocess 16k mono s16: p50={p50:.0f}us p99={p99:.0f}us per 20ms chunk "
+                f"({p99 / 20000 * 100:.2f}% of the period), out level={20 * np.log10(np.sqrt(np.mean(y * y))):.1f}dBFS "
+                f"dc={y.mean():.1e} hum(50Hz)/voice(300Hz)={20 * np.log10(spectrum[50] / spectrum[300]):.1f}dB "
+                f"{preprocessor.stats()}")
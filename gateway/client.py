@@ -0,0 +1,109 @@
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from typing import Optional
+from urllib.parse import urlencode
+from gateway.wsproto import WebSocket, ConnectionClosed, OP_BINARY, connect
+
+logger = logging.getLogger()
+
+
+class DeviceClient:
+    # 设备端的最小实现，也用于网关压测：上传一句话的 PCM，接收识别中间结果、合成的 PCM 和本轮结束事件
+    def __init__(self, url: str, device: str, tenant: str = "default", token: Optional[str] = None):
+        query = {"device": device, "tenant": tenant}
+        if token:
+            query["token"] = token
+        self.url = f"{url}?{urlencode(query)}"
+        self.device = device
+        self.ws: Optional[WebSocket] = None
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.receiver: Optional[asyncio.Task] = None
+        self.turns = 0
+        self.audio_at: Optional[float] = None
+        self.audio_bytes = 0
+
+    async def connect(self, timeout: float = 10) -> "DeviceClient":
+        self.ws = await connect(self.url, timeout)
+        self.receiver = asyncio.create_task(self._receive())
+        return self
+
+    async def _receive(self) -> None:
+        # 音频只计数，事件交给 turn()
+        try:
+            while True:
+                opcode, payload = await self.ws.recv()
+                if opcode == OP_BINARY:
+                    if self.audio_at is None:
+                        self.audio_at = time.monotonic()
+                    self.audio_bytes += len(payload)
+                else:
+                    self.inbox.put_nowait(json.loads(payload))
+        except (ConnectionClosed, ConnectionError, asyncio.IncompleteReadError):
+            self.inbox.put_nowait(None)
+
+    async def turn(self, pcm: bytes, chunk: int = 1280, realtime: bool = True, timeout: float = 60) -> dict:
+        # 返回网关给出的各阶段耗时，加上设备端看到的首包和结束时间(从发送 end 开始计时)
+        self.turns += 1
+        self.audio_bytes = 0
+        for offset in range(0, len(pcm), chunk):
+            await self.ws.send(pcm[offset:offset + chunk])
+            if realtime:
+                await asyncio.sleep(chunk / 32000)
+        end = time.monotonic()
+        self.audio_at = None
+        await self.ws.send(json.dumps({"type": "end"}))
+        deadline = end + timeout
+        while True:
+            try:
+                event = await asyncio.wait_for(self.inbox.get(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                return {"error": "timeout"}
+            if event is None:
+                return {"error": "disconnected"}
+            if event.get("type") == "done" and event.get("turn") == self.turns:
+                break
+        timings = dict(event.get("timings", {}))
+        timings["device_total"] = time.monotonic() - end
+        if self.audio_at is not None:
+            timings["device_first_audio"] = self.audio_at - end
+        timings["audio_bytes"] = self.audio_bytes
+        return timings
+
+    async def cancel(self) -> None:
+        await self.ws.send(json.dumps({"type": "cancel"}))
+
+    async def close(self) -> None:
+        # 接收任务还在读 socket，这里不等对端的 close 帧
+        if self.ws:
+            await self.ws.close(wait=False)
+        if self.receiver:
+            try:
+                await asyncio.wait_for(self.receiver, 1.0)
+            except asyncio.TimeoutError:
+                pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="网关设备端模拟：上传一段 PCM，打印识别结果和回答")
+    parser.add_argument("--url", default="ws://127.0.0.1:8770/v1/device")
+    parser.add_argument("--device", default="device-0")
+    parser.add_argument("--tenant", default="default")
+    parser.add_argument("--token", default=None)
+    parser.add_argument("pcm", help="16k 16bit 单声道 PCM 文件")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    async def main():
+        client = await DeviceClient(args.url, args.device, args.tenant, args.token).connect()
+        with open(args.pcm, "rb") as f:
+            timings = await client.turn(f.read())
+        logger.info(f"timings={timings}")
+        await client.close()
+
+    asyncio.run(main())
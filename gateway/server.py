@@ -0,0 +1,480 @@
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import asyncio
+import logging
+import argparse
+import threading
+import concurrent.futures
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from gateway.wsproto import WebSocket, ConnectionClosed, handshake, OP_BINARY
+from asr.xf_iat import ASRClient
+from tts.xf_tts import TTSClient
+from tts.cache import TTSCache
+from chat.chat import Chat
+from pipeline import VoicePipeline
+
+logger = logging.getLogger()
+
+DEVICE_PATH = "/v1/device"
+# 设备号和租户名会用作历史文件的路径，只允许简单字符，且不能以 . 开头(排除 . 和 ..)
+NAME = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.-]{0,63}$")
+UPLOAD_CANCEL = object()  # 放入上传队列表示放弃这一句
+
+
+class Tenant:
+    # 一个租户(一批设备)共用的并发额度：同时进行的对话轮数不超过 limit，超出的排队等待
+    def __init__(self, name: str, limit: int = 8, token: Optional[str] = None):
+        self.name = name
+        self.limit = limit
+        self.token = token
+        self.slots = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.turns = 0
+        self.rejected = 0
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "active": self.active, "waiting": self.waiting,
+                "turns": self.turns, "rejected": self.rejected}
+
+
+def parse_tenants(spec: str) -> List[Tenant]:
+    # "home:8,school:32:secret" -> 租户名:并发上限[:令牌]
+    tenants = []
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        name, limit, *token = item.split(":", 2)
+        tenants.append(Tenant(name, int(limit), token[0] if token else None))
+    return tenants
+
+
+class DeviceSession:
+    # 一台设备的一条连接。上行：二进制帧是 16k 16bit 单声道 PCM，一句话的第一帧开始新的一轮，
+    # {"type": "end"} 表示这句话说完，{"type": "cancel"} 打断当前一轮；说话时上一轮还没播完也会被打断。
+    # 下行：二进制帧是合成的 PCM，文本帧是事件 partial(识别中间结果) / done(一轮结束，带各阶段耗时)
+    def __init__(self, gateway: "Gateway", ws: WebSocket, tenant: Tenant, device: str):
+        self.gateway = gateway
+        self.ws = ws
+        self.tenant = tenant
+        self.device = device
+        self.loop = asyncio.get_running_loop()
+        self.pipeline = VoicePipeline(gateway.chat(tenant.name, device), gateway.system_prompt, gateway.new_tts,
+                                      self._play, asr_request_timeout=gateway.asr_request_timeout, rate=16000,
+                                      stream=gateway.stream, tts_timeout=gateway.tts_timeout,
+                                      tts_cache=gateway.tts_cache, tts_fanout=gateway.tts_fanout,
+                                      flush=self._flush)
+        # 下行队列满时合成播放线程等待，下行慢的设备不会在网关里堆积音频
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=gateway.download_chunks)
+        self.upload: Optional[asyncio.Queue] = None
+        self.turns = 0
+        self.tasks = set()
+        self.closed = False
+
+    async def run(self) -> None:
+        sender = asyncio.create_task(self._sender())
+        try:
+            while True:
+                opcode, payload = await self.ws.recv()
+                if opcode == OP_BINARY:
+                    if self.upload is None:
+                        self._start_turn()
+                    # 上传队列满(还在排队等额度或识别跟不上)时不再读 socket，TCP 窗口把反压传给设备
+                    await self.upload.put(payload)
+                else:
+                    await self._control(json.loads(payload))
+        except (ConnectionClosed, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            logger.warning(f"device {self.device} sent bad message: {e}")
+        finally:
+            self.closed = True
+            self._barge_in()
+            self._drain(self.outbox)
+            self.outbox.put_nowait(None)
+            await sender
+            if not self.ws.closed:
+                await self.ws.close()
+
+    async def _control(self, message: dict) -> None:
+        kind = message.get("type")
+        if kind == "end":
+            if self.upload is not None:
+                await self.upload.put(None)
+                self.upload = None
+        elif kind == "cancel":
+            self._barge_in()
+        else:
+            logger.warning(f"device {self.device} sent unknown message: {kind}")
+
+    def _start_turn(self) -> None:
+        self._barge_in()
+        self.turns += 1
+        self.upload = asyncio.Queue(maxsize=self.gateway.upload_chunks)
+        task = asyncio.create_task(self._turn(self.turns, self.upload))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _barge_in(self) -> None:
+        # 放弃正在上传的一句，打断正在回答的一轮
+        if self.upload is not None:
+            self._drain(self.upload)
+            self.upload.put_nowait(UPLOAD_CANCEL)
+            self.upload = None
+        self.pipeline.cancel()
+
+    @staticmethod
+    def _drain(q: asyncio.Queue) -> list:
+        items = []
+        while not q.empty():
+            items.append(q.get_nowait())
+        return items
+
+    async def _turn(self, n: int, upload: asyncio.Queue) -> None:
+        gateway, tenant = self.gateway, self.tenant
+        tenant.waiting += 1
+        try:
+            await asyncio.wait_for(gateway.acquire(tenant), gateway.queue_timeout)
+        except asyncio.TimeoutError:
+            tenant.rejected += 1
+            logger.warning(f"tenant {tenant.name} busy, device {self.device} turn {n} rejected")
+            while await upload.get() not in (None, UPLOAD_CANCEL):
+                pass
+            await self._emit({"type": "done", "turn": n, "timings": {"error": "busy"}})
+            return
+        finally:
+            tenant.waiting -= 1
+
+        try:
+            timings = await self._run_turn(n, upload)
+        finally:
+            gateway.release(tenant)
+        await self._emit({"type": "done", "turn": n, "timings": timings})
+
+    async def _run_turn(self, n: int, upload: asyncio.Queue) -> dict:
+        gateway = self.gateway
+        try:
+            asr = await self.loop.run_in_executor(
+                gateway.executor, gateway.new_asr,
+                lambda text: self._emit_threadsafe({"type": "partial", "turn": n, "text": text}))
+        except Exception as e:
+            logger.error(f"device {self.device} asr connect failed: {e}")
+            while await upload.get() not in (None, UPLOAD_CANCEL):
+                pass
+            return {"error": "asr"}
+        asr.start_stream(rate=16000)
+        # 流式识别时 run_turn 只用音频判断有没有录到声音，不必在网关里攒下整句
+        heard = b""
+        while True:
+            data = await upload.get()
+            if data is None or data is UPLOAD_CANCEL:
+                break
+            heard = heard or data
+            asr.feed(data)
+        # 说完之后、开始识别之前设备又开始说下一句，这一轮也算被打断
+        if data is UPLOAD_CANCEL or n != self.turns:
+            asr.cancel()
+            return {"error": "cancelled"}
+        timings = await self.loop.run_in_executor(gateway.executor, self.pipeline.run_turn, asr, heard)
+        self.pipeline.chat.compact_history()
+        return timings
+
+    async def _emit(self, event: dict) -> None:
+        if not self.closed:
+            await self.outbox.put(event)
+
+    def _emit_threadsafe(self, event: dict) -> None:
+        if not self.closed:
+            asyncio.run_coroutine_threadsafe(self.outbox.put(event), self.loop)
+
+    def _play(self, audio: bytes) -> None:
+        # 在合成播放线程上调用：等下行队列有空位再返回，设备收得慢时合成也跟着慢下来
+        if self.closed:
+            return
+        future = asyncio.run_coroutine_threadsafe(self.outbox.put(bytes(audio)), self.loop)
+        try:
+            future.result(timeout=self.gateway.tts_timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            logger.warning(f"device {self.device} downlink stalled, cancel turn")
+            self.loop.call_soon_threadsafe(self.pipeline.cancel)
+
+    def _flush(self) -> None:
+        # 打断时丢掉还没发出去的音频，事件保留
+        for item in self._drain(self.outbox):
+            if not isinstance(item, bytes):
+                self.outbox.put_nowait(item)
+
+    async def _sender(self) -> None:
+        try:
+            while True:
+                item = await self.outbox.get()
+                if item is None:
+                    return
+                # send 在 socket 写缓冲满时等待
+                await self.ws.send(json.dumps(item, ensure_ascii=False) if isinstance(item, dict) else item)
+        except (ConnectionClosed, ConnectionError) as e:
+            logger.info(f"device {self.device} downlink closed: {e}")
+            self.closed = True
+            self.ws.abort()
+
+
+class Gateway:
+    # 多设备语音网关：设备通过 WebSocket 上传 PCM，网关为每台设备跑 ASR -> Chat -> TTS，合成的 PCM 原路下发，
+    # 对话历史按设备分开。上游连接(讯飞预热连接池、对话接口的 HTTP 连接池)由各个工厂函数共用；
+    # 对话轮数先按租户限流，再受全局 max_turns 限制，阻塞的客户端调用放在同样大小的线程池里，不阻塞事件循环
+    def __init__(self, new_asr: Callable[[Callable[[str], None]], ASRClient], new_tts: Callable[[], TTSClient],
+                 new_chat: Callable[[str, str], Chat], system_prompt: str, host: str = "0.0.0.0", port: int = 8770,
+                 tenants: Optional[List[Tenant]] = None, tenant_limit: int = 8, open_tenants: bool = False,
+                 token: Optional[str] = None, allow_anonymous: bool = False, max_open_tenants: int = 64,
+                 max_chats: int = 256, chat_idle_ttl: float = 1800,
+                 max_turns: int = 64, max_devices: int = 1024, queue_timeout: float = 10,
+                 asr_request_timeout: int = 10, tts_timeout: float = 10, tts_fanout: int = 2,
+                 tts_cache: Optional[TTSCache] = None, stream: bool = True,
+                 upload_chunks: int = 256, download_chunks: int = 32):
+        self.new_asr = new_asr
+        self.new_tts = new_tts
+        self.new_chat = new_chat
+        self.system_prompt = system_prompt
+        self.host = host
+        self.port = port
+        self.tenants: Dict[str, Tenant] = {tenant.name: tenant for tenant in tenants or []}
+        # 不带 tenant 参数的设备归到 default 租户；open_tenants=True 时未配置的租户按 tenant_limit 自动创建
+        self.tenants.setdefault("default", Tenant("default", tenant_limit))
+        self.tenant_limit = tenant_limit
+        self.open_tenants = open_tenants
+        self.max_open_tenants = max_open_tenants
+        self.open_tenant_count = 0
+        # 没有自己令牌的租户用 token；两者都没有时默认拒绝，只有显式 allow_anonymous 才放行(本机压测)
+        self.token = token
+        self.allow_anonymous = allow_anonymous
+        self.max_turns = max_turns
+        self.max_devices = max_devices
+        self.queue_timeout = queue_timeout
+        self.asr_request_timeout = asr_request_timeout
+        self.tts_timeout = tts_timeout
+        self.tts_fanout = tts_fanout
+        self.tts_cache = tts_cache
+        self.stream = stream
+        # 上行约 40ms 一帧，256 帧约 10 秒；下行按合成块计
+        self.upload_chunks = upload_chunks
+        self.download_chunks = download_chunks
+        self.slots = asyncio.Semaphore(max_turns)
+        self.executor = ThreadPoolExecutor(max_workers=max_turns, thread_name_prefix="gateway-turn")
+        # 每台设备的对话(带历史日志的写线程和文件)按最近使用排序，断开的设备超过 max_chats 台
+        # 或空闲超过 chat_idle_ttl 秒就关闭，重连时从日志重新加载
+        self.chats: "OrderedDict[Tuple[str, str], Chat]" = OrderedDict()
+        self.chat_used: Dict[Tuple[str, str], float] = {}
+        self.max_chats = max_chats
+        self.chat_idle_ttl = chat_idle_ttl
+        self.sessions: set = set()
+        self.active = 0
+        self.peak_active = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.sweeper: Optional[asyncio.TimerHandle] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}{DEVICE_PATH}"
+
+    def tenant(self, name: str) -> Optional[Tenant]:
+        tenant = self.tenants.get(name)
+        if tenant is None and self.open_tenants and self.open_tenant_count < self.max_open_tenants:
+            self.open_tenant_count += 1
+            tenant = self.tenants[name] = Tenant(name, self.tenant_limit)
+        return tenant
+
+    def authorize(self, tenant: Tenant, token: Optional[str]) -> bool:
+        expected = tenant.token or self.token
+        if expected is None:
+            return self.allow_anonymous
+        return hmac.compare_digest(expected, token or "")
+
+    def chat(self, tenant: str, device: str) -> Chat:
+        # 同一台设备断线重连后继续使用原来的对话历史
+        key = (tenant, device)
+        if key not in self.chats:
+            self.chats[key] = self.new_chat(tenant, device)
+        self.chats.move_to_end(key)
+        self.chat_used[key] = time.monotonic()
+        self._evict_chats(keep=key)
+        return self.chats[key]
+
+    def release_chat(self, tenant: str, device: str) -> None:
+        # 设备断开：空闲时间从现在算起
+        key = (tenant, device)
+        if key in self.chats:
+            self.chats.move_to_end(key)
+            self.chat_used[key] = time.monotonic()
+        self._evict_chats()
+
+    def _sweep_chats(self) -> None:
+        # 没有设备连接或断开时也要按时关闭空闲的对话
+        self._evict_chats()
+        self.sweeper = asyncio.get_running_loop().call_later(max(1.0, self.chat_idle_ttl / 4), self._sweep_chats)
+
+    def _evict_chats(self, keep: Optional[Tuple[str, str]] = None) -> None:
+        # 从最久没用的开始关闭，还连着的设备不关；关闭要等日志写完，放到线程池里，不阻塞事件循环
+        connected = {(session.tenant.name, session.device) for session in self.sessions}
+        now = time.monotonic()
+        for key in list(self.chats):
+            if len(self.chats) <= self.max_chats and now - self.chat_used[key] < self.chat_idle_ttl:
+                break
+            if key in connected or key == keep:
+                continue
+            chat = self.chats.pop(key)
+            del self.chat_used[key]
+            logger.info(f"close idle chat {key}")
+            self.executor.submit(chat.close)
+
+    async def acquire(self, tenant: Tenant) -> None:
+        await tenant.slots.acquire()
+        try:
+            await self.slots.acquire()
+        except BaseException:
+            tenant.slots.release()
+            raise
+        tenant.active += 1
+        tenant.turns += 1
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+
+    def release(self, tenant: Tenant) -> None:
+        tenant.active -= 1
+        self.active -= 1
+        self.slots.release()
+        tenant.slots.release()
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self.handle, self.host, self.port, backlog=1024)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self._sweep_chats()
+        logger.info(f"gateway listening on {self.url}")
+
+    def start_in_thread(self) -> "Gateway":
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="gateway", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.start(), self.loop).result()
+        return self
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        ws = None
+        try:
+            ws = await handshake(reader, writer)
+            if ws is None:
+                return
+            device = ws.query.get("device", "")
+            tenant = self.tenant(ws.query.get("tenant", "default")) \
+                if NAME.match(ws.query.get("tenant", "default")) else None
+            if ws.path != DEVICE_PATH or not NAME.match(device):
+                await ws.close(1008, "bad device")
+                return
+            if tenant is None or not self.authorize(tenant, ws.query.get("token")):
+                await ws.close(1008, "unauthorized")
+                return
+            if len(self.sessions) >= self.max_devices:
+                await ws.close(1013, "too many devices")
+                return
+            session = DeviceSession(self, ws, tenant, device)
+            self.sessions.add(session)
+            try:
+                await session.run()
+            finally:
+                self.sessions.discard(session)
+                self.release_chat(tenant.name, device)
+        except (ConnectionClosed, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error(f"gateway handler exception: {e}")
+        finally:
+            if ws and not ws.closed:
+                await ws.close()
+
+    def stats(self) -> dict:
+        return {"devices": len(self.sessions), "active": self.active, "peak_active": self.peak_active,
+                "tenants": {name: tenant.stats() for name, tenant in self.tenants.items()}}
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from openai import OpenAI
+    from asr.xf_iat import IAT_URL
+    from asr.xf_iat import create_session_manager as create_asr_session_manager
+    from tts.xf_tts import TTS_URL
+    from tts.xf_tts import create_session_manager as create_tts_session_manager
+    from chat.cache import ResponseCache
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="多设备语音网关")
+    parser.add_argument("--host", default=os.getenv("gateway_host", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("gateway_port", "8770")))
+    parser.add_argument("--history-dir", default=os.getenv("gateway_history_dir", "gateway_history"))
+    args = parser.parse_args()
+
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    # 所有设备共用上游连接池；预热的连接数按同时进行的轮数估算
+    max_turns = int(os.getenv("gateway_max_turns", "64"))
+    tts_fanout = int(os.getenv("tts_fanout", "3"))
+    session_max_age = float(os.getenv("ws_session_max_age", "240"))
+    asr_sessions = create_asr_session_manager(os.getenv("asr_api_key"), os.getenv("asr_api_secret"),
+                                              url=os.getenv("asr_ws_url") or IAT_URL,
+                                              pool_size=int(os.getenv("gateway_asr_pool", "8")),
+                                              max_age=session_max_age).start()
+    tts_sessions = create_tts_session_manager(os.getenv("tts_api_key"), os.getenv("tts_api_secret"),
+                                              url=os.getenv("tts_ws_url") or TTS_URL,
+                                              pool_size=int(os.getenv("gateway_tts_pool", "16")),
+                                              max_age=session_max_age).start()
+    client = OpenAI(api_key=os.getenv("openai_api_key"), base_url=os.getenv("openai_url"))
+    response_cache = ResponseCache(max_entries=int(os.getenv("chat_cache_size", "256")),
+                                   ttl=float(os.getenv("chat_cache_ttl", "3600"))) \
+        if os.getenv("chat_cache", "false") == "true" else None
+
+    def new_chat(tenant: str, device: str) -> Chat:
+        # NAME 已经挡掉了 . 和 ..，这里再确认历史文件确实落在 history_dir 下面
+        root = os.path.realpath(args.history_dir)
+        path = os.path.realpath(os.path.join(root, tenant, f"{device}.jsonl"))
+        if os.path.dirname(os.path.dirname(path)) != root:
+            raise ValueError(f"history path escapes {root}: {tenant}/{device}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return Chat(url=os.getenv("openai_url"), model=os.getenv("openai_model"),
+                    api_key=os.getenv("openai_api_key"), history_path=path,
+                    history_budget=int(os.getenv("chat_history_budget", "1000")),
+                    summary_budget=int(os.getenv("chat_summary_budget", "300")),
+                    response_cache=response_cache, client=client)
+
+    gateway = Gateway(lambda on_partial: ASRClient(os.getenv("asr_ws_connect_timeout"), os.getenv("asr_app_id"),
+                                                   os.getenv("asr_api_key"), os.getenv("asr_api_secret"),
+                                                   session_manager=asr_sessions, on_partial=on_partial),
+                      lambda: TTSClient(os.getenv("tts_ws_connect_timeout"), os.getenv("tts_app_id"),
+                                        os.getenv("tts_api_key"), os.getenv("tts_api_secret"),
+                                        session_manager=tts_sessions),
+                      new_chat, os.getenv("gateway_system_prompt", "你是小燧，一个可以实时语音对话的智能助手。"),
+                      host=args.host, port=args.port,
+                      tenants=parse_tenants(os.getenv("gateway_tenants", "")),
+                      tenant_limit=int(os.getenv("gateway_tenant_limit", "8")),
+                      open_tenants=os.getenv("gateway_open_tenants", "false") == "true",
+                      token=os.getenv("gateway_token") or None,
+                      allow_anonymous=os.getenv("gateway_allow_anonymous", "false") == "true",
+                      max_open_tenants=int(os.getenv("gateway_max_open_tenants", "64")),
+                      max_chats=int(os.getenv("gateway_max_chats", "256")),
+                      chat_idle_ttl=float(os.getenv("gateway_chat_idle_ttl", "1800")),
+                      max_turns=max_turns,
+                      asr_request_timeout=int(os.getenv("asr_request_timeout")),
+                      tts_timeout=int(os.getenv("tts_ws_connect_timeout")),
+                      tts_fanout=tts_fanout,
+                      tts_cache=TTSCache(os.getenv("tts_cache_dir", "tts_cache"),
+                                         max_bytes=int(os.getenv("tts_cache_max_mb", "64")) * 1024 * 1024),
+                      stream=os.getenv("chat_stream", "true") == "true")
+
+    async def main():
+        await gateway.start()
+        await gateway.server.serve_forever()
+
+    asyncio.run(main())
@@ -0,0 +1,212 @@
+import os
+import asyncio
+import base64
+import hashlib
+import struct
+import logging
+from typing import Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger()
+
+# RFC 6455 最小实现，网关和本地替身服务共用：握手、数据帧(含分片)、ping/pong、close；
+# 客户端(connect)只用于网关压测和设备模拟，发出的帧按规范加掩码。
+# 网关直接面对设备，读帧前先检查长度：单帧超过 max_frame 或分片合并后超过 max_message 时以 1009 关闭，
+# 服务端收到没加掩码的帧、超长或分片的控制帧时以 1002 关闭，不会按对端声明的长度分配内存
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+# 默认上限：设备上行 40ms 一帧 PCM 只有 1280 字节，1 MiB 足够任何正常的消息
+MAX_FRAME = 1 << 20
+MAX_MESSAGE = 1 << 20
+
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_TOO_BIG = 1009
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+class WebSocket:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, path: str, query: dict,
+                 mask: bool = False, max_frame: int = MAX_FRAME, max_message: int = MAX_MESSAGE):
+        self.reader = reader
+        self.writer = writer
+        self.path = path
+        self.query = query
+        # 客户端发出的帧必须加掩码，服务端不加
+        self.mask = mask
+        self.max_frame = max_frame
+        self.max_message = max_message
+        self.closed = False
+
+    async def _reject(self, code: int, reason: str) -> None:
+        logger.warning(f"websocket {self.path} closed: {reason}")
+        await self.close(code, reason, wait=False)
+        raise ConnectionClosed(reason)
+
+    async def recv(self) -> Tuple[int, bytes]:
+        # 返回 (opcode, payload)，分片消息合并后返回
+        message = b""
+        message_opcode = None
+        while True:
+            head = await self.reader.readexactly(2)
+            fin = head[0] & 0x80
+            opcode = head[0] & 0x0F
+            masked = head[1] & 0x80
+            length = head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+            if opcode >= OP_CLOSE and (length > 125 or not fin):
+                await self._reject(CLOSE_PROTOCOL_ERROR, "bad control frame")
+            if not self.mask and not masked:
+                # 我们是服务端：客户端发来的帧必须加掩码
+                await self._reject(CLOSE_PROTOCOL_ERROR, "unmasked client frame")
+            if length > self.max_frame:
+                await self._reject(CLOSE_TOO_BIG, f"frame of {length} bytes")
+            if opcode < OP_CLOSE and len(message) + length > self.max_message:
+                await self._reject(CLOSE_TOO_BIG, f"message over {self.max_message} bytes")
+            mask = await self.reader.readexactly(4) if masked else None
+            payload = await self.reader.readexactly(length)
+            if mask:
+                payload = _unmask(payload, mask)
+
+            if opcode == OP_PING:
+                await self.send(payload, OP_PONG)
+                continue
+            if opcode == OP_PONG:
+                continue
+            if opcode == OP_CLOSE:
+                if not self.closed:
+                    await self.close(wait=False)
+                raise ConnectionClosed()
+            if opcode != OP_CONTINUATION:
+                message_opcode = opcode
+            message += payload
+            if fin:
+                return message_opcode, message
+
+    async def recv_text(self) -> str:
+        opcode, payload = await self.recv()
+        return payload.decode("utf-8")
+
+    async def send(self, data, opcode: Optional[int] = None) -> None:
+        if self.closed and opcode != OP_CLOSE:
+            raise ConnectionClosed()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+            opcode = OP_TEXT if opcode is None else opcode
+        elif opcode is None:
+            opcode = OP_BINARY
+        length = len(data)
+        masked = 0x80 if self.mask else 0
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, masked | length)
+        elif length < 65536:
+            header = struct.pack("!BBH", 0x80 | opcode, masked | 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, masked | 127, length)
+        if self.mask:
+            mask = os.urandom(4)
+            header += mask
+            data = _unmask(data, mask)
+        self.writer.write(header + data)
+        # 写缓冲满时在这里等待，即反压
+        await self.writer.drain()
+
+    async def close(self, code: int = 1000, reason: str = "", wait: bool = True) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self.send(struct.pack("!H", code) + reason.encode("utf-8"), OP_CLOSE)
+            if wait:
+                # 等对端回 close 帧再断开，客户端才会认为是正常关闭
+                await asyncio.wait_for(self._drain_until_close(), timeout=1.0)
+        except (ConnectionError, ConnectionClosed, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        self.writer.close()
+
+    async def _drain_until_close(self) -> None:
+        while True:
+            head = await self.reader.readexactly(2)
+            length = head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+            if length > self.max_frame:
+                return
+            await self.reader.readexactly(length + (4 if head[1] & 0x80 else 0))
+            if head[0] & 0x0F == OP_CLOSE:
+                return
+
+    def abort(self) -> None:
+        # 模拟网络中断：不发 close 帧直接断开
+        self.closed = True
+        self.writer.transport.abort()
+
+
+def _unmask(payload: bytes, mask: bytes) -> bytes:
+    n = len(payload)
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(n, "big")
+
+
+async def handshake(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, max_frame: int = MAX_FRAME,
+                    max_message: int = MAX_MESSAGE) -> Optional[WebSocket]:
+    request = await reader.readuntil(b"\r\n\r\n")
+    lines = request.decode("latin-1").split("\r\n")
+    method, target, _ = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+    key = headers.get("sec-websocket-key")
+    if method != "GET" or not key or "websocket" not in headers.get("upgrade", "").lower():
+        writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+        await writer.drain()
+        writer.close()
+        return None
+    accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+    writer.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                  "Upgrade: websocket\r\n"
+                  "Connection: Upgrade\r\n"
+                  f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+    await writer.drain()
+    url = urlparse(target)
+    return WebSocket(reader, writer, url.path, {k: v[0] for k, v in parse_qs(url.query).items()},
+                     max_frame=max_frame, max_message=max_message)
+
+
+async def connect(url: str, timeout: float = 10) -> WebSocket:
+    # 客户端握手，只支持 ws://
+    url_parts = urlparse(url)
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(url_parts.hostname, url_parts.port or 80),
+                                            timeout)
+    key = base64.b64encode(os.urandom(16)).decode()
+    target = url_parts.path + (f"?{url_parts.query}" if url_parts.query else "")
+    writer.write((f"GET {target} HTTP/1.1\r\n"
+                  f"Host: {url_parts.netloc}\r\n"
+                  "Upgrade: websocket\r\n"
+                  "Connection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\n"
+                  "Sec-WebSocket-Version: 13\r\n\r\n").encode())
+    await writer.drain()
+    response = (await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)).decode("latin-1")
+    accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+    if not response.startswith("HTTP/1.1 101") or accept not in response:
+        writer.close()
+        raise ConnectionError(f"websocket handshake failed: {response.splitlines()[0] if response else ''}")
+    return WebSocket(reader, writer, url_parts.path, {k: v[0] for k, v in parse_qs(url_parts.query).items()},
+                     mask=True)
@@ -0,0 +1,312 @@
+import os
+import sys
+import glob
+import math
+import time
+import queue
+import logging
+import argparse
+import threading
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from dsp import to_float
+
+logger = logging.getLogger()
+
+
+class MFCC:
+    # 流式 MFCC：25ms 帧、10ms 帧移，预加重和不足一帧的样本跨块保留；
+    # 静音帧(对数能量低于 gate_dbfs)不做 FFT，只返回能量
+    def __init__(self, rate: int = 16000, frame_ms: int = 25, hop_ms: int = 10, n_fft: int = 512,
+                 n_mels: int = 26, n_ceps: int = 13, low_hz: float = 60, high_hz: Optional[float] = None,
+                 preemphasis: float = 0.97):
+        self.rate = rate
+        self.frame = rate * frame_ms // 1000
+        self.hop = rate * hop_ms // 1000
+        self.n_fft = n_fft
+        self.preemphasis = preemphasis
+        self.window = np.hamming(self.frame).astype(np.float32)
+        # 三角形 mel 滤波器组，(n_fft // 2 + 1, n_mels)
+        high_hz = high_hz or rate / 2
+
+        def mel(hz):
+            return 2595 * np.log10(1 + hz / 700)
+
+        points = 700 * (10 ** (np.linspace(mel(low_hz), mel(high_hz), n_mels + 2) / 2595) - 1)
+        bins = np.fft.rfftfreq(n_fft, 1 / rate)
+        lower, center, upper = points[:-2, None], points[1:-1, None], points[2:, None]
+        bank = np.maximum(0, np.minimum((bins - lower) / (center - lower), (upper - bins) / (upper - center)))
+        self.mel_bank = bank.T.astype(np.float32)
+        # DCT-II，去掉 c0(整体能量由增益决定，不参与匹配)，再做倒谱提升
+        n = np.arange(n_mels)
+        k = np.arange(1, n_ceps)
+        lifter = 1 + (n_ceps - 1) / 2 * np.sin(np.pi * k / (n_ceps - 1))
+        self.dct = (np.cos(np.pi * k[None, :] * (n[:, None] + 0.5) / n_mels) * lifter).astype(np.float32)
+        self.dims = len(k)
+        self.reset()
+
+    def reset(self) -> None:
+        self.tail = np.zeros(0, dtype=np.float32)
+        self.last = 0.0
+
+    def process(self, x: np.ndarray, gate_dbfs: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        # x 是单声道 float32 样本；返回 (帧数, dims) 的特征和每帧的对数能量(dBFS)，静音帧的特征为 0
+        y = np.empty(len(x), dtype=np.float32)
+        if len(x):
+            y[0] = x[0] - self.preemphasis * self.last
+            y[1:] = x[1:] - self.preemphasis * x[:-1]
+            self.last = float(x[-1])
+        buf = np.concatenate((self.tail, y))
+        count = (len(buf) - self.frame) // self.hop + 1 if len(buf) >= self.frame else 0
+        self.tail = buf[count * self.hop:]
+        if count == 0:
+            return np.zeros((0, self.dims), dtype=np.float32), np.zeros(0, dtype=np.float32)
+        frames = np.lib.stride_tricks.sliding_window_view(buf, self.frame)[::self.hop][:count]
+        energy = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+        features = np.zeros((count, self.dims), dtype=np.float32)
+        voiced = energy > gate_dbfs if gate_dbfs is not None else np.ones(count, dtype=bool)
+        if voiced.any():
+            spectrum = np.abs(np.fft.rfft(frames[voiced] * self.window, self.n_fft)) ** 2
+            features[voiced] = np.log(spectrum @ self.mel_bank + 1e-6) @ self.dct
+        return features, energy
+
+
+def extract(pcm: bytes, rate: int = 16000, trim_db: float = 30) -> np.ndarray:
+    # 录入样本 -> 模板：整段提取特征，去掉首尾比最响的帧低 trim_db 以上的部分
+    mfcc = MFCC(rate)
+    features, energy = mfcc.process(to_float(pcm)[:, 0])
+    loud = np.flatnonzero(energy > energy.max() - trim_db)
+    if not len(loud):
+        return features
+    return features[loud[0]:loud[-1] + 1]
+
+
+def save_templates(directory: str, templates: List[np.ndarray]) -> None:
+    os.makedirs(directory, exist_ok=True)
+    for i, template in enumerate(templates):
+        np.save(os.path.join(directory, f"template-{i}.npy"), template)
+
+
+def load_templates(directory: str) -> List[np.ndarray]:
+    return [np.load(path) for path in sorted(glob.glob(os.path.join(directory, "*.npy")))]
+
+
+def read_pcm(path: str) -> bytes:
+    # .wav 取其中的 PCM(要求 16k 16bit 单声道)，其他文件当作裸 PCM
+    if path.endswith(".wav"):
+        import wave
+        with wave.open(path, "rb") as f:
+            if f.getframerate() != 16000 or f.getsampwidth() != 2 or f.getnchannels() != 1:
+                raise ValueError(f"{path}: 需要 16k 16bit 单声道")
+            return f.readframes(f.getnframes())
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class KeywordSpotter:
+    # 唤醒词检测：流式 MFCC + 子序列 DTW，和几个录入的模板比对。
+    # 每个模板帧恰好计入一次代价(步长 (1,1)、(1,2)、(2,1)，语速可在一半到两倍之间变化)，
+    # 所以每来一帧输入只需用前两列算出新的一列，所有模板拼在一起一次向量化计算完；
+    # 每帧的计算量固定(模板总帧数 x 特征维数)，静音时连 FFT 也跳过。
+    # 帧间距离用余弦距离，对音量和信道的整体变化不敏感；
+    # 得分是路径上每个模板帧的平均距离，低于 threshold 且不再下降时触发 on_detect(score)
+    RESET = object()
+
+    def __init__(self, templates: List[np.ndarray], on_detect: Optional[Callable[[float], None]] = None,
+                 threshold: float = 0.2, rate: int = 16000, gate_dbfs: float = -50, reset_ms: int = 500,
+                 refractory_ms: int = 1500, confirm_frames: int = 3, max_template_frames: int = 120,
+                 queue_chunks: int = 50):
+        if not templates:
+            raise ValueError("没有唤醒词模板")
+        self.on_detect = on_detect
+        self.threshold = threshold
+        self.gate_dbfs = gate_dbfs
+        self.mfcc = MFCC(rate)
+        hop_ms = 1000 * self.mfcc.hop / rate
+        self.reset_frames = int(reset_ms / hop_ms)
+        self.refractory_frames = int(refractory_ms / hop_ms)
+        self.confirm_frames = confirm_frames
+        # 模板按行拼接；first/second 标出每个模板的第一、二帧，last 是每个模板最后一帧的行号
+        templates = [t[:max_template_frames].astype(np.float32) for t in templates]
+        features = np.concatenate(templates)
+        self.features = features / (np.linalg.norm(features, axis=1, keepdims=True) + 1e-9)
+        lengths = np.array([len(t) for t in templates])
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        self.first = np.zeros(len(self.features), dtype=bool)
+        self.first[starts] = True
+        self.second = np.zeros(len(self.features), dtype=bool)
+        self.second[starts[lengths > 1] + 1] = True
+        self.last = starts + lengths - 1
+        self.lengths = lengths.astype(np.float32)
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_chunks)
+        self.thread: Optional[threading.Thread] = None
+        # 统计
+        self.detections = 0
+        self.dropped_chunks = 0
+        self.processed_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.reset()
+
+    def reset(self) -> None:
+        # 清空匹配状态，例如一轮对话结束、重新开始监听时
+        self.mfcc.reset()
+        inf = np.full(len(self.features), np.inf, dtype=np.float32)
+        self.d1 = inf
+        self.d2 = inf
+        self.idle = True
+        self.silent_frames = 0
+        self.refractory = 0
+        self.best = np.inf
+        self.best_age = 0
+
+    def _column(self, f: np.ndarray) -> np.ndarray:
+        # 输入帧 f 对所有模板帧的一列累计代价
+        c = 1.0 - self.features @ (f / (np.linalg.norm(f) + 1e-9))
+        prev = np.full(len(c), np.inf, dtype=np.float32)
+        # (1,1)：D[i-1, j-1]；(1,2)：D[i-1, j-2]；(2,1)：D[i-2, j-1] + c[i-1, j]
+        prev[1:] = np.minimum(self.d1[:-1], self.d2[:-1])
+        skip = np.full(len(c), np.inf, dtype=np.float32)
+        skip[2:] = self.d1[:-2] + c[1:-1]
+        skip[self.second] = np.inf
+        prev = np.minimum(prev, skip)
+        # 子序列匹配：模板可以从任意一帧输入开始
+        prev[self.first] = 0.0
+        d = c + prev
+        self.d2, self.d1 = self.d1, d
+        return d[self.last] / self.lengths
+
+    def process(self, data: bytes) -> Optional[float]:
+        # 同步处理一块 PCM，检测到唤醒词时返回得分
+        x = to_float(data)[:, 0]
+        if self.idle and (not len(x) or 10 * math.log10(float(np.dot(x, x)) / len(x) + 1e-10) < self.gate_dbfs):
+            # 持续静音：匹配状态已经清空，只推进分帧，不算特征
+            self.mfcc.process(x, self.gate_dbfs)
+            return None
+        # 匹配中的静音帧(字间停顿)也要算特征，和模板里的停顿对得上
+        features, energy = self.mfcc.process(x)
+        detected = None
+        for f, e in zip(features, energy):
+            if self.refractory:
+                self.refractory -= 1
+                continue
+            if e < self.gate_dbfs:
+                self.silent_frames += 1
+                if self.silent_frames >= self.reset_frames and not self.idle:
+                    self._clear()
+                    continue
+            else:
+                self.silent_frames = 0
+                self.idle = False
+            if self.idle:
+                continue
+            score = float(np.min(self._column(f)))
+            if score < self.best:
+                self.best, self.best_age = score, 0
+            else:
+                self.best_age += 1
+            # 得分到达谷底(连续 confirm_frames 帧不再下降)时才触发，取最好的那一次
+            if self.best < self.threshold and self.best_age >= self.confirm_frames:
+                detected = self.best
+                self.detections += 1
+                self._clear()
+                self.refractory = self.refractory_frames
+        return detected
+
+    def _clear(self) -> None:
+        inf = np.full(len(self.features), np.inf, dtype=np.float32)
+        self.d1 = inf
+        self.d2 = inf
+        self.idle = True
+        self.best = np.inf
+        self.best_age = 0
+
+    def start(self) -> "KeywordSpotter":
+        # 后台线程检测，feed() 不阻塞录音线程
+        self.thread = threading.Thread(target=self._spotter_daemon, name="kws", daemon=True)
+        self.thread.start()
+        return self
+
+    def feed(self, data: bytes) -> None:
+        # 检测线程跟不上时丢掉音频而不是积压，CPU 占用有上限
+        try:
+            self.queue.put_nowait(data)
+        except queue.Full:
+            self.dropped_chunks += 1
+
+    def resume(self) -> None:
+        # 暂停送数据之后重新开始：之前的匹配状态作废，排在已送进去的音频之后生效
+        self.queue.put(self.RESET)
+
+    def close(self) -> None:
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def stats(self) -> dict:
+        cpu_percent = self.cpu_seconds / self.processed_seconds * 100 if self.processed_seconds else 0.0
+        return {"detections": self.detections, "dropped_chunks": self.dropped_chunks,
+                "processed_seconds": round(self.processed_seconds, 1), "cpu_percent": round(cpu_percent, 2)}
+
+    def _spotter_daemon(self) -> None:
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            if data is self.RESET:
+                self.reset()
+                continue
+            started = time.thread_time()
+            score = self.process(data)
+            self.cpu_seconds += time.thread_time() - started
+            self.processed_seconds += len(data) / 2 / self.mfcc.rate
+            if score is not None:
+                logger.info(f"wake word detected, score={score:.2f}")
+                if self.on_detect:
+                    try:
+                        self.on_detect(score)
+                    except Exception as e:
+                        logger.error(f"wake word callback failed: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="唤醒词模板录入和检测")
+    sub = parser.add_subparsers(dest="command", required=True)
+    enroll = sub.add_parser("enroll", help="从 16k 16bit 单声道的 wav/pcm 文件生成模板")
+    enroll.add_argument("--out", default="kws_templates")
+    enroll.add_argument("clips", nargs="+")
+    record = sub.add_parser("record", help="用麦克风录几遍唤醒词生成模板")
+    record.add_argument("--out", default="kws_templates")
+    record.add_argument("--count", type=int, default=4)
+    detect = sub.add_parser("detect", help="在一段录音里找唤醒词")
+    detect.add_argument("--templates", default="kws_templates")
+    detect.add_argument("--threshold", type=float, default=0.2)
+    detect.add_argument("clip")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    if args.command == "enroll":
+        templates = [extract(read_pcm(path)) for path in args.clips]
+        save_templates(args.out, templates)
+        logger.info(f"saved {len(templates)} templates to {args.out}, frames={[len(t) for t in templates]}")
+    elif args.command == "record":
+        from audio import AudioRecorder, CapturePreprocessor, VoiceActivityDetector
+        recorder = AudioRecorder(rate=16000, vad=VoiceActivityDetector(rate=16000), auto_stop_ms=400,
+                                 max_seconds=3, preprocessor=CapturePreprocessor(16000))
+        templates = []
+        for i in range(args.count):
+            logger.info(f"({i + 1}/{args.count}) 请说“小燧”")
+            recorder.start_recording(lambda pcm: templates.append(extract(pcm)))
+        save_templates(args.out, templates)
+        logger.info(f"saved {len(templates)} templates to {args.out}, frames={[len(t) for t in templates]}")
+    else:
+        spotter = KeywordSpotter(load_templates(args.templates), threshold=args.threshold)
+        pcm = read_pcm(args.clip)
+        chunk = 640
+        for offset in range(0, len(pcm), chunk):
+            score = spotter.process(pcm[offset:offset + chunk])
+            if score is not None:
+                logger.info(f"{offset / 32000:.2f}s: score={score:.2f}")
+        logger.info(f"{spotter.stats()}")
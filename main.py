@@ -6,12 +6,22 @@ import threading
 import time
 from signal import pause
 from dotenv import load_dotenv
-from typing import Callable
-from asr.xf_iat import ASRClient
-from tts.xf_tts import TTSClient
+from typing import Callable, Optional, Union
+from asr.xf_iat import ASRClient, IAT_URL
+from asr.xf_iat import create_session_manager as create_asr_session_manager
+from asr.codec import ThroughputMeter, UploadCodec
+from asr.hedge import HedgedASR, HedgeStats
+from tts.xf_tts import TTSClient, TTS_URL
+from tts.xf_tts import create_session_manager as create_tts_session_manager
 from chat.chat import Chat
+from chat.cache import ResponseCache
+from tts.cache import TTSCache
+from pipeline import VoicePipeline, WARMUP_PHRASES
 from screen.screen import Screen
-from audio import AudioPlayer, AudioRecorder, AudioVolumeControl
+from audio import (AudioPlayer, AudioRecorder, AudioVolumeControl, CapturePreprocessor, Mixer, PlaybackEngine,
+                   VoiceActivityDetector, tone)
+from kws.spotter import KeywordSpotter, load_templates
+from replay.session import SessionRecorder, SessionWriter
 from PIL import Image, ImageDraw, ImageFont
 from threading import Thread
 from queue import Queue
@@ -92,8 +102,23 @@ class App:
         # 初始化屏幕
         self.screen = Screen(simulate=(os.getenv("simulate_screen") == 'true'))
 
+        # 可选的会话录制：每轮的录音、按键、ASR 帧、对话和合成结果写进会话文件，用 replay.driver 离线回放
+        self.session_recorder: Optional[SessionRecorder] = None
+        if os.getenv("session_record_dir"):
+            self.session_recorder = SessionRecorder(os.getenv("session_record_dir"),
+                                                    keep=int(os.getenv("session_record_keep", "200")),
+                                                    meta={"rate": 16000,
+                                                          "chat_stream": os.getenv("chat_stream", "true") == "true",
+                                                          "tts_fanout": int(os.getenv("tts_fanout", "3"))})
+
         self.chat = Chat(url=os.getenv("openai_url"), model=os.getenv("openai_model"),
-                         api_key=os.getenv("openai_api_key"), history_path="history.json")
+                         api_key=os.getenv("openai_api_key"), history_path="history.jsonl",
+                         history_budget=int(os.getenv("chat_history_budget", "1000")),
+                         summary_budget=int(os.getenv("chat_summary_budget", "300")),
+                         response_cache=ResponseCache(max_entries=int(os.getenv("chat_cache_size", "256")),
+                                                      ttl=float(os.getenv("chat_cache_ttl", "3600")))
+                         if os.getenv("chat_cache", "false") == "true" else None,
+                         recorder=self.session_recorder)
         self.system_prompt = ('你现在作为一个可以实时语音对话的智能助手，名字是“小燧”。\n'
                               '你可以和用户聊天、回答问题、讲笑话、讲故事、唱歌、讲解知识等等。\n'
                               '你还可以解读用户拍的照片，你可以提示用户拍一张自拍照片，然后你可以描述一下用户的状态。\n'
@@ -113,20 +138,94 @@ class App:
                               '你回答的内容要尊重用户智商，不得恶搞、恶意调侃用户。\n'
                               '你回答的内容要符合社会主意核心价值观，不得违背社会公序良俗。')
 
-        #  初始化音量控制
-        self.volume_control = AudioVolumeControl()
+        # 声卡按原生采样率/声道数打开时，进程内转换成 16k 单声道，不经过 ALSA plug 层
+        device = os.getenv("audio_device", "default")
+        device_rate = int(os.getenv("audio_device_rate")) if os.getenv("audio_device_rate") else None
+        device_channels = int(os.getenv("audio_device_channels")) if os.getenv("audio_device_channels") else None
 
         # 初始化音频播放器
-        self.audio_player = AudioPlayer(channels=1, rate=16000)
-
-        # 初始化音频录制器
-        self.audio_recorder = AudioRecorder(channels=1, rate=16000)
+        self.audio_player = AudioPlayer(channels=1, rate=16000, device=device, device_rate=device_rate,
+                                        device_channels=device_channels)
+        # 软件混音：说话声和提示音叠加后写同一个声卡流，音量在混音时调整
+        self.mixer = Mixer(self.audio_player)
+        # 独立的播放线程和有界缓冲区，合成和声卡输出互不阻塞
+        self.playback = PlaybackEngine(self.mixer.channel("speech"),
+                                       buffer_ms=int(os.getenv("playback_buffer_ms", "3000")))
+        self.earcon_enable = os.getenv("earcon_enable", "true") == "true"
+        self.earcons = {"thinking": tone(880, 120), "tick": tone(1320, 40, amplitude=0.2)}
 
-        # asr
+        #  初始化音量控制
+        software_volume = os.getenv("software_volume", "true") == "true"
+        self.volume_control = AudioVolumeControl(self.mixer if software_volume else None)
+
+        # 初始化音频录制器，默认开启端点检测
+        vad = VoiceActivityDetector(rate=16000) if os.getenv("vad_enable", "true") == "true" else None
+        # 去直流、高通、自动增益，识别不再受录音电平和低频噪声影响
+        preprocessor = None
+        if os.getenv("capture_preprocess", "true") == "true":
+            preprocessor = CapturePreprocessor(rate=16000,
+                                               highpass_hz=float(os.getenv("capture_highpass_hz", "120")),
+                                               target_dbfs=float(os.getenv("capture_agc_target_dbfs", "-20")),
+                                               max_gain_db=float(os.getenv("capture_agc_max_gain_db", "24")))
+        # 唤醒词模式不按键，说完话靠端点检测自动结束
+        wake_word = os.getenv("wake_word_enable", "false") == "true"
+        if wake_word and not vad:
+            logger.warning("唤醒词模式需要端点检测(vad_enable=true)，否则只能等录音超过上限才结束")
+        self.audio_recorder = AudioRecorder(channels=1, rate=16000, vad=vad,
+                                            auto_stop_ms=int(os.getenv("vad_auto_stop_ms",
+                                                                       "800" if wake_word else "0")),
+                                            preroll_ms=int(os.getenv("record_preroll_ms", "300")),
+                                            device=device, device_rate=device_rate, device_channels=device_channels,
+                                            preprocessor=preprocessor)
+        # 唤醒词：声卡常开，读线程把每块音频交给检测线程，检测到“小燧”和按下 ENTER 键效果一样
+        self.spotter: Optional[KeywordSpotter] = None
+        self.wake_word_paused = False
+        if wake_word:
+            self.spotter = KeywordSpotter(load_templates(os.getenv("wake_word_templates", "kws_templates")),
+                                          threshold=float(os.getenv("wake_word_threshold", "0.2"))).start()
+        if wake_word or os.getenv("record_always_open", "false") == "true":
+            # 录音设备常开，按键时不再等打开设备，并带上按键前的一小段音频
+            self.audio_recorder.open()
+
+        # 预热的 ASR/TTS 连接，按键时直接拿来用
+        session_max_age = float(os.getenv("ws_session_max_age", "240"))
+        tts_fanout = int(os.getenv("tts_fanout", "3"))
+        self.asr_sessions = create_asr_session_manager(os.getenv("asr_api_key"), os.getenv("asr_api_secret"),
+                                                       url=os.getenv("asr_ws_url") or IAT_URL,
+                                                       max_age=session_max_age).start()
+        self.tts_sessions = create_tts_session_manager(os.getenv("tts_api_key"), os.getenv("tts_api_secret"),
+                                                       url=os.getenv("tts_ws_url") or TTS_URL,
+                                                       pool_size=int(os.getenv("tts_session_pool", str(tts_fanout))),
+                                                       max_age=session_max_age).start()
+
+        # asr，按测得的上行带宽自动选择上传编码
         self.asr = None
-
-        # tts
-        self.tts = None
+        self.asr_throughput = ThroughputMeter()
+        self.asr_adaptive_codec = os.getenv("asr_adaptive_codec", "true") == "true"
+
+        # 可选的对冲识别，asr_hedge_delay 留空时按首个中间结果延迟的 p95 推导
+        self.asr_hedge = os.getenv("asr_hedge", "false") == "true"
+        self.asr_hedge_delay = float(os.getenv("asr_hedge_delay")) if os.getenv("asr_hedge_delay") else None
+        self.asr_hedge_stats = HedgeStats(sample_timeout=int(os.getenv("asr_request_timeout")))
+
+        # 一轮对话的 ASR -> Chat -> TTS -> 播放流程，默认流式生成、逐句合成播放
+        # 合成结果缓存在本地，重复的语句不再走网络，离线也能播放
+        self.tts_cache = TTSCache(os.getenv("tts_cache_dir", "tts_cache"),
+                                  max_bytes=int(os.getenv("tts_cache_max_mb", "64")) * 1024 * 1024)
+        self.tts_cache.start_warmup(WARMUP_PHRASES, self._new_tts)
+        self.pipeline = VoicePipeline(self.chat, self.system_prompt,
+                                      self._new_tts,
+                                      self.playback.write,
+                                      asr_request_timeout=int(os.getenv("asr_request_timeout")),
+                                      stream=os.getenv("chat_stream", "true") == "true",
+                                      tts_timeout=int(os.getenv("tts_ws_connect_timeout")),
+                                      tts_cache=self.tts_cache,
+                                      tts_fanout=tts_fanout,
+                                      flush=self.playback.flush,
+                                      drain=self.playback.drain)
+        if self.spotter:
+            # 检测时要看对话是否在进行，pipeline 建好之后再接上
+            self.audio_recorder.tap = self._wake_word_tap
 
         # network connection state
         self.is_connected = False
@@ -134,40 +233,120 @@ class App:
         # battery state
         self.battery_level = 100
 
+        # 实时识别文本，由渲染线程合并刷新，不阻塞 ASR 接收线程
+        self.transcript_text = ""
+        self.transcript_event = threading.Event()
+
+    def _new_tts(self) -> TTSClient:
+        return TTSClient(os.getenv("tts_ws_connect_timeout"),
+                         os.getenv("tts_app_id"),
+                         os.getenv("tts_api_key"),
+                         os.getenv("tts_api_secret"),
+                         session_manager=self.tts_sessions,
+                         recorder=self.session_recorder)
+
     # 触发录音
+    def _new_asr(self, codec: Optional[UploadCodec] = None, on_partial: Optional[Callable] = None,
+                 primary: bool = True) -> ASRClient:
+        return ASRClient(os.getenv("asr_ws_connect_timeout"),
+                         os.getenv("asr_app_id"),
+                         os.getenv("asr_api_key"),
+                         os.getenv("asr_api_secret"),
+                         session_manager=self.asr_sessions,
+                         on_partial=on_partial,
+                         codec=type(codec)() if codec else None,
+                         throughput=self.asr_throughput if primary else None,
+                         recorder=self.session_recorder)
+
     def _start_recording(self) -> None:
         if not self.audio_recorder.is_recording:
-            self.asr = ASRClient(os.getenv("asr_ws_connect_timeout"),
-                            os.getenv("asr_app_id"),
-                            os.getenv("asr_api_key"),
-                            os.getenv("asr_api_secret"))
-            t = threading.Thread(target=self.audio_recorder.start_recording, args=(self._audio_callback,))
+            # 空闲时预热连接会被服务端关掉，按下按键就开始补，说话的这几秒里握手完成
+            self.asr_sessions.warm()
+            self.tts_sessions.warm()
+            # 上一轮还在生成或播放时按下按键：立即打断，闭嘴开始听
+            if self.pipeline.cancel():
+                logger.info(f"barge-in, playback={self.playback.stats()}")
+            elif self.playback.depth:
+                # 不属于任何一轮的音频(例如提示语)也不能录进新的一轮
+                self.playback.flush()
+            codec = self.asr_throughput.select() if self.asr_adaptive_codec else None
+            if codec:
+                logger.info(f"asr upload codec={codec.name}, capacity={self.asr_throughput.capacity}")
+            session = None
+            if self.session_recorder:
+                # 先开始新的一轮，这一轮的 ASR/TTS 连接编号从 1 开始
+                session = self.session_recorder.begin_turn({"codec": codec.name if codec else None,
+                                                            "hedge": self.asr_hedge})
+                self.session_recorder.key("ENTER_PRESSED")
+            if self.asr_hedge:
+                asr = HedgedASR(lambda on_partial, primary: self._new_asr(codec, on_partial, primary),
+                                self.asr_hedge_stats, delay=self.asr_hedge_delay,
+                                on_partial=self._on_partial_transcript)
+            else:
+                asr = self._new_asr(codec, self._on_partial_transcript)
+            self.transcript_text = ""
+            asr.start_stream(rate=16000)
+            self.asr = asr
+            t = threading.Thread(target=self.audio_recorder.start_recording,
+                                 args=(lambda audio_bytes: self._audio_callback(audio_bytes, asr, session),
+                                       lambda audio_data: self._feed(asr, audio_data)))
             t.start()
 
     # 停止录音
     def _stop_recording(self) -> None:
         if self.audio_recorder.is_recording:
-            time.sleep(1)
-            self.audio_recorder.stop_recording()
+            # 不再固定等 1 秒，录音线程在这句话说完(或 1 秒后)自行结束
+            if self.session_recorder:
+                self.session_recorder.key("ENTER_RELEASED")
+            self.audio_recorder.stop_recording(drain=1.0)
+
+    def _feed(self, asr: Union[ASRClient, HedgedASR], audio_data: bytes) -> None:
+        # 边录边送 ASR，开启会话录制时同时写进会话文件
+        if self.session_recorder:
+            self.session_recorder.capture(audio_data)
+        asr.feed(audio_data)
 
     # 录音回调函数，核心部分
-    def _audio_callback(self, audio_bytes: bytes) -> None:
-        # 语音转文字
-        user_prompt = self.asr(audio_bytes, rate=16000, timeout=int(os.getenv("asr_request_timeout")))
-        if user_prompt == "":
+    def _audio_callback(self, audio_bytes: bytes, asr: Union[ASRClient, HedgedASR, None] = None,
+                        session: Optional[SessionWriter] = None) -> None:
+        if self.session_recorder:
+            self.session_recorder.mark("callback")
+        # 录音已经停止，提示音不会被录进去；和后面的回答在混音器里叠加
+        self.earcon("thinking")
+        # run_turn 等这一轮的音频播完才返回，播放期间按键会打断并清空缓冲区
+        timings = self.pipeline.run_turn(asr or self.asr, audio_bytes)
+        # 说完之后再在后台压缩对话历史，不占用响应时间；被打断时新的一轮已经开始，留到下一轮结束再做
+        if not self.audio_recorder.is_recording and self.pipeline.turn is None:
+            self.chat.compact_history()
+        logger.info(f"turn timings={timings}, playback={self.playback.stats()}")
+        if self.session_recorder:
+            self.session_recorder.end_turn(session, timings)
+
+    def _wake_word_tap(self, data: bytes) -> None:
+        # 录音、回答和播放期间不检测，免得把自己说的“小燧”当成唤醒
+        if self.audio_recorder.is_recording or self.pipeline.turn is not None or self.playback.depth > 0:
+            self.wake_word_paused = True
             return
+        if self.wake_word_paused:
+            self.wake_word_paused = False
+            self.spotter.resume()
+        self.spotter.feed(data)
 
-        # 文字对话
-        assistent_response = self.chat(self.system_prompt, user_prompt)
-        logger.info(f"assistent_response={assistent_response}")
+    def earcon(self, name: str) -> None:
+        if self.earcon_enable:
+            self.mixer.play(self.earcons[name])
 
-        self.tts = TTSClient(os.getenv("tts_ws_connect_timeout"),
-                             os.getenv("tts_app_id"),
-                             os.getenv("tts_api_key"),
-                             os.getenv("tts_api_secret"))
+    def _on_partial_transcript(self, text: str) -> None:
+        self.transcript_text = text
+        self.transcript_event.set()
 
-        # 文字转语音并播放
-        self.tts(assistent_response, self.audio_player.play, rate=16000)
+    def transcript_render_daemon(self) -> None:
+        # 屏幕刷新较慢，只渲染最新的一版文本，中间版本直接丢弃
+        while True:
+            self.transcript_event.wait()
+            self.transcript_event.clear()
+            if self.ui_level == 0 and self.ui_state == UIState.CHAT and self.transcript_text:
+                self.show_transcript_with_banner(self.transcript_text)
 
     def network_check_daemon(self, period: int = 10) -> None:
         while True:
@@ -206,6 +385,30 @@ class App:
                     banner)
         self.screen.show_image(image)
 
+    def show_transcript_with_banner(self, text: str) -> None:
+        banner_height = 40
+        banner_width = self.screen.width - 10
+        image = Image.open("screen/image/topicon-chat.png")
+        banner = self.get_banner_image(banner_height, banner_width)
+        image.paste(banner,
+                    (self.screen.width - banner_height, (self.screen.height - banner_width) // 2),
+                    banner)
+        image = image.rotate(90)
+        draw = ImageDraw.Draw(image)
+        font = ImageFont.truetype("screen/Font/Font00.ttf", 20)
+
+        # 按像素宽度折行，只显示最后几行
+        lines = [""]
+        for char in text:
+            if font.getlength(lines[-1] + char) > self.screen.width:
+                lines.append("")
+            lines[-1] += char
+        lines = lines[-((self.screen.height - banner_height) // 24):]
+        for i, line in enumerate(lines):
+            draw.text((0, banner_height + i * 24), line, fill="BLACK", font=font, align="left")
+        image = image.rotate(-90)
+        self.screen.show_image(image)
+
     def show_wifi_list_with_banner(
             self,
             up: int = 0,
@@ -339,6 +542,11 @@ class App:
             button_right.when_pressed = lambda: key_event_queue.put(KeyEvent["RIGHT_PRESSED"])
             button_right.when_released = lambda: key_event_queue.put(KeyEvent["RIGHT_RELEASED"])
 
+        if self.spotter:
+            # 只在对话界面响应唤醒词，设置界面里不能当成确认键
+            self.spotter.on_detect = lambda score: key_event_queue.put(KeyEvent.ENTER_PRESSED) \
+                if self.ui_level == 0 and self.ui_state == UIState.CHAT else None
+
         # 显示初始画面
         self.show_image_with_banner("screen/image/topicon-chat.png")
         while True:
@@ -364,11 +572,13 @@ class App:
                     self._stop_recording()
                 elif key_event == KeyEvent.UP_PRESSED:
                     vol = self.volume_control.up()
+                    self.earcon("tick")
                     self.show_image_with_banner(f"screen/image/volume-{vol}.png")
                     time.sleep(0.2)
                     self.show_image_with_banner("screen/image/topicon-chat.png")
                 elif key_event == KeyEvent.DOWN_PRESSED:
                     vol = self.volume_control.down()
+                    self.earcon("tick")
                     self.show_image_with_banner(f"screen/image/volume-{vol}.png")
                     time.sleep(0.2)
                     self.show_image_with_banner("screen/image/topicon-chat.png")
@@ -421,6 +631,8 @@ class App:
     def run_forever(self) -> None:
         network_check_thread = Thread(target=self.network_check_daemon)
         network_check_thread.start()
+        transcript_render_thread = Thread(target=self.transcript_render_daemon, daemon=True)
+        transcript_render_thread.start()
         app_thread = Thread(target=self.core)
         app_thread.start()
 
@@ -0,0 +1,229 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+from asr.xf_iat import ASRClient
+from tts.xf_tts import TTSClient
+from tts.segmenter import SentenceSegmenter, split_text
+from tts.speech import SpeechQueue
+from tts.cache import TTSCache
+from chat.chat import Chat
+
+logger = logging.getLogger()
+
+NETWORK_ERROR_NOTICE = "网络好像出了点问题，请稍后再试。"
+# 启动时预先合成并缓存的固定语句
+WARMUP_PHRASES = [NETWORK_ERROR_NOTICE, "你好，我是小燧。", "我不懂。", "我没听清，请再说一遍。"]
+
+
+class Turn:
+    # 一轮对话中可以被打断的资源：ASR 请求、对话的 HTTP 流、合成播放队列
+    def __init__(self, asr: ASRClient):
+        self.asr = asr
+        self.chat_stream: Any = None
+        self.speech: Optional[SpeechQueue] = None
+        # run_turn 的各阶段耗时，进行中也可以读(例如基准测试判断合成是否已经结束)
+        self.timings: dict = {}
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+
+    def set_chat_stream(self, stream: Any) -> None:
+        with self.lock:
+            self.chat_stream = stream
+            cancelled = self.cancelled.is_set()
+        if cancelled:
+            stream.close()
+
+    def set_speech(self, speech: SpeechQueue) -> None:
+        with self.lock:
+            self.speech = speech
+            cancelled = self.cancelled.is_set()
+        if cancelled:
+            speech.cancel()
+
+    def cancel(self, flush: Optional[Callable[[], None]] = None) -> None:
+        with self.lock:
+            self.cancelled.set()
+            chat_stream, speech = self.chat_stream, self.speech
+        # 先清空播放缓冲区让设备立即闭嘴；关闭连接要等关闭握手，放到后台，不耽误开始新的录音
+        if flush:
+            flush()
+        threading.Thread(target=self._close, args=(chat_stream, speech), daemon=True).start()
+
+    def _close(self, chat_stream: Any, speech: Optional[SpeechQueue]) -> None:
+        if speech:
+            speech.cancel()
+        if chat_stream:
+            try:
+                chat_stream.close()
+            except Exception as e:
+                logger.warning(f"close chat stream failed: {e}")
+        self.asr.cancel()
+
+
+class VoicePipeline:
+    # 一轮对话的核心流程：ASR -> Chat -> TTS -> 播放，不依赖屏幕和按键，App 和基准测试共用
+    def __init__(self, chat: Chat, system_prompt: str, tts_factory: Callable[[], TTSClient],
+                 play: Callable[[bytes], None], asr_request_timeout: int = 10, rate: int = 16000,
+                 stream: bool = True, tts_timeout: float = 10, tts_cache: Optional[TTSCache] = None,
+                 tts_fanout: int = 2, flush: Optional[Callable[[], None]] = None,
+                 drain: Optional[Callable[[], None]] = None):
+        self.chat = chat
+        self.system_prompt = system_prompt
+        self.tts_factory = tts_factory
+        self.play = play
+        # 打断时清空播放缓冲区
+        self.flush = flush
+        # 等缓冲区里的音频播完；给了它，run_turn 要等播放结束才返回，这段时间里仍可以打断
+        self.drain = drain
+        self.asr_request_timeout = asr_request_timeout
+        self.rate = rate
+        self.stream = stream
+        self.tts_timeout = tts_timeout
+        self.tts_cache = tts_cache
+        # 同时进行的合成请求数，预热连接池的大小应不小于它
+        self.tts_fanout = tts_fanout
+        self.turn: Optional[Turn] = None
+
+    def cancel(self) -> bool:
+        # 打断正在进行的一轮：停止生成、关闭合成连接、清空播放缓冲区；返回是否真的打断了什么
+        turn = self.turn
+        if turn is None or turn.cancelled.is_set():
+            return False
+        turn.cancel(self.flush)
+        logger.info("turn cancelled")
+        return True
+
+    def run_turn(self, asr: ASRClient, audio_bytes: bytes) -> dict:
+        # 返回各阶段耗时(秒)，从松开按键、录音回调开始计时
+        start = time.monotonic()
+        self.turn = turn = Turn(asr)
+        timings = turn.timings
+
+        def mark(stage: str) -> None:
+            timings[stage] = time.monotonic() - start
+
+        try:
+            if not audio_bytes:
+                # 端点检测没有听到说话，不必再等 ASR
+                logger.info("no speech detected")
+                asr.cancel()
+                timings["error"] = "no speech"
+                return timings
+
+            # 语音转文字，录音过程中音频已经流式送出，这里只需要发送结束帧并等待结果
+            if asr.stream_queue is not None:
+                asr.finish()
+                user_prompt = asr.wait_result(timeout=self.asr_request_timeout)
+            else:
+                user_prompt = asr(audio_bytes, rate=self.rate, timeout=self.asr_request_timeout)
+            mark("asr")
+            timings["user_prompt"] = user_prompt
+            if turn.cancelled.is_set():
+                timings["error"] = "cancelled"
+                return timings
+            if user_prompt == "":
+                timings["error"] = "asr"
+                return timings
+
+            if self.stream:
+                self._speak_streaming(turn, user_prompt, timings, mark)
+            else:
+                self._speak(turn, user_prompt, timings, mark)
+            if turn.cancelled.is_set():
+                timings["error"] = "cancelled"
+                return timings
+            # 合成结束后缓冲区里可能还有几秒音频，播完才注销这一轮，按键打断仍会清空缓冲区
+            if self.drain:
+                self.drain()
+            return timings
+        finally:
+            if self.turn is turn:
+                self.turn = None
+
+    def _player(self, turn: Turn, timings: dict, mark: Callable[[str], None]) -> Callable[[bytes], None]:
+        def play(audio: bytes) -> None:
+            if turn.cancelled.is_set():
+                return
+            if "first_audio" not in timings:
+                mark("first_audio")
+            self.play(audio)
+        return play
+
+    def _speech_queue(self, turn: Turn, play: Callable[[bytes], None]) -> SpeechQueue:
+        speech = SpeechQueue(self.tts_factory, play, rate=self.rate, timeout=self.tts_timeout,
+                             max_inflight=self.tts_fanout, cache=self.tts_cache)
+        turn.set_speech(speech)
+        return speech
+
+    def _speak(self, turn: Turn, user_prompt: str, timings: dict, mark: Callable[[str], None]) -> None:
+        # 文字对话，整段请求无法中途断开，被打断时丢弃结果
+        try:
+            assistent_response = self.chat(self.system_prompt, user_prompt)
+        except Exception as e:
+            logger.error(f"chat failed: {e}")
+            timings["error"] = "chat"
+            self.say(NETWORK_ERROR_NOTICE)
+            return
+        mark("chat")
+        timings["response"] = assistent_response
+        logger.info(f"assistent_response={assistent_response}")
+        if turn.cancelled.is_set():
+            return
+
+        # 文字转语音并播放：长回答按句切开，在多个连接上并行合成，播放队列按顺序拼回；
+        # WebSocket 线程只负责收数据，不直接写声卡
+        speech = self._speech_queue(turn, self._player(turn, timings, mark))
+        for segment in split_text(assistent_response):
+            speech.put(segment)
+        speech.close()
+        failed = speech.wait()
+        mark("tts")
+        if failed and not turn.cancelled.is_set():
+            timings["error"] = "tts"
+
+    def say(self, text: str) -> None:
+        # 播放固定提示语，优先使用缓存，离线时也能提示
+        speech = SpeechQueue(self.tts_factory, self.play, rate=self.rate, timeout=self.tts_timeout,
+                             cache=self.tts_cache)
+        speech.put(text)
+        speech.close()
+        speech.wait()
+
+    def _speak_streaming(self, turn: Turn, user_prompt: str, timings: dict, mark: Callable[[str], None]) -> None:
+        # 流式对话：回答边生成边断句，每句立即合成，播放队列按顺序播放，说完第一句就开口
+        segmenter = SentenceSegmenter()
+        speech = self._speech_queue(turn, self._player(turn, timings, mark))
+
+        def put(segment: str) -> None:
+            if "first_segment" not in timings:
+                mark("first_segment")
+            logger.info(f"segment: {segment}")
+            speech.put(segment)
+
+        response = ""
+        try:
+            for delta in self.chat.stream(self.system_prompt, user_prompt, on_stream=turn.set_chat_stream):
+                if "first_token" not in timings:
+                    mark("first_token")
+                response += delta
+                for segment in segmenter.feed(delta):
+                    put(segment)
+        except Exception as e:
+            if not turn.cancelled.is_set():
+                logger.error(f"chat failed: {e}")
+                timings["error"] = "chat"
+                if not response:
+                    put(NETWORK_ERROR_NOTICE)
+        segment = segmenter.flush()
+        if segment and "error" not in timings and not turn.cancelled.is_set():
+            put(segment)
+        mark("chat")
+        timings["response"] = response
+        logger.info(f"assistent_response={response}")
+
+        speech.close()
+        failed = speech.wait()
+        mark("tts")
+        if failed and "error" not in timings and not turn.cancelled.is_set():
+            timings["error"] = "tts"
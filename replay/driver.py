@@ -0,0 +1,266 @@
+import os
+import sys
+import glob
+import json
+import time
+import base64
+import asyncio
+import logging
+import argparse
+from typing import List, Optional
+from standin.faults import Faults
+from gateway.wsproto import WebSocket
+from standin.xfyun_server import XfyunStandin
+from standin.chat_server import ChatStandin
+from asr.xf_iat import ASRClient
+from asr.xf_iat import create_session_manager as create_asr_session_manager
+from asr.codec import available_codecs
+from tts.xf_tts import TTSClient
+from tts.xf_tts import create_session_manager as create_tts_session_manager
+from chat.chat import Chat
+from pipeline import VoicePipeline
+from replay.session import Session
+
+logger = logging.getLogger()
+
+# 对比的阶段(秒)，与 VoicePipeline.run_turn 返回的键一致
+STAGES = ["asr", "first_token", "first_segment", "first_audio", "chat", "tts"]
+
+
+class ReplayXfyunStandin(XfyunStandin):
+    # 按录下的时间把 ASR 帧和合成帧原样发回去；speed>1 时按比例加快。没有录到的请求退回普通替身的行为
+    def __init__(self, speed: float = 1.0, **kwargs):
+        super().__init__(faults=Faults(0, 0), **kwargs)
+        self.speed = speed
+        self.session: Optional[Session] = None
+        self.origin = 0.0
+        self.asr_streams: List[int] = []
+        self.tts_used: set = set()
+
+    def load(self, session: Session, origin: float) -> None:
+        # origin 对应录制时本轮开始(按下按键)的时刻
+        self.session = session
+        self.origin = origin
+        self.asr_streams = sorted({stream for at, stream, message in session.asr_frames},
+                                  key=lambda stream: min(at for at, s, m in session.asr_frames if s == stream))
+        self.tts_used = set()
+        self.transcript = session.timings.get("user_prompt") or self.transcript
+
+    async def sleep_until(self, at: float) -> None:
+        await asyncio.sleep(max(0.0, at - time.monotonic()))
+
+    async def iat(self, ws: WebSocket) -> None:
+        # 连接池会提前建好连接，要等客户端发来第一帧才知道是哪一轮的哪个识别请求
+        first = await ws.recv_text()
+        if not self.asr_streams:
+            await self.iat_standin(ws, first)
+            return
+        stream = self.asr_streams.pop(0)
+        frames = [(at, message) for at, s, message in self.session.asr_frames if s == stream]
+        callback = self.session.mark_at("callback") or 0.0
+
+        async def receive() -> None:
+            # 客户端发来结束帧之后才下发最终结果，与真实服务一样
+            message = json.loads(first)
+            while message.get("data", {}).get("status") != 2:
+                message = json.loads(await ws.recv_text())
+
+        receiver = asyncio.ensure_future(receive())
+        try:
+            for at, message in frames:
+                response = json.loads(message)
+                if response.get("code") == 0 and response.get("data", {}).get("status") != 2:
+                    await self.sleep_until(self.origin + at / self.speed)
+                else:
+                    # 最终帧(或错误帧)：相对客户端结束帧的延迟按录音回调开始的时刻估计
+                    if response.get("code") == 0:
+                        await receiver
+                    await asyncio.sleep(max(0.0, at - callback) / self.speed)
+                await ws.send(message)
+            await ws.close()
+        finally:
+            receiver.cancel()
+
+    async def iat_standin(self, ws: WebSocket, first: str) -> None:
+        # 没有录到 ASR 帧：把已经读走的第一帧放回去，交给普通替身按录下的识别结果回复
+        recv_text = ws.recv_text
+        pending = [first]
+
+        async def replay_first() -> str:
+            return pending.pop() if pending else await recv_text()
+
+        ws.recv_text = replay_first
+        await super().iat(ws)
+
+    async def synthesize(self, ws: WebSocket, sid: str, text: str, rate: int) -> None:
+        # 按文本找到录下的合成请求，从收到请求算起按原来的间隔下发每一帧
+        for requested, stream, recorded in self.session.tts_requests if self.session else []:
+            if recorded == text and stream not in self.tts_used:
+                self.tts_used.add(stream)
+                break
+        else:
+            await super().synthesize(ws, sid, text, rate)
+            return
+        start = time.monotonic()
+        for at, s, status, audio in self.session.tts_frames:
+            if s != stream:
+                continue
+            await self.sleep_until(start + (at - requested) / self.speed)
+            await ws.send(json.dumps({"code": 0, "message": "success", "sid": sid,
+                                      "data": {"audio": base64.b64encode(audio).decode(), "status": status}}))
+
+
+class ReplayChatStandin(ChatStandin):
+    # 回答取录下的增量文本，每段按录制时相对请求的时刻下发
+    def __init__(self, speed: float = 1.0, **kwargs):
+        super().__init__(faults=Faults(0, 0), token_seconds=0, **kwargs)
+        self.speed = speed
+        self.deltas: List[tuple] = []
+
+    def load(self, session: Session) -> None:
+        requested = session.chat_requests[0][0] if session.chat_requests else 0.0
+        self.deltas = [(at - requested, text) for at, text in session.chat_deltas]
+        self.reply = "".join(text for at, text in self.deltas) or session.timings.get("response") or self.reply
+
+    def completion(self, request: dict) -> dict:
+        # 非流式：等到录制时整段回答到达的时刻
+        if self.deltas:
+            time.sleep(max(0.0, self.deltas[-1][0]) / self.speed)
+        return super().completion(request)
+
+    def completion_chunks(self, request: dict):
+        if not self.deltas:
+            yield from super().completion_chunks(request)
+            return
+        start = time.monotonic()
+        id = f"chatcmpl-replay-{int(time.time() * 1000)}"
+        base = {"id": id, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request.get("model", "standin")}
+        yield dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        for at, text in self.deltas:
+            time.sleep(max(0.0, start + at / self.speed - time.monotonic()))
+            yield dict(base, choices=[{"index": 0, "delta": {"content": text}, "finish_reason": None}])
+        yield dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+
+
+class Replayer:
+    # 不带屏幕、按键和声卡的 App：录音按原来的时刻送进 ASR，到录音回调的时刻走一遍 App._audio_callback 的流程
+    # (run_turn、等播放完、压缩历史)。main.App 依赖屏幕/GPIO/PIL，不能在开发机上直接实例化
+    def __init__(self, speed: float = 1.0, playback: bool = True, timeout: int = 10):
+        self.speed = speed
+        self.timeout = timeout
+        self.xfyun = ReplayXfyunStandin(speed).start_in_thread()
+        self.chat_standin = ReplayChatStandin(speed).start_in_thread()
+        self.asr_sessions = create_asr_session_manager("replay", "replay", url=f"{self.xfyun.url}/v2/iat").start()
+        self.tts_sessions = create_tts_session_manager("replay", "replay", url=f"{self.xfyun.url}/v2/tts",
+                                                       pool_size=3).start()
+        self.chat = Chat(url=self.chat_standin.url, model="replay", api_key="replay")
+        self.playback = None
+        if playback:
+            # audio 模块依赖 pyaudio/alsaaudio，只在需要时导入；按加速后的速率"播放"
+            from audio import PlaybackEngine
+            from bench.turn_latency import RealtimeSink
+            self.playback = PlaybackEngine(RealtimeSink(rate=int(16000 * speed)))
+        self.pipelines: dict = {}
+
+    def pipeline(self, meta: dict) -> VoicePipeline:
+        # 流式与否、并行合成数沿用录制时的配置；不用合成缓存，每句都经过替身
+        key = (meta.get("chat_stream", True), meta.get("tts_fanout", 3))
+        if key not in self.pipelines:
+            self.pipelines[key] = VoicePipeline(
+                self.chat, "你是小燧。",
+                lambda: TTSClient(self.timeout, "replay", "replay", "replay", session_manager=self.tts_sessions),
+                self.playback.write if self.playback else (lambda audio: None),
+                asr_request_timeout=self.timeout, stream=key[0], tts_timeout=self.timeout, tts_fanout=key[1],
+                flush=self.playback.flush if self.playback else None,
+                drain=self.playback.drain if self.playback else None)
+        return self.pipelines[key]
+
+    def new_asr(self, meta: dict) -> ASRClient:
+        codecs = {codec.name: codec for codec in available_codecs()}
+        codec = codecs.get(meta.get("codec"))
+        return ASRClient(self.timeout, "replay", "replay", "replay", session_manager=self.asr_sessions,
+                         codec=type(codec)() if codec else None)
+
+    def run(self, session: Session) -> dict:
+        pipeline = self.pipeline(session.meta)
+        origin = time.monotonic()
+        self.xfyun.load(session, origin)
+        self.chat_standin.load(session)
+
+        def wait_until(at: float) -> None:
+            time.sleep(max(0.0, origin + at / self.speed - time.monotonic()))
+
+        # 录制的第 0 秒就是按下按键、开始这一轮的时刻
+        asr = self.new_asr(session.meta)
+        asr.start_stream(rate=16000)
+        for at, pcm in session.capture:
+            wait_until(at)
+            asr.feed(pcm)
+        wait_until(session.mark_at("callback") or (session.capture[-1][0] if session.capture else 0.0))
+        timings = pipeline.run_turn(asr, b"".join(pcm for at, pcm in session.capture))
+        self.chat.compact_history()
+        return timings
+
+    def stop(self) -> None:
+        self.asr_sessions.stop()
+        self.tts_sessions.stop()
+        self.chat_standin.stop()
+
+
+def compare(session: Session, timings: dict, speed: float) -> float:
+    # 打印录制和回放的各阶段耗时，回放的按 speed 折算回原速；返回最大的变慢量(秒)
+    recorded = session.timings
+    print(session.summary())
+    print(f"  {'stage':14s}{'recorded':>10s}{'replayed':>10s}{'x speed':>10s}{'delta':>10s}   (ms)")
+    worst = 0.0
+    for stage in STAGES:
+        if not isinstance(recorded.get(stage), (int, float)) or not isinstance(timings.get(stage), (int, float)):
+            continue
+        scaled = timings[stage] * speed
+        worst = max(worst, scaled - recorded[stage])
+        print(f"  {stage:14s}{recorded[stage] * 1000:10.1f}{timings[stage] * 1000:10.1f}{scaled * 1000:10.1f}"
+              f"{(scaled - recorded[stage]) * 1000:+10.1f}")
+    for key in ("user_prompt", "response", "error"):
+        if recorded.get(key) != timings.get(key):
+            print(f"  {key} differs: recorded={recorded.get(key)!r} replayed={timings.get(key)!r}")
+    return worst
+
+
+def main(args: argparse.Namespace) -> int:
+    paths = []
+    for path in args.paths:
+        paths += sorted(glob.glob(os.path.join(path, "*.xsr"))) if os.path.isdir(path) else [path]
+    replayer = Replayer(args.speed, playback=not args.no_playback, timeout=args.timeout)
+    failed = 0
+    try:
+        for path in paths:
+            session = Session(path)
+            timings = replayer.run(session)
+            worst = compare(session, timings, args.speed)
+            # 回放的文本不一致说明流程本身变了，也算回归
+            if ("error" in timings and "error" not in session.timings) or \
+                    (args.fail_over is not None and worst * 1000 > args.fail_over):
+                failed += 1
+            time.sleep(args.gap)
+    finally:
+        replayer.stop()
+    print(f"sessions={len(paths)} regressions={failed}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="按录制时的节奏回放会话文件，对比各阶段耗时；可用于 git bisect run")
+    parser.add_argument("paths", nargs="+", help="会话文件(.xsr)或会话目录")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍数，2 表示两倍速")
+    parser.add_argument("--no-playback", action="store_true", help="不经播放引擎，合成的音频直接丢弃")
+    parser.add_argument("--fail-over", type=float, default=None,
+                        help="任一阶段(折算回原速后)比录制时慢超过这么多毫秒就以状态 1 退出")
+    parser.add_argument("--timeout", type=int, default=10)
+    parser.add_argument("--gap", type=float, default=0.05, help="两轮之间的间隔(秒)")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    sys.exit(main(args))
@@ -0,0 +1,260 @@
+import os
+import sys
+import glob
+import json
+import mmap
+import time
+import struct
+import logging
+import threading
+from typing import Iterator, List, Optional, Tuple, Union
+
+logger = logging.getLogger()
+
+# 文件头：魔数 + 元数据(JSON)长度，后面跟元数据
+MAGIC = b"XSR1"
+HEADER = struct.Struct("<4sI")
+# 记录头：类型、流编号(同一轮里的第几个 ASR/TTS 连接)、相对本轮开始的微秒数、负载长度
+RECORD = struct.Struct("<BHqI")
+
+# 记录类型；0 保留给文件末尾预分配的空白，读到就结束
+END = 0
+KEY = 1          # 按键事件名
+CAPTURE = 2      # 录到并送给 ASR 的 PCM
+MARK = 3         # 流程中的时间点，例如录音回调开始
+ASR_FRAME = 4    # ASR 服务端返回的原始 JSON 帧
+CHAT_REQUEST = 5  # 发给对话模型的 messages(JSON)
+CHAT_DELTA = 6   # 对话模型返回的增量文本
+TTS_REQUEST = 7  # 送去合成的文本
+TTS_FRAME = 8    # 合成返回的一帧：1 字节 status + PCM
+TIMINGS = 9      # 本轮结束时 run_turn 返回的各阶段耗时(JSON)
+
+KIND_NAMES = {KEY: "key", CAPTURE: "capture", MARK: "mark", ASR_FRAME: "asr_frame", CHAT_REQUEST: "chat_request",
+              CHAT_DELTA: "chat_delta", TTS_REQUEST: "tts_request", TTS_FRAME: "tts_frame", TIMINGS: "timings"}
+
+
+class SessionWriter:
+    # 追加写入内存映射的会话文件：先预分配，写满后成倍扩大再重新映射，关闭时截掉没用到的部分。
+    # 写一条记录只是一次内存拷贝，不经过系统调用，可以在录音、ASR 接收、合成线程里直接调用；
+    # 进程崩溃时文件末尾是预分配的 0，读到类型 0 就结束，已写入的记录都还在
+    def __init__(self, path: str, meta: Optional[dict] = None, capacity: int = 1 << 20):
+        self.path = path
+        self.file = open(path, "w+b")
+        self.capacity = capacity
+        self.file.truncate(capacity)
+        self.map = mmap.mmap(self.file.fileno(), capacity)
+        header = json.dumps(meta or {}, ensure_ascii=False).encode("utf-8")
+        self.position = 0
+        self._reserve(HEADER.size + len(header))
+        HEADER.pack_into(self.map, 0, MAGIC, len(header))
+        self.map[HEADER.size:HEADER.size + len(header)] = header
+        self.position = HEADER.size + len(header)
+        self.started = time.monotonic()
+        self.records = 0
+        self.lock = threading.Lock()
+
+    def _reserve(self, size: int) -> None:
+        if self.position + size <= self.capacity:
+            return
+        while self.position + size > self.capacity:
+            self.capacity *= 2
+        self.map.close()
+        self.file.truncate(self.capacity)
+        self.map = mmap.mmap(self.file.fileno(), self.capacity)
+
+    def append(self, kind: int, payload: bytes = b"", stream: int = 0, at: Optional[float] = None) -> None:
+        at = time.monotonic() if at is None else at
+        with self.lock:
+            if self.map is None:
+                return
+            self._reserve(RECORD.size + len(payload))
+            RECORD.pack_into(self.map, self.position, kind, stream, int((at - self.started) * 1e6), len(payload))
+            start = self.position + RECORD.size
+            self.map[start:start + len(payload)] = payload
+            self.position = start + len(payload)
+            self.records += 1
+
+    def close(self) -> None:
+        with self.lock:
+            if self.map is None:
+                return
+            self.map.flush()
+            self.map.close()
+            self.map = None
+            self.file.truncate(self.position)
+            self.file.close()
+
+
+class SessionReader:
+    # 只读映射，记录的负载是映射上的 memoryview，不拷贝
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, length = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: 不是会话文件")
+        self.meta = json.loads(bytes(self.map[HEADER.size:HEADER.size + length]))
+        self.start = HEADER.size + length
+
+    def __iter__(self) -> Iterator[Tuple[int, int, float, memoryview]]:
+        # (类型, 流编号, 相对本轮开始的秒数, 负载)
+        view = memoryview(self.map)
+        position = self.start
+        while position + RECORD.size <= len(view):
+            kind, stream, micros, length = RECORD.unpack_from(view, position)
+            if kind == END or position + RECORD.size + length > len(view):
+                break
+            position += RECORD.size
+            yield kind, stream, micros / 1e6, view[position:position + length]
+            position += length
+
+    def close(self) -> None:
+        self.map.close()
+
+
+class SessionRecorder:
+    # 可选的会话录制：每轮对话写一个文件，包含录音、按键时间、ASR 帧、对话请求和回答、合成帧；
+    # 只保留最近 keep 个文件。一轮之外到达的记录(例如上一轮被打断后的迟到帧)直接丢弃
+    def __init__(self, directory: str, keep: int = 200, meta: Optional[dict] = None):
+        self.directory = directory
+        self.keep = keep
+        self.meta = meta or {}
+        self.writer: Optional[SessionWriter] = None
+        self.streams = 0
+        self.turns = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def begin_turn(self, meta: Optional[dict] = None) -> SessionWriter:
+        # 打断时上一轮还没结束，它的文件由它自己的 end_turn 关闭，之后的新记录都写进这一轮
+        with self.lock:
+            self.turns += 1
+            self.streams = 0
+            name = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}-{self.turns:04d}.xsr"
+            meta = dict(self.meta, **(meta or {}), wall_time=time.time())
+            writer = self.writer = SessionWriter(os.path.join(self.directory, name), meta)
+        self._prune()
+        return writer
+
+    def end_turn(self, writer: Optional[SessionWriter], timings: dict) -> None:
+        if writer is None:
+            return
+        with self.lock:
+            if self.writer is writer:
+                self.writer = None
+        writer.append(TIMINGS, json.dumps(timings, ensure_ascii=False, default=str).encode("utf-8"))
+        writer.close()
+
+    def _prune(self) -> None:
+        files = sorted(glob.glob(os.path.join(self.directory, "*.xsr")), key=os.path.getmtime)
+        for path in files[:max(0, len(files) - self.keep)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stream(self) -> int:
+        # 新的 ASR/TTS 连接在本轮里的编号
+        with self.lock:
+            self.streams += 1
+            return self.streams
+
+    def record(self, kind: int, payload: bytes = b"", stream: int = 0) -> None:
+        writer = self.writer
+        if writer:
+            writer.append(kind, payload, stream)
+
+    def key(self, name: str) -> None:
+        self.record(KEY, name.encode("utf-8"))
+
+    def mark(self, name: str) -> None:
+        self.record(MARK, name.encode("utf-8"))
+
+    def capture(self, pcm: bytes) -> None:
+        self.record(CAPTURE, pcm)
+
+    def asr_frame(self, stream: int, message: Union[str, bytes]) -> None:
+        self.record(ASR_FRAME, message.encode("utf-8") if isinstance(message, str) else message, stream)
+
+    def chat_request(self, messages: list) -> None:
+        self.record(CHAT_REQUEST, json.dumps(messages, ensure_ascii=False).encode("utf-8"))
+
+    def chat_delta(self, text: str) -> None:
+        self.record(CHAT_DELTA, text.encode("utf-8"))
+
+    def tts_request(self, stream: int, text: str) -> None:
+        self.record(TTS_REQUEST, text.encode("utf-8"), stream)
+
+    def tts_frame(self, stream: int, status: int, audio: bytes) -> None:
+        self.record(TTS_FRAME, bytes([status or 0]) + audio, stream)
+
+
+class Session:
+    # 读出一轮的全部记录，按类型整理好，供回放和查看
+    def __init__(self, path: str):
+        self.path = path
+        reader = SessionReader(path)
+        self.meta = reader.meta
+        self.keys: List[Tuple[float, str]] = []
+        self.marks: List[Tuple[float, str]] = []
+        self.capture: List[Tuple[float, bytes]] = []
+        self.asr_frames: List[Tuple[float, int, str]] = []
+        self.chat_requests: List[Tuple[float, list]] = []
+        self.chat_deltas: List[Tuple[float, str]] = []
+        self.tts_requests: List[Tuple[float, int, str]] = []
+        self.tts_frames: List[Tuple[float, int, int, bytes]] = []
+        self.timings: dict = {}
+        for kind, stream, at, payload in reader:
+            if kind == KEY:
+                self.keys.append((at, str(payload, "utf-8")))
+            elif kind == MARK:
+                self.marks.append((at, str(payload, "utf-8")))
+            elif kind == CAPTURE:
+                self.capture.append((at, bytes(payload)))
+            elif kind == ASR_FRAME:
+                self.asr_frames.append((at, stream, str(payload, "utf-8")))
+            elif kind == CHAT_REQUEST:
+                self.chat_requests.append((at, json.loads(bytes(payload))))
+            elif kind == CHAT_DELTA:
+                self.chat_deltas.append((at, str(payload, "utf-8")))
+            elif kind == TTS_REQUEST:
+                self.tts_requests.append((at, stream, str(payload, "utf-8")))
+            elif kind == TTS_FRAME:
+                self.tts_frames.append((at, stream, payload[0], bytes(payload[1:])))
+            elif kind == TIMINGS:
+                self.timings = json.loads(bytes(payload))
+        # 还有 memoryview 指向映射时不能关闭
+        payload = None
+        reader.close()
+
+    def mark_at(self, name: str) -> Optional[float]:
+        for at, mark in self.marks:
+            if mark == name:
+                return at
+        return None
+
+    def summary(self) -> str:
+        audio = sum(len(pcm) for at, pcm in self.capture)
+        return (f"{os.path.basename(self.path)}: keys={[k for at, k in self.keys]} capture={audio / 32000:.1f}s "
+                f"asr_frames={len(self.asr_frames)} chat_deltas={len(self.chat_deltas)} "
+                f"tts={len(self.tts_requests)} requests/{len(self.tts_frames)} frames "
+                f"prompt={self.timings.get('user_prompt')!r}")
+
+
+if __name__ == "__main__":
+    # 查看会话文件：每轮的概要，加 -v 列出每条记录
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    verbose = "-v" in sys.argv[1:]
+    for path in [p for p in sys.argv[1:] if p != "-v"]:
+        if verbose:
+            reader = SessionReader(path)
+            logger.info(f"{path}: meta={reader.meta}")
+            for kind, stream, at, payload in reader:
+                text = f"{len(payload)} bytes" if kind in (CAPTURE, TTS_FRAME) else str(payload, "utf-8")[:80]
+                logger.info(f"  {at * 1000:9.1f}ms {KIND_NAMES.get(kind, kind):12s} #{stream} {text}")
+            payload = None
+            reader.close()
+        else:
+            logger.info(Session(path).summary())
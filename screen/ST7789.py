@@ -11,6 +11,14 @@ class ST7789(config.RaspberryPi):
     width = 240
     height = 240
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 预分配的帧缓冲：RGB565 的中间结果(本机字节序)和发给屏幕的大端数据，每次刷新复用
+        self._rgb565 = self.np.empty((self.height, self.width), dtype=self.np.uint16)
+        self._scratch = self.np.empty((self.height, self.width), dtype=self.np.uint16)
+        self._frame = self.np.empty((self.height, self.width), dtype='>u2')
+        self._white = b'\xff' * (self.width * self.height * 2)
+
     def command(self, cmd):
         self.digital_write(self.GPIO_DC_PIN, False)
         self.spi_writebyte([cmd])
@@ -134,23 +142,28 @@ class ST7789(config.RaspberryPi):
             raise ValueError('Image must be same dimensions as display \
                 ({0}x{1}).'.format(self.width, self.height))
         img = self.np.asarray(image)
-        pix = self.np.zeros((self.width, self.height, 2), dtype=self.np.uint8)
-        pix[..., [0]] = self.np.add(self.np.bitwise_and(img[..., [0]], 0xF8), self.np.right_shift(img[..., [1]], 5))
-        pix[..., [1]] = self.np.add(self.np.bitwise_and(self.np.left_shift(img[..., [1]], 3), 0xE0),
-                                    self.np.right_shift(img[..., [2]], 3))
-        pix = pix.flatten().tolist()
+        # RGB565 = R[7:3] G[7:2] B[7:3]，在预分配的 uint16 缓冲里原地计算，再一次性转成大端
+        np, rgb565, scratch = self.np, self._rgb565, self._scratch
+        np.copyto(rgb565, img[..., 0])
+        rgb565 &= 0xF8
+        rgb565 <<= 8
+        np.copyto(scratch, img[..., 1])
+        scratch &= 0xFC
+        scratch <<= 3
+        rgb565 |= scratch
+        np.copyto(scratch, img[..., 2])
+        scratch >>= 3
+        rgb565 |= scratch
+        np.copyto(self._frame, rgb565)
         self.SetWindows(0, 0, self.width, self.height)
         self.digital_write(self.GPIO_DC_PIN, True)
-        for i in range(0, len(pix), 4096):
-            self.spi_writebyte(pix[i:i + 4096])
+        self.spi_writebuffer(self._frame)
 
     def clear(self):
         """Clear contents of image buffer"""
-        _buffer = [0xff] * (self.width * self.height * 2)
         self.SetWindows(0, 0, self.width, self.height)
         self.digital_write(self.GPIO_DC_PIN, True)
-        for i in range(0, len(_buffer), 4096):
-            self.spi_writebyte(_buffer[i:i + 4096])
+        self.spi_writebuffer(self._white)
 
     def bl_DutyCycle(self, duty):
         """Set backlight duty cycle"""
@@ -66,6 +66,18 @@ class RaspberryPi:
         if self.SPI is not None:
             self.SPI.writebytes(data)
 
+    def spi_writebuffer(self, data):
+        # 整块写入实现了缓冲区协议的数据(bytes/numpy 数组)，不转成 Python 列表；
+        # spidev>=3.5 的 writebytes2 在 C 里按驱动的 bufsiz 分块，旧版本退回每次 4096 字节的 writebytes
+        if self.SPI is None:
+            return
+        if hasattr(self.SPI, "writebytes2"):
+            self.SPI.writebytes2(data)
+            return
+        data = memoryview(data).cast("B")
+        for i in range(0, len(data), 4096):
+            self.SPI.writebytes(data[i:i + 4096].tolist())
+
     def bl_DutyCycle(self, duty):
         self.GPIO_BL_PIN.value = duty / 100
 
@@ -0,0 +1,155 @@
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from standin.faults import Faults
+
+logger = logging.getLogger()
+
+
+class ChatStandin:
+    # OpenAI 兼容的 /v1/chat/completions 替身，回答内容固定，延迟和故障可配置
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, faults: Optional[Faults] = None,
+                 reply: str = "你好，我是小燧。今天天气晴，最高气温二十五度，适合出门散步。",
+                 token_chars: int = 2, token_seconds: float = 0.03):
+        self.host = host
+        self.port = port
+        self.faults = faults or Faults()
+        self.reply = reply
+        # stream=True 时每 token_seconds 下发 token_chars 个字，模拟逐 token 生成
+        self.token_chars = token_chars
+        self.token_seconds = token_seconds
+        self.httpd: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def make_handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self.send_json(404, {"error": {"message": "not found"}})
+                    return
+                failure = standin.faults.failure()
+                standin.faults.sleep()
+                if failure == "error":
+                    self.send_json(500, {"error": {"message": "standin injected error", "type": "server_error"}})
+                    return
+                if failure == "drop":
+                    # 没有响应就断开
+                    self.close_connection = True
+                    return
+                if failure == "stall":
+                    # 不响应也不断开，直到客户端超时放弃
+                    self.close_connection = True
+                    self.wait_disconnect()
+                    return
+                if request.get("stream"):
+                    self.send_stream(request)
+                else:
+                    # 非流式要等全部 token 生成完才返回
+                    time.sleep(standin.token_seconds * len(list(standin.completion_chunks(request))))
+                    self.send_json(200, standin.completion(request))
+
+            def wait_disconnect(self) -> None:
+                try:
+                    while self.connection.recv(4096):
+                        pass
+                except OSError:
+                    pass
+
+            def send_stream(self, request: dict) -> None:
+                # SSE 格式，不带 Content-Length，写完后关闭连接
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    for chunk in standin.completion_chunks(request):
+                        self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                        time.sleep(standin.token_seconds)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前断开(例如被打断)
+                    pass
+
+            def send_json(self, code: int, body: dict) -> None:
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def completion(self, request: dict) -> dict:
+        return {
+            "id": f"chatcmpl-standin-{int(time.time() * 1000)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "standin"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": self.reply}}],
+            "usage": {"prompt_tokens": sum(len(m.get("content", "")) for m in request.get("messages", [])),
+                      "completion_tokens": len(self.reply),
+                      "total_tokens": 0}
+        }
+
+    def completion_chunks(self, request: dict):
+        id = f"chatcmpl-standin-{int(time.time() * 1000)}"
+        base = {"id": id, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request.get("model", "standin")}
+        yield dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        for offset in range(0, len(self.reply), self.token_chars):
+            yield dict(base, choices=[{"index": 0, "delta": {"content": self.reply[offset:offset + self.token_chars]},
+                                       "finish_reason": None}])
+        yield dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+
+    def start_in_thread(self) -> "ChatStandin":
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, name="chat-standin", daemon=True).start()
+        logger.info(f"chat standin listening on {self.url}")
+        return self
+
+    def stop(self) -> None:
+        if self.httpd:
+            self.httpd.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI 兼容对话接口本地替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--token-seconds", type=float, default=0.03)
+    args = parser.parse_args()
+
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    standin = ChatStandin(args.host, args.port, Faults(args.latency, args.jitter, args.failure_rate),
+                          token_seconds=args.token_seconds)
+    standin.start_in_thread()
+    threading.Event().wait()
@@ -0,0 +1,33 @@
+import asyncio
+import random
+import time
+from typing import Optional
+
+
+class Faults:
+    # 延迟、抖动和故障注入配置，所有替身服务共用
+    # failure_rate 的请求会随机出现以下故障之一：
+    #   error - 返回错误码后关闭
+    #   drop  - 不发 close 帧直接断开
+    #   stall - 不再响应，直到客户端放弃
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, failure_rate: float = 0.0,
+                 failure_modes: tuple = ("error", "drop", "stall"), seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_modes = failure_modes
+        self.random = random.Random(seed)
+
+    def delay_seconds(self) -> float:
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    async def delay(self) -> None:
+        await asyncio.sleep(self.delay_seconds())
+
+    def sleep(self) -> None:
+        time.sleep(self.delay_seconds())
+
+    def failure(self) -> Optional[str]:
+        if self.failure_rate > 0 and self.random.random() < self.failure_rate:
+            return self.random.choice(self.failure_modes)
+        return None
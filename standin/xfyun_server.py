@@ -0,0 +1,173 @@
+import sys
+import logging
+import asyncio
+import argparse
+import base64
+import json
+import threading
+import numpy as np
+from typing import Optional
+from gateway.wsproto import WebSocket, ConnectionClosed, handshake
+from standin.faults import Faults
+
+logger = logging.getLogger()
+
+
+class XfyunStandin:
+    # 本地替身：在一个端口上同时提供 /v2/iat 和 /v2/tts 两套讯飞 WebSocket 帧协议，不校验签名
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, faults: Optional[Faults] = None,
+                 transcript: str = "今天天气怎么样", partial_every: int = 10,
+                 tts_char_seconds: float = 0.2, tts_rtf: float = 0.1, tts_chunk_seconds: float = 0.1):
+        self.host = host
+        self.port = port
+        self.faults = faults or Faults()
+        self.transcript = transcript
+        self.partial_every = partial_every
+        self.tts_char_seconds = tts_char_seconds
+        self.tts_rtf = tts_rtf
+        self.tts_chunk_seconds = tts_chunk_seconds
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.sid = 0
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"xfyun standin listening on {self.url}")
+
+    def start_in_thread(self) -> "XfyunStandin":
+        # 在后台线程里跑独立事件循环，方便同步代码(基准测试)直接使用
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="xfyun-standin", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.start(), self.loop).result()
+        return self
+
+    def next_sid(self, prefix: str) -> str:
+        self.sid += 1
+        return f"{prefix}{self.sid:08d}@standin"
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        ws = None
+        try:
+            ws = await handshake(reader, writer)
+            if ws is None:
+                return
+            if ws.path.endswith("/iat"):
+                await self.iat(ws)
+            elif ws.path.endswith("/tts"):
+                await self.tts(ws)
+            else:
+                await ws.close(1008, "unknown path")
+        except (ConnectionClosed, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error(f"standin handler exception: {e}")
+        finally:
+            if ws and not ws.closed:
+                await ws.close()
+
+    async def fail(self, ws: WebSocket, mode: str, sid: str) -> None:
+        if mode == "error":
+            await ws.send(json.dumps({"code": 10800, "message": "standin injected error", "sid": sid}))
+            await ws.close()
+        elif mode == "drop":
+            ws.abort()
+        else:
+            # stall：读掉客户端后续的数据但永不回复
+            while True:
+                await ws.recv()
+
+    def iat_result(self, sid: str, sn: int, text: str, status: int) -> str:
+        # 每次都用全文替换之前所有结果，对应 dwa=wpgs 的 pgs=rpl 语义
+        result = {"sn": sn, "ls": status == 2, "bg": 0, "ed": 0,
+                  "ws": [{"bg": 0, "cw": [{"sc": 0, "w": text}]}] if text else []}
+        if sn > 1:
+            result["pgs"] = "rpl"
+            result["rg"] = [1, sn - 1]
+        else:
+            result["pgs"] = "apd"
+        return json.dumps({"code": 0, "message": "success", "sid": sid,
+                           "data": {"status": status, "result": result}}, ensure_ascii=False)
+
+    async def iat(self, ws: WebSocket) -> None:
+        sid = self.next_sid("iat")
+        frames = 0
+        sn = 0
+        failure = None
+        while True:
+            message = json.loads(await ws.recv_text())
+            data = message.get("data", {})
+            if frames == 0:
+                if "business" not in message or "common" not in message:
+                    await ws.send(json.dumps({"code": 10106, "message": "invalid parameter", "sid": sid}))
+                    await ws.close()
+                    return
+                failure = self.faults.failure()
+            frames += 1
+            if failure:
+                await self.fail(ws, failure, sid)
+                return
+
+            if data.get("status") == 2:
+                await self.faults.delay()
+                sn += 1
+                await ws.send(self.iat_result(sid, sn, self.transcript, 2))
+                await ws.close()
+                return
+            if self.partial_every and frames % self.partial_every == 0:
+                sn += 1
+                text = self.transcript[:min(len(self.transcript), sn)]
+                await ws.send(self.iat_result(sid, sn, text, 1))
+
+    async def tts(self, ws: WebSocket) -> None:
+        sid = self.next_sid("tts")
+        message = json.loads(await ws.recv_text())
+        failure = self.faults.failure()
+        if failure:
+            await self.fail(ws, failure, sid)
+            return
+        text = base64.b64decode(message["data"]["text"]).decode("utf-8")
+        auf = message.get("business", {}).get("auf", "audio/L16;rate=16000")
+        await self.synthesize(ws, sid, text, int(auf.split("rate=")[-1]))
+
+    async def synthesize(self, ws: WebSocket, sid: str, text: str, rate: int) -> None:
+        # 合成一段时长与文本长度成正比的正弦音，按 tts_rtf 的实时率分块下发
+        await self.faults.delay()
+        total = max(1, int(len(text) * self.tts_char_seconds * rate))
+        chunk = max(1, int(self.tts_chunk_seconds * rate))
+        t = np.arange(total) / rate
+        pcm = (np.sin(2 * np.pi * 440 * t) * 3000).astype('<i2').tobytes()
+        for offset in range(0, total, chunk):
+            last = offset + chunk >= total
+            audio = pcm[offset * 2:(offset + chunk) * 2]
+            await ws.send(json.dumps({"code": 0, "message": "success", "sid": sid,
+                                      "data": {"audio": base64.b64encode(audio).decode(), "status": 2 if last else 1,
+                                               "ced": str(offset + chunk)}}))
+            if not last:
+                await asyncio.sleep(self.tts_chunk_seconds * self.tts_rtf)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="xfyun iat/tts 本地替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--transcript", default="今天天气怎么样")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    async def main():
+        standin = XfyunStandin(args.host, args.port, Faults(args.latency, args.jitter, args.failure_rate),
+                               transcript=args.transcript)
+        await standin.start()
+        await standin.server.serve_forever()
+
+    asyncio.run(main())
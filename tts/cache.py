@@ -0,0 +1,168 @@
+import os
+import sys
+import mmap
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+from tts.xf_tts import TTSClient, DEFAULT_VCN, DEFAULT_SPEED
+
+logger = logging.getLogger()
+
+
+def cache_key(text: str, vcn: str, speed: int, rate: int) -> str:
+    return hashlib.sha1(f"{vcn}|{speed}|{rate}|{text}".encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    # 合成结果的磁盘缓存：每条是一个裸 PCM 文件，文件名是 (text, vcn, speed, rate) 的哈希；
+    # 读取用 mmap，播放时直接切 memoryview，不拷贝；总大小超过 max_bytes 时按最近使用淘汰，
+    # 预热的提示语固定在缓存里不淘汰。发音人和语速在构造时固定，tts_factory 创建的 TTSClient 要用同样的 vcn/speed。
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, vcn: str = DEFAULT_VCN,
+                 speed: int = DEFAULT_SPEED, seen_size: int = 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.vcn = vcn
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # 文件名 -> 大小，按最近使用排序，最后一个是最新的
+        self.index: "OrderedDict[str, int]" = OrderedDict()
+        self.total = 0
+        # 预热写入的文件名，不参与淘汰(离线时要靠它们播放提示)
+        self.pinned: set = set()
+        # 最近未命中的文件名 -> 未命中次数，只有重复出现的句子才值得写进缓存
+        self.seen: "OrderedDict[str, int]" = OrderedDict()
+        self.seen_size = seen_size
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        # 重启后按文件修改时间(命中时会更新)恢复使用顺序
+        entries = []
+        for name in os.listdir(self.path):
+            file = os.path.join(self.path, name)
+            if name.endswith(".tmp"):
+                os.remove(file)
+                continue
+            if not name.endswith(".pcm"):
+                continue
+            stat = os.stat(file)
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self.index[name] = size
+            self.total += size
+        self._evict()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def get(self, text: str, rate: int = 16000) -> Optional[memoryview]:
+        name = cache_key(text, self.vcn, self.speed, rate) + ".pcm"
+        with self.lock:
+            if name not in self.index:
+                self.misses += 1
+                self.seen[name] = self.seen.pop(name, 0) + 1
+                while len(self.seen) > self.seen_size:
+                    self.seen.popitem(last=False)
+                return None
+            self.index.move_to_end(name)
+            self.hits += 1
+        try:
+            with open(self._file(name), "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(self._file(name))
+        except (OSError, ValueError) as e:
+            # 文件被删或为空，当作未命中
+            logger.warning(f"tts cache read failed: {e}")
+            with self.lock:
+                self.total -= self.index.pop(name, 0)
+            return None
+        return memoryview(mm)
+
+    def wants(self, text: str, rate: int = 16000) -> bool:
+        # 第二次未命中才缓存：大模型的回答大多只出现一次，每句都写会挤掉预热的提示语，也白白写 SD 卡
+        name = cache_key(text, self.vcn, self.speed, rate) + ".pcm"
+        with self.lock:
+            return self.seen.get(name, 0) >= 2
+
+    def pin(self, text: str, rate: int = 16000) -> None:
+        with self.lock:
+            self.pinned.add(cache_key(text, self.vcn, self.speed, rate) + ".pcm")
+
+    def put(self, text: str, pcm: bytes, rate: int = 16000, pinned: bool = False) -> None:
+        if not pcm:
+            return
+        name = cache_key(text, self.vcn, self.speed, rate) + ".pcm"
+        tmp = self._file(f"{name}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(pcm)
+        # 先写临时文件再改名，断电也不会留下半截音频
+        os.replace(tmp, self._file(name))
+        with self.lock:
+            self.total += len(pcm) - self.index.pop(name, 0)
+            self.index[name] = len(pcm)
+            self.seen.pop(name, None)
+            if pinned:
+                self.pinned.add(name)
+            self._evict()
+
+    def _evict(self) -> None:
+        # 最新写入的一条即使超出也保留
+        for name in list(self.index)[:-1]:
+            if self.total <= self.max_bytes:
+                break
+            if name in self.pinned:
+                continue
+            self.total -= self.index.pop(name)
+            try:
+                # 正在播放的 mmap 不受影响，文件在映射关闭后才真正释放
+                os.remove(self._file(name))
+            except FileNotFoundError:
+                pass
+
+    def warmup(self, texts: Iterable[str], tts_factory: Callable[[], TTSClient], rate: int = 16000,
+               timeout: int = 10) -> None:
+        # 启动时把固定提示语预先合成好，之后离线也能播放
+        for text in texts:
+            if self.get(text, rate) is not None:
+                self.pin(text, rate)
+                continue
+            chunks = []
+            tts = tts_factory()
+            tts(text, chunks.append, rate=rate, timeout=timeout)
+            if tts.future.done() and tts.future.exception() is None:
+                self.put(text, b"".join(chunks), rate, pinned=True)
+                logger.info(f"tts cache warmed: {text}")
+
+    def start_warmup(self, texts: Iterable[str], tts_factory: Callable[[], TTSClient],
+                     rate: int = 16000) -> threading.Thread:
+        t = threading.Thread(target=self.warmup, args=(list(texts), tts_factory, rate), name="tts-warmup",
+                             daemon=True)
+        t.start()
+        return t
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.index), "bytes": self.total, "pinned": len(self.pinned), "hits": self.hits,
+                    "misses": self.misses}
+
+
+if __name__ == "__main__":
+    import tempfile
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    cache = TTSCache(tempfile.mkdtemp(), max_bytes=3 * 32000)
+    pcm = bytes(32000)
+    cache.put("网络好像出了点问题", pcm, pinned=True)
+    for text in ["你好", "我不懂", "音量已调大"]:
+        cache.put(text, pcm)
+    start = time.monotonic()
+    audio = cache.get("音量已调大")
+    logger.info(f"hit in {(time.monotonic() - start) * 1000:.3f}ms, {len(audio)} bytes, "
+                f"evicted={cache.get('你好') is None}, pinned kept={cache.get('网络好像出了点问题') is not None}, "
+                f"stats={cache.stats()}")
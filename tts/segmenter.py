@@ -0,0 +1,118 @@
+from typing import List, Optional
+
+# 句末标点，遇到即可断句
+SENTENCE_END = "。！？；!?;…\n"
+# 句中停顿，句子过长时退而在这里断开
+CLAUSE_END = "，、：,:"
+# 紧跟在标点后面的右引号、右括号归到前一句
+CLOSING = "”’」』）)】》\"'"
+
+
+class SentenceSegmenter:
+    # 把 LLM 流式吐出的文本增量切成适合逐句合成的片段：
+    # 第一句尽量短(逗号处即可断开)，让设备尽快开口；之后按句末标点切，过长的句子在逗号处切，
+    # 再长则强制按 max_chars 切。英文句点只有后面跟着空白时才算句末，避免把 3.5、v1.2 切开。
+    def __init__(self, first_min_chars: int = 4, min_chars: int = 8, max_chars: int = 60):
+        self.first_min_chars = first_min_chars
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.buffer = ""
+        self.count = 0
+
+    def reset(self) -> None:
+        self.buffer = ""
+        self.count = 0
+
+    def feed(self, text: str) -> List[str]:
+        self.buffer += text
+        segments = []
+        while True:
+            end = self._find()
+            if end is None:
+                break
+            segment = self._cut(end)
+            if segment:
+                segments.append(segment)
+        return segments
+
+    def flush(self) -> Optional[str]:
+        segment = self.buffer.strip()
+        self.buffer = ""
+        if not segment:
+            return None
+        self.count += 1
+        return segment
+
+    def _find(self) -> Optional[int]:
+        # 返回下一个切分位置，还不能切时返回 None
+        min_chars = self.first_min_chars if self.count == 0 else self.min_chars
+        buffer = self.buffer
+        clause = -1
+        i = 0
+        while i < len(buffer):
+            ch = buffer[i]
+            end = -1
+            if ch in SENTENCE_END:
+                end = i
+            elif ch == ".":
+                if i + 1 >= len(buffer):
+                    # 还不知道后面是不是空白，等下一个增量
+                    break
+                if buffer[i + 1].isspace():
+                    end = i
+            elif ch in CLAUSE_END:
+                clause = i
+            if end >= 0:
+                end = self._extend(buffer, end)
+                if end is None:
+                    # 标点后面可能还有引号、括号，等下一个增量再决定
+                    break
+                if len(buffer[:end].strip()) >= min_chars:
+                    return end
+                clause = max(clause, end - 1)
+                i = end
+                continue
+            if clause >= 0 and self.count == 0 and len(buffer[:clause + 1].strip()) >= min_chars:
+                # 第一句在逗号处就断开
+                return clause + 1
+            if i + 1 >= self.max_chars:
+                return clause + 1 if clause + 1 >= min_chars else i + 1
+            i += 1
+        return None
+
+    def _extend(self, buffer: str, end: int) -> Optional[int]:
+        # 把连续的句末标点和右引号、右括号都算进前一句，返回切分位置
+        end += 1
+        while end < len(buffer) and (buffer[end] in SENTENCE_END or buffer[end] in CLOSING):
+            end += 1
+        if end >= len(buffer):
+            return None
+        return end
+
+    def _cut(self, end: int) -> Optional[str]:
+        segment = self.buffer[:end].strip()
+        self.buffer = self.buffer[end:]
+        if not segment:
+            return None
+        self.count += 1
+        return segment
+
+
+def split_text(text: str, max_chars: int = 60) -> List[str]:
+    # 整段文本一次切完，用于长回答的并行合成；每段不超过 max_chars，也避开接口的单次文本长度上限
+    segmenter = SentenceSegmenter(max_chars=max_chars)
+    segments = segmenter.feed(text)
+    last = segmenter.flush()
+    if last:
+        segments.append(last)
+    return segments
+
+
+if __name__ == "__main__":
+    segmenter = SentenceSegmenter()
+    reply = "你好，我是小燧。今天天气晴，最高气温25.5度，适合出门散步！你想去哪里呢？“公园”还是（商场）？Sure. Let's go!"
+    for i in range(0, len(reply), 3):
+        for segment in segmenter.feed(reply[i:i + 3]):
+            print(segment)
+    print(segmenter.flush())
+    print(split_text(reply))
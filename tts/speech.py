@@ -0,0 +1,137 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+from tts.xf_tts import TTSClient, TTSError
+from tts.cache import TTSCache
+
+logger = logging.getLogger()
+
+
+class Segment:
+    # 一句话的合成请求，音频块按到达顺序进入 chunks，None 表示这一句结束
+    def __init__(self, index: int, text: str):
+        self.index = index
+        self.text = text
+        self.chunks: queue.Queue = queue.Queue()
+        self.tts: Optional[TTSClient] = None
+        self.error: Optional[Exception] = None
+        # 重复出现的句子才收集音频写进缓存
+        self.store = False
+        self.audio: List[bytes] = []
+
+
+class SpeechQueue:
+    # 逐句合成、按序播放：put() 之后立即在预热连接上发起合成，最多 max_inflight 句同时合成；
+    # 播放线程按顺序播放，当前句还在合成时边收边播，后面的句子在播放期间合成好排队等待
+    def __init__(self, tts_factory: Callable[[], TTSClient], play: Callable[[bytes], None],
+                 rate: int = 16000, timeout: float = 10, max_inflight: int = 2, cache: Optional[TTSCache] = None):
+        self.tts_factory = tts_factory
+        self.play = play
+        self.rate = rate
+        self.timeout = timeout
+        self.cache = cache
+        self.inflight = threading.Semaphore(max_inflight)
+        self.pending: queue.Queue = queue.Queue()
+        self.ordered: queue.Queue = queue.Queue()
+        self.segments: List[Segment] = []
+        self.cancelled = False
+        self.first_audio_at: Optional[float] = None
+        self.done: Future = Future()
+        threading.Thread(target=self._synthesize_daemon, name="tts-synth", daemon=True).start()
+        threading.Thread(target=self._play_daemon, name="tts-play", daemon=True).start()
+
+    def put(self, text: str) -> None:
+        segment = Segment(len(self.segments), text)
+        self.segments.append(segment)
+        self.pending.put(segment)
+        self.ordered.put(segment)
+
+    def close(self) -> None:
+        # 不再有新的句子，播放完已排队的句子后 done 完成
+        self.pending.put(None)
+        self.ordered.put(None)
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        for segment in self.segments:
+            if segment.tts:
+                segment.tts._fail(TTSError("cancelled"))
+                if segment.tts.ws:
+                    segment.tts.ws.close()
+            segment.chunks.put(None)
+        self.close()
+
+    def wait(self, timeout: Optional[float] = None) -> List[Segment]:
+        # 返回合成失败的句子
+        self.done.result(timeout=timeout)
+        return [segment for segment in self.segments if segment.error]
+
+    def _synthesize_daemon(self) -> None:
+        while True:
+            segment = self.pending.get()
+            if segment is None or self.cancelled:
+                return
+            audio = self.cache.get(segment.text, self.rate) if self.cache else None
+            if audio is not None:
+                # 缓存命中，不走网络，直接交给播放线程
+                segment.chunks.put(audio)
+                segment.chunks.put(None)
+                continue
+            segment.store = bool(self.cache) and self.cache.wants(segment.text, self.rate)
+            self.inflight.acquire()
+            if self.cancelled:
+                self.inflight.release()
+                return
+            try:
+                segment.tts = self.tts_factory()
+                future = segment.tts.submit(segment.text,
+                                            lambda audio, segment=segment: self._on_audio(segment, audio),
+                                            rate=self.rate)
+            except Exception as e:
+                future = Future()
+                future.set_exception(e)
+            future.add_done_callback(lambda f, segment=segment: self._on_synthesized(segment, f))
+
+    def _on_audio(self, segment: Segment, audio: bytes) -> None:
+        if segment.store:
+            segment.audio.append(audio)
+        segment.chunks.put(audio)
+
+    def _on_synthesized(self, segment: Segment, future: Future) -> None:
+        segment.error = future.exception()
+        if segment.error:
+            logger.error(f"tts segment {segment.index} failed: {segment.error}")
+        elif segment.store and not self.cancelled:
+            self.cache.put(segment.text, b"".join(segment.audio), self.rate)
+        segment.chunks.put(None)
+        self.inflight.release()
+
+    def _play_daemon(self) -> None:
+        try:
+            while True:
+                segment = self.ordered.get()
+                if segment is None:
+                    break
+                while not self.cancelled:
+                    try:
+                        audio = segment.chunks.get(timeout=self.timeout)
+                    except queue.Empty:
+                        # 合成卡住，放弃这一句，不让后面的句子一直等
+                        logger.error(f"tts segment {segment.index} stalled for {self.timeout}s")
+                        if segment.tts:
+                            segment.tts._fail(TTSError(f"no audio received within {self.timeout}s"))
+                            if segment.tts.ws:
+                                segment.tts.ws.close()
+                        segment.error = segment.error or TTSError("stalled")
+                        break
+                    if audio is None:
+                        break
+                    if audio and not self.cancelled:
+                        if self.first_audio_at is None:
+                            self.first_audio_at = time.monotonic()
+                        self.play(audio)
+        finally:
+            self.done.set_result(None)
@@ -2,27 +2,36 @@ import os
 import sys
 import logging
 import websocket
-import datetime
-import hashlib
 import base64
-import hmac
 import json
-from urllib.parse import urlencode
 import time
-import ssl
-from wsgiref.handlers import format_date_time
-from datetime import datetime
-from time import mktime
 import threading
-import os
-import pyaudio
+from concurrent.futures import Future
+from xfyun.session import Session, SessionManager, create_url
+from replay.session import SessionRecorder
 from typing import Optional, Any, Union, Callable
 
+TTS_URL = 'wss://tts-api.xfyun.cn/v2/tts'
+DEFAULT_VCN = "x4_lingxiaolu_en"
+DEFAULT_SPEED = 50
+
 logger = logging.getLogger()
 
 
+class TTSError(Exception):
+    pass
+
+
+def create_session_manager(api_key: str, api_secret: str, url: str = TTS_URL, **kwargs) -> SessionManager:
+    # 官方 tts 接口签名用的 host 是 ws-api.xfyun.cn；url 可以指向本地替身服务(standin)做离线测试
+    host = "ws-api.xfyun.cn" if url == TTS_URL else None
+    return SessionManager("tts", lambda: create_url(url, api_key, api_secret, host=host), **kwargs)
+
+
 class TTSClient:
-    def __init__(self, ws_connect_timeout: Union[int, str], app_id: str, api_key: str, api_secret: str):
+    def __init__(self, ws_connect_timeout: Union[int, str], app_id: str, api_key: str, api_secret: str,
+                 session_manager: Optional[SessionManager] = None, vcn: str = DEFAULT_VCN,
+                 speed: int = DEFAULT_SPEED, recorder: Optional[SessionRecorder] = None):
         if isinstance(ws_connect_timeout, str):
             self.ws_connect_timeout = int(ws_connect_timeout)
         else:
@@ -30,10 +39,19 @@ class TTSClient:
         self.app_id = app_id
         self.api_key = api_key
         self.api_secret = api_secret
-        self.thread_loop = None
+        self.vcn = vcn
+        self.speed = speed
         self.is_connected: bool = False
-        self.once_done = False
+        self.ws: Optional[websocket.WebSocketApp] = None
+        self.session_manager: Optional[SessionManager] = session_manager
+        self.session: Optional[Session] = None
+        self.future: Future = Future()
+        self.connect_done = threading.Event()
+        self.first_audio = threading.Event()
         self.callback: Optional[Callable] = None
+        # 可选的会话录制，记下合成的文本和返回的每一帧音频
+        self.recorder = recorder
+        self.record_stream = recorder.stream() if recorder else 0
         self.start_daemon()
 
     def __del__(self):
@@ -41,31 +59,16 @@ class TTSClient:
             self.ws.close()
 
     def start_daemon(self):
-        if not self.thread_loop:
-            self.thread_loop = threading.Thread(target=self.connect, daemon=True)
-            self.thread_loop.start()
+        # 优先使用预热好的连接，握手不在一轮对话的关键路径上
+        if not self.session:
+            if self.session_manager:
+                self.session = self.session_manager.acquire()
+            else:
+                self.session = Session(self.create_url, "tts").start()
+            self.session.bind(self)
 
     def create_url(self) -> str:
-        url = 'wss://tts-api.xfyun.cn/v2/tts'
-        now = datetime.now()
-        date = format_date_time(mktime(now.timetuple()))
-
-        signature_origin = f"host: ws-api.xfyun.cn\n" \
-                           f"date: {date}\n" \
-                           f"GET /v2/tts HTTP/1.1"
-        signature_sha = hmac.new(self.api_secret.encode('utf-8'), signature_origin.encode('utf-8'),
-                                 digestmod=hashlib.sha256).digest()
-        signature_sha = base64.b64encode(signature_sha).decode(encoding='utf-8')
-
-        authorization_origin = f'api_key="{self.api_key}", algorithm="hmac-sha256", headers="host date request-line", signature="{signature_sha}"'
-        authorization = base64.b64encode(authorization_origin.encode('utf-8')).decode(encoding='utf-8')
-
-        v = {
-            "authorization": authorization,
-            "date": date,
-            "host": "ws-api.xfyun.cn"
-        }
-        return url + '?' + urlencode(v)
+        return create_url(TTS_URL, self.api_key, self.api_secret, host="ws-api.xfyun.cn")
 
     def on_message(self, ws: websocket.WebSocketApp, message: str) -> None:
         try:
@@ -77,84 +80,107 @@ class TTSClient:
             audio = message["data"].get("audio", "")
             if audio:
                 audio = base64.b64decode(audio)
-            status = message["data"]["status"]
-
-            if status == 2:
-                logger.info("ws is closed")
-                ws.close()
+            status = message["data"]["status"] if message.get("data") else None
+            if self.recorder and code == 0:
+                self.recorder.tts_frame(self.record_stream, status, audio)
 
             if code != 0:
                 err_msg = message["message"]
                 logger.error(f"sid:{sid} call error:{err_msg} code is:{code}")
-            else:
-                self.once_done = True
-                if self.callback:
-                    self.callback(audio)
+                self._fail(TTSError(f"sid:{sid} code:{code} {err_msg}"))
+                ws.close()
+                return
+
+            self.first_audio.set()
+            if self.callback:
+                self.callback(audio)
+
+            if status == 2:
+                logger.info("ws is closed")
+                self._resolve()
+                ws.close()
         except Exception as e:
             logger.error(f"receive msg, but parse exception: {e}")
+            self._fail(e)
 
     def on_error(self, ws: websocket.WebSocketApp, error: Exception) -> None:
-        logger.error(f"### error ###\n{error}")
+        # 收到最终帧后服务端正常关闭(code 1000)也会走到这里，不算错误
+        if self.future.done():
+            logger.debug(f"### closed after final frame ###\n{error}")
+        else:
+            logger.error(f"### error ###\n{error}")
         self.is_connected = False
-        self.thread_loop = None
         self.ws = None
-        #self.start_daemon()
+        self.connect_done.set()
+        self._fail(TTSError(f"websocket error: {error}"))
 
     def on_close(self, ws: websocket.WebSocketApp, a: Any, b: Any) -> None:
         logger.info(f"### closed ###\na={a}\nb={b}")
         self.is_connected = False
-        self.thread_loop = None
         self.ws = None
-        #self.start_daemon()
+        self.connect_done.set()
+        self._fail(TTSError(f"websocket closed before final frame: {a} {b}"))
 
     def on_open(self, ws: websocket.WebSocketApp) -> None:
         logger.info(f"### connected ###")
         self.is_connected = True
         self.ws = ws
+        self.connect_done.set()
 
-    def connect(self) -> None:
-        websocket.enableTrace(False)
-        ws = websocket.WebSocketApp(self.create_url(),
-                                    on_message=self.on_message,
-                                    on_error=self.on_error,
-                                    on_close=self.on_close,
-                                    on_open=self.on_open)
-        ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
 
-    def send_text(self, text: str, rate: int = 16000) -> None:
-        for i in range(self.ws_connect_timeout):
-            if not self.is_connected:
-                logger.info("WebSocket is not connected, waiting...")
-                time.sleep(1)
-            else:
-                break
+    def _fail(self, error: Exception) -> None:
+        # 出错时也要唤醒等待首帧的调用方
+        self.first_audio.set()
+        if not self.future.done():
+            self.future.set_exception(error)
 
+    def send_text(self, text: str, rate: int = 16000) -> None:
+        # on_open / on_error / on_close 都会唤醒，不再按秒轮询
+        self.connect_done.wait(self.ws_connect_timeout)
         if not self.is_connected:
-            raise Exception("WebSocket is not connected")
+            raise TTSError("WebSocket is not connected")
 
         data = {
             "common": {"app_id": self.app_id},
-            "business": {"aue": "raw", "auf": f"audio/L16;rate={rate}", "vcn": "x4_lingxiaolu_en", "tte": "utf8", "speed": 50},
+            "business": {"aue": "raw", "auf": f"audio/L16;rate={rate}", "vcn": self.vcn, "tte": "utf8",
+                         "speed": self.speed},
             "data": {
                 "status": 2,
                 "text": str(base64.b64encode(text.encode('utf-8')), "UTF8")
             }
         }
+        if self.recorder:
+            self.recorder.tts_request(self.record_stream, text)
         self.ws.send(json.dumps(data))
 
-    def __call__(self, text: str, callback: Callable, rate: int = 16000, timeout: int = 10) -> None:
+    def submit(self, text: str, callback: Callable, rate: int = 16000) -> Future:
+        # 返回在最后一帧音频回调完成后结束的 Future，出错时携带异常
         self.callback = callback
-        self.send_text(text, rate=rate)
+        try:
+            self.send_text(text, rate=rate)
+        except Exception as e:
+            self._fail(e)
+        return self.future
 
-        # 等待 ASR 完成
-        for i in range(int(timeout)):
-            if not self.once_done:
-                time.sleep(1)
-            else:
-                break
+    def __call__(self, text: str, callback: Callable, rate: int = 16000, timeout: int = 10) -> None:
+        future = self.submit(text, callback, rate=rate)
+
+        # timeout 限制首帧音频的等待时间，之后的播放时长取决于文本长度，连接断开时 on_close 会结束等待
+        if not self.first_audio.wait(timeout):
+            self._fail(TTSError(f"no audio received within {timeout}s"))
+            if self.ws:
+                self.ws.close()
+        try:
+            future.result()
+        except Exception as e:
+            logger.error(f"tts request failed: {e}")
 
 
 if __name__ == "__main__":
+    import pyaudio
     from dotenv import load_dotenv
     load_dotenv()
 
@@ -175,11 +201,13 @@ if __name__ == "__main__":
               可提供公有云接口及私有化部署方案。",
              "依托讯飞超脑2030，面向物理世界、数字世界和元宇宙，帮助开发者构建虚实结合、多模态交互、\
               智能运动、模型训练、软硬一体、大小脑协同的实体机器人与虚拟数字人。"]
+    sessions = create_session_manager(os.getenv("tts_api_key"), os.getenv("tts_api_secret")).start()
     for text in texts:
         tts = TTSClient(os.getenv("tts_ws_connect_timeout"),
                         os.getenv("tts_app_id"),
                         os.getenv("tts_api_key"),
-                        os.getenv("tts_api_secret"))
+                        os.getenv("tts_api_secret"),
+                        session_manager=sessions)
         tts(text, audio_play, rate=16000)
         time.sleep(30)
 
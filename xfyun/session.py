@@ -0,0 +1,222 @@
+import logging
+import websocket
+import hashlib
+import base64
+import hmac
+import ssl
+import time
+import threading
+from urllib.parse import urlencode, urlparse
+from wsgiref.handlers import format_date_time
+from datetime import datetime
+from time import mktime
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger()
+
+
+def create_url(url: str, api_key: str, api_secret: str, host: Optional[str] = None) -> str:
+    # 讯飞 WebSocket 接口鉴权：对 host/date/request-line 做 hmac-sha256 签名，date 有效期 300 秒
+    parsed = urlparse(url)
+    host = host or parsed.hostname
+    now: datetime = datetime.now()
+    date: str = format_date_time(mktime(now.timetuple()))
+    signature_origin: str = f"host: {host}\n" \
+                            f"date: {date}\n" \
+                            f"GET {parsed.path} HTTP/1.1"
+    signature_sha: bytes = hmac.new(api_secret.encode('utf-8'), signature_origin.encode('utf-8'),
+                                    digestmod=hashlib.sha256).digest()
+    signature_sha: str = base64.b64encode(signature_sha).decode(encoding='utf-8')
+    authorization_origin: str = f'api_key="{api_key}", algorithm="hmac-sha256", headers="host date request-line", signature="{signature_sha}"'
+    authorization: str = base64.b64encode(authorization_origin.encode('utf-8')).decode(encoding='utf-8')
+
+    v: dict[str, str] = {
+        "authorization": authorization,
+        "date": date,
+        "host": host
+    }
+    return url + '?' + urlencode(v)
+
+
+class Session:
+    # 一条 WebSocket 连接，可以先建好再绑定到 ASRClient/TTSClient 上使用
+    def __init__(self, url_factory: Callable[[], str], name: str = "ws"):
+        self.url_factory = url_factory
+        self.name = name
+        self.ws: Optional[websocket.WebSocketApp] = None
+        self.handler: Any = None
+        self.lock = threading.Lock()
+        self.opened = threading.Event()
+        self.closed = threading.Event()
+        self.created_at = time.monotonic()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> "Session":
+        self.thread = threading.Thread(target=self._run, name=f"{self.name}-session", daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self) -> None:
+        try:
+            # 每次建连都重新签名，date 头不会过期
+            self.ws = websocket.WebSocketApp(self.url_factory(),
+                                             on_message=self._on_message,
+                                             on_error=self._on_error,
+                                             on_close=self._on_close,
+                                             on_open=self._on_open)
+            # 讯飞下发的音频是 base64 放在 JSON 文本帧里，逐字节的 UTF-8 校验是纯 Python 实现，
+            # 很耗 CPU；消息本来就要按 UTF-8 解码再解析 JSON，这里跳过
+            self.ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE}, skip_utf8_validation=True)
+        except Exception as e:
+            logger.error(f"{self.name} session exception: {e}")
+        finally:
+            if not self.closed.is_set():
+                self._on_close(self.ws, None, "run_forever exited")
+
+    def _on_open(self, ws: websocket.WebSocketApp) -> None:
+        with self.lock:
+            self.opened.set()
+            handler = self.handler
+        if handler:
+            handler.on_open(ws)
+
+    def _on_message(self, ws: websocket.WebSocketApp, message: str) -> None:
+        handler = self.handler
+        if handler:
+            handler.on_message(ws, message)
+        else:
+            logger.warning(f"{self.name} session got message before bind: {message[:200]}")
+
+    def _on_error(self, ws: websocket.WebSocketApp, error: Exception) -> None:
+        handler = self.handler
+        if handler:
+            handler.on_error(ws, error)
+        else:
+            logger.info(f"{self.name} idle session error: {error}")
+
+    def _on_close(self, ws: websocket.WebSocketApp, a: Any, b: Any) -> None:
+        with self.lock:
+            if self.closed.is_set():
+                return
+            self.closed.set()
+            handler = self.handler
+        if handler:
+            handler.on_close(ws, a, b)
+
+    def bind(self, handler: Any) -> None:
+        # 绑定时连接可能已经打开或已经断开，补发对应的回调，保证 on_open/on_close 只触发一次
+        with self.lock:
+            self.handler = handler
+            opened = self.opened.is_set()
+            closed = self.closed.is_set()
+        if closed:
+            handler.on_close(self.ws, None, "session closed before bind")
+        elif opened:
+            handler.on_open(self.ws)
+
+    @property
+    def is_alive(self) -> bool:
+        return not self.closed.is_set()
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.created_at
+
+    def close(self) -> None:
+        if self.ws:
+            self.ws.close()
+
+
+class SessionManager:
+    # 预热连接池：保留 pool_size 条已鉴权、已握手的空闲连接，断开或过期就补上。
+    # 讯飞约 10 秒没有数据就关闭空闲连接，被服务端关掉的预热连接不立即重连(否则设备空闲时每 10 秒握手一次)，
+    # 池子进入休眠，等下一次 acquire() 或 warm()(按下按键时)再补；没用上就又被关掉的次数越多，补连前等得越久
+    def __init__(self, name: str, url_factory: Callable[[], str], pool_size: int = 1,
+                 max_age: float = 240, check_period: float = 1.0):
+        self.name = name
+        self.url_factory = url_factory
+        self.pool_size = pool_size
+        self.max_age = max_age
+        self.check_period = check_period
+        self.spares: List[Session] = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.dormant = False
+        self.idle_closes = 0
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> "SessionManager":
+        if not self.thread:
+            self.thread = threading.Thread(target=self._maintain, name=f"{self.name}-session-manager", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.stopped = True
+        self.wakeup.set()
+        with self.lock:
+            spares, self.spares = self.spares, []
+        for session in spares:
+            session.close()
+
+    def warm(self) -> None:
+        # 马上要用连接(例如刚按下按键)：结束休眠，按退避时间补齐空闲连接
+        with self.lock:
+            self.dormant = False
+        self.wakeup.set()
+
+    def _usable(self, session: Session) -> bool:
+        return session.is_alive and session.age < self.max_age
+
+    def acquire(self) -> Session:
+        # 取一条预热好的连接，池子空了才在调用方线程上现建
+        session = None
+        with self.lock:
+            while self.spares:
+                candidate = self.spares.pop(0)
+                if self._usable(candidate):
+                    session = candidate
+                    break
+                candidate.close()
+            # 连接真正被用上了，之前的空闲关闭不再计入退避
+            self.dormant = False
+            self.idle_closes = 0
+        self.wakeup.set()
+        if session is None:
+            logger.info(f"{self.name} session pool empty, connecting on demand")
+            session = Session(self.url_factory, self.name).start()
+        return session
+
+    def _maintain(self) -> None:
+        while not self.stopped:
+            stale = []
+            with self.lock:
+                for session in list(self.spares):
+                    if not self._usable(session):
+                        self.spares.remove(session)
+                        stale.append(session)
+                        # 还没握手成功就断开，说明网络或鉴权有问题，退避重试
+                        if not session.opened.is_set():
+                            self.failures += 1
+                            self.next_attempt = time.monotonic() + min(30.0, 2 ** self.failures)
+                        elif not session.is_alive:
+                            # 握手成功但还没用上就被服务端关掉：空闲超时，休眠到下次要用时再补
+                            self.failures = 0
+                            self.idle_closes += 1
+                            self.dormant = True
+                            self.next_attempt = time.monotonic() + min(30.0, 2 ** self.idle_closes)
+                        else:
+                            self.failures = 0
+                    elif session.opened.is_set():
+                        self.failures = 0
+                missing = self.pool_size - len(self.spares)
+                if missing > 0 and not self.dormant and time.monotonic() >= self.next_attempt:
+                    for i in range(missing):
+                        self.spares.append(Session(self.url_factory, self.name).start())
+            for session in stale:
+                session.close()
+            self.wakeup.wait(self.check_period)
+            self.wakeup.clear()